@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 {
     'name': 'Facturación Electrónica SUNAT - NubeFact',
-    'version': '18.0.1.0.0',
+    'version': '18.0.1.1.0',
     'category': 'Accounting',
     'summary': 'Integración con NubeFact para envío de comprobantes electrónicos a SUNAT',
     'description': """
@@ -17,15 +17,21 @@
         * Descarga de PDF y XML
         * Configuración de credenciales NubeFact
         * Registro de respuestas de SUNAT
+        * Mapeo de unidades de medida al Catálogo 03 de SUNAT
+        * Envío en segundo plano con cola, reintentos y envíos simultáneos
     """,
     'author': 'SSE',
     'depends': ['account'],
     'data': [
         'security/ir.model.access.csv',
         'data/ir_sequence_data.xml',
+        'data/ir_cron_data.xml',
         'views/ir_sequence_views.xml',
         'views/nubefact_config_views.xml',
         'views/account_move_views.xml',
+        'views/nubefact_queue_views.xml',
+        'views/uom_uom_views.xml',
+        'views/nubefact_request_log_views.xml',
     ],
     'installable': True,
     'application': False,
@@ -1,4 +1,8 @@
 # -*- coding: utf-8 -*-
 
 from . import nubefact_config
+from . import nubefact_request_log
 from . import account_move
+from . import nubefact_queue
+from . import uom_uom
+from . import nubefact_series
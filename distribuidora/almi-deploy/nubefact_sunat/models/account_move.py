@@ -3,13 +3,19 @@
 import logging
 import json
 import base64
-import requests
+import time
+from collections import defaultdict
+from datetime import timedelta
 
 from odoo import api, fields, models, _
 from odoo.exceptions import UserError, ValidationError
 
 _logger = logging.getLogger(__name__)
 
+# Consultas automáticas de un comprobante sin respuesta definitiva; la espera
+# entre consultas se duplica cada vez (con 30 min: unos 5 días en total)
+POLL_MAX_ATTEMPTS = 8
+
 
 class AccountMove(models.Model):
     _inherit = 'account.move'
@@ -35,6 +41,36 @@ class AccountMove(models.Model):
         copy=False
     )
     
+    sunat_submitted = fields.Boolean(
+        string='Recibido por NubeFact',
+        copy=False,
+        readonly=True,
+        help='El comprobante llegó o pudo llegar a NubeFact (respuesta recibida o conexión '
+             'cortada durante el envío). Solo estos comprobantes se consultan automáticamente.'
+    )
+    
+    sunat_last_poll = fields.Datetime(
+        string='Última Consulta SUNAT',
+        copy=False,
+        readonly=True,
+        help='Última vez que la consulta automática verificó el estado del comprobante en NubeFact'
+    )
+    
+    sunat_next_poll = fields.Datetime(
+        string='Próxima Consulta SUNAT',
+        copy=False,
+        readonly=True,
+        help='La consulta automática no verifica el comprobante antes de esta fecha'
+    )
+    
+    sunat_poll_count = fields.Integer(
+        string='Consultas SUNAT',
+        default=0,
+        copy=False,
+        readonly=True,
+        help='Consultas automáticas sin respuesta definitiva desde el último envío'
+    )
+    
     sunat_fecha_envio = fields.Datetime(
         string='Fecha de Envío SUNAT',
         readonly=True,
@@ -121,104 +157,57 @@ class AccountMove(models.Model):
     
     def _get_or_create_pe_sequence(self, journal, tipo_doc):
         """Obtiene o crea la secuencia correcta para facturas/boletas peruanas"""
-        if tipo_doc == '6':  # RUC - Factura
-            # Buscar la secuencia de facturas del módulo
-            sequence = self.env['ir.sequence'].search([
-                ('code', '=', 'account.move.invoice.pe'),
-                ('company_id', '=', self.env.company.id)
-            ], limit=1)
-            
-            if not sequence:
-                # Si no existe, buscar por nombre
-                sequence = self.env.ref('nubefact_sunat.sequence_invoice_pe', raise_if_not_found=False)
-            
-            if not sequence:
-                # Crear secuencia de facturas si no existe
-                sequence = self.env['ir.sequence'].sudo().create({
-                    'name': 'Facturas Electrónicas PE',
-                    'code': 'account.move.invoice.pe',
-                    'prefix': 'F001-',
-                    'padding': 6,
-                    'number_increment': 1,
-                    'number_next': 1,
-                    'implementation': 'standard',
-                    'company_id': self.env.company.id,
-                })
-                _logger.info(f"✅ Secuencia de Facturas PE creada: {sequence.name}")
-        else:  # DNI u otros - Boleta
-            # Buscar la secuencia de boletas del módulo
-            sequence = self.env['ir.sequence'].search([
-                ('code', '=', 'account.move.boleta.pe'),
-                ('company_id', '=', self.env.company.id)
-            ], limit=1)
-            
-            if not sequence:
-                # Si no existe, buscar por nombre
-                sequence = self.env.ref('nubefact_sunat.sequence_boleta_pe', raise_if_not_found=False)
-            
-            if not sequence:
-                # Crear secuencia de boletas si no existe
-                sequence = self.env['ir.sequence'].sudo().create({
-                    'name': 'Boletas de Venta PE',
-                    'code': 'account.move.boleta.pe',
-                    'prefix': 'B001-',
-                    'padding': 6,
-                    'number_increment': 1,
-                    'number_next': 1,
-                    'implementation': 'standard',
-                    'company_id': self.env.company.id,
-                })
-                _logger.info(f"✅ Secuencia de Boletas PE creada: {sequence.name}")
-        
-        return sequence
+        allocator = self.env['nubefact.series.allocator']
+        return allocator._get_sequence(self.env.company, allocator._get_serie_type(tipo_doc))
     
     @api.model_create_multi
     def create(self, vals_list):
         """Override para asignar el diario y secuencia correcta según el tipo de cliente"""
-        for vals in vals_list:
-            # Solo aplicar para facturas de venta nuevas
-            if vals.get('move_type') in ['out_invoice', 'out_refund'] and vals.get('partner_id'):
-                # Obtener el partner
-                partner = self.env['res.partner'].browse(vals['partner_id'])
-                
-                # Solo para compañías peruanas
-                if self.env.company.country_code == 'PE':
-                    # Determinar tipo de documento
-                    tipo_doc = self._get_tipo_documento_identidad(partner)
-                    
-                    # Buscar el diario apropiado solo si no se especificó uno
-                    if not vals.get('journal_id'):
-                        if tipo_doc == '6':  # RUC - Factura
-                            journal = self.env['account.journal'].search([
-                                ('name', '=', 'Factura'),
-                                ('type', '=', 'sale'),
-                                ('company_id', '=', self.env.company.id)
-                            ], limit=1)
-                        else:  # DNI u otros - Boleta
-                            journal = self.env['account.journal'].search([
-                                ('name', '=', 'Boleta'),
-                                ('type', '=', 'sale'),
-                                ('company_id', '=', self.env.company.id)
-                            ], limit=1)
-                        
-                        if journal:
-                            vals['journal_id'] = journal.id
-                    
-                    # Asignar el nombre de factura usando la secuencia correcta del módulo nubefact
-                    # Solo si no tiene nombre o tiene el nombre temporal '/'
-                    if not vals.get('name') or vals.get('name') == '/':
-                        journal_id = vals.get('journal_id')
-                        if journal_id:
-                            journal = self.env['account.journal'].browse(journal_id)
-                            # Obtener o crear la secuencia correcta
-                            sequence = self._get_or_create_pe_sequence(journal, tipo_doc)
-                            
-                            # Generar el siguiente número usando la secuencia
-                            vals['name'] = sequence.next_by_id()
-                            _logger.info(f"✅ Asignado número de factura: {vals['name']} usando secuencia {sequence.name}")
+        # Solo para compañías peruanas y facturas de venta nuevas
+        if self.env.company.country_code == 'PE':
+            sale_vals = [
+                vals for vals in vals_list
+                if vals.get('move_type') in ['out_invoice', 'out_refund'] and vals.get('partner_id')
+            ]
+            if sale_vals:
+                self._assign_pe_series(sale_vals)
         
         return super().create(vals_list)
     
+    def _assign_pe_series(self, vals_list):
+        """
+        Asigna diario y número de la serie electrónica a un lote de valores.
+        Los números de cada serie se reservan juntos, con una sola consulta.
+        """
+        company = self.env.company
+        allocator = self.env['nubefact.series.allocator']
+        partners = self.env['res.partner'].browse({vals['partner_id'] for vals in vals_list})
+        tipo_docs = {partner.id: self._get_tipo_documento_identidad(partner) for partner in partners}
+        
+        to_name = defaultdict(list)
+        for vals in vals_list:
+            serie_type = allocator._get_serie_type(tipo_docs[vals['partner_id']])
+            
+            # Buscar el diario apropiado solo si no se especificó uno
+            if not vals.get('journal_id'):
+                journal_id = allocator._get_journal_id(company, serie_type)
+                if journal_id:
+                    vals['journal_id'] = journal_id
+            
+            # Asignar el nombre usando la secuencia correcta del módulo nubefact
+            # Solo si no tiene nombre o tiene el nombre temporal '/'
+            if vals.get('journal_id') and (not vals.get('name') or vals.get('name') == '/'):
+                to_name[serie_type].append(vals)
+        
+        for serie_type, serie_vals in to_name.items():
+            names = allocator._reserve_names(company, serie_type, len(serie_vals))
+            for vals, name in zip(serie_vals, names):
+                vals['name'] = name
+            _logger.info(
+                f"✅ Asignados {len(names)} números de {'factura' if serie_type == 'invoice' else 'boleta'}: {names[0]}"
+                + (f" a {names[-1]}" if len(names) > 1 else "")
+            )
+    
     def _get_tipo_documento_identidad(self, partner):
         """Mapea el tipo de documento de identidad para SUNAT"""
         # Verificar si existe el campo de localización latam
@@ -271,84 +260,70 @@ class AccountMove(models.Model):
     
     def _get_sunat_uom_code(self, uom):
         """
-        Mapea la unidad de medida de Odoo al código SUNAT (Catálogo 03)
+        Retorna el código SUNAT (Catálogo 03) de la unidad de medida,
+        desde el mapeo guardado en las unidades (cacheado por registro)
         """
         if not uom:
             return 'NIU'
         
-        # Mapeo de unidades comunes
-        uom_map = {
-            # Unidades
-            'unit': 'NIU',
-            'unidad': 'NIU',
-            'unidades': 'NIU',
-            'units': 'NIU',
-            'u': 'NIU',
-            
-            # Peso
-            'kg': 'KGM',
-            'kilogramo': 'KGM',
-            'kilogramos': 'KGM',
-            'g': 'GRM',
-            'gramo': 'GRM',
-            'gramos': 'GRM',
-            'ton': 'TNE',
-            'tonelada': 'TNE',
-            'lb': 'LBR',
-            'libra': 'LBR',
-            
-            # Longitud
-            'm': 'MTR',
-            'metro': 'MTR',
-            'metros': 'MTR',
-            'cm': 'CMT',
-            'centimetro': 'CMT',
-            'centimetros': 'CMT',
-            'mm': 'MMT',
-            'milimetro': 'MMT',
-            'milimetros': 'MMT',
-            
-            # Volumen
-            'l': 'LTR',
-            'litro': 'LTR',
-            'litros': 'LTR',
-            'ml': 'MLT',
-            'mililitro': 'MLT',
-            'mililitros': 'MLT',
-            'gal': 'GLL',
-            'galon': 'GLL',
-            
-            # Cantidad
-            'docena': 'DZN',
-            'docenas': 'DZN',
-            'caja': 'BX',
-            'cajas': 'BX',
-            'paquete': 'PK',
-            'paquetes': 'PK',
-            'pack': 'PK',
-            'bolsa': 'BG',
-            'bolsas': 'BG',
-            
-            # Servicios
-            'servicio': 'ZZ',
-            'servicios': 'ZZ',
-            'hora': 'HUR',
-            'horas': 'HUR',
-            'dia': 'DAY',
-            'dias': 'DAY',
-            'mes': 'MON',
-            'meses': 'MON',
-        }
-        
-        # Normalizar el nombre de la unidad
-        uom_name = uom.name.lower().strip()
-        
-        # Buscar en el mapeo
-        return uom_map.get(uom_name, 'NIU')  # Por defecto NIU si no se encuentra
+        code = self.env['uom.uom']._get_sunat_code_map().get(uom.id)
+        if not code:
+            _logger.warning(f"⚠️ La unidad de medida '{uom.name}' no tiene código SUNAT, se envía como NIU")
+            return 'NIU'
+        return code
     
     def _prepare_nubefact_invoice_data(self):
         """Prepara los datos de la factura para enviar a NubeFact"""
         self.ensure_one()
+        payloads, errors = self._prepare_nubefact_invoice_payloads()
+        if self.id in errors:
+            raise UserError(errors[self.id])
+        return payloads[self.id]
+    
+    def _prepare_nubefact_invoice_payloads(self):
+        """
+        Prepara los datos de NubeFact de varios comprobantes a la vez.
+        Las líneas, productos, impuestos y clientes de todos los comprobantes
+        se leen en pocas consultas antes de construir los payloads.
+        
+        Returns:
+            (payloads, errors): dicts {id del comprobante: payload} y
+            {id del comprobante: mensaje de error} para los que no se pueden enviar
+        """
+        # Leer todas las líneas de producto de los comprobantes en una consulta
+        lines = self.env['account.move.line'].search_fetch([
+            ('move_id', 'in', self.ids),
+            ('display_type', '=', 'product'),
+        ], [
+            'move_id', 'name', 'quantity', 'price_unit', 'discount',
+            'price_subtotal', 'price_total', 'tax_ids', 'product_id', 'product_uom_id',
+        ], order='move_id, id')
+        lines.product_id.fetch(['default_code'])
+        self.partner_id.fetch(['vat', 'name', 'street', 'email'])
+        uom_codes = self.env['uom.uom']._get_sunat_code_map()
+        
+        lines_by_move = defaultdict(list)
+        for line in lines:
+            lines_by_move[line.move_id.id].append(line)
+        
+        payloads = {}
+        errors = {}
+        for move in self:
+            try:
+                payloads[move.id] = move._build_nubefact_invoice_payload(lines_by_move[move.id], uom_codes)
+            except UserError as e:
+                errors[move.id] = str(e)
+        return payloads, errors
+    
+    def _build_nubefact_invoice_payload(self, product_lines, uom_codes):
+        """
+        Construye el payload de NubeFact del comprobante.
+        
+        Args:
+            product_lines: líneas de producto del comprobante, ya leídas
+            uom_codes: mapeo {id de unidad: código SUNAT}
+        """
+        self.ensure_one()
         
         # Validaciones
         if not self.partner_id:
@@ -358,7 +333,6 @@ class AccountMove(models.Model):
             raise UserError(_('El cliente debe tener un número de documento (RUC/DNI).'))
         
         # Validar que haya líneas de producto
-        product_lines = self.invoice_line_ids.filtered(lambda l: l.display_type == 'product')
         if not product_lines:
             raise UserError(_('La factura debe tener al menos un producto o servicio.'))
         
@@ -369,57 +343,48 @@ class AccountMove(models.Model):
         total_gratuita = 0.0
         total_igv = 0.0
         
-        for line in self.invoice_line_ids.filtered(lambda l: l.display_type == 'product'):
-            # Verificar si es gratuito (precio unitario = 0)
-            if line.price_unit == 0:
-                total_gratuita += line.price_subtotal
-                continue
-            
-            # Usar totales que Odoo ya calculó
-            total_taxes = line.price_total - line.price_subtotal
-            
-            # Determinar tipo de línea
-            if not line.tax_ids:
-                total_inafecta += line.price_subtotal
-            elif total_taxes > 0.01:
-                total_gravada += line.price_subtotal
-                total_igv += total_taxes
-            else:
-                total_exonerada += line.price_subtotal
-        
         total = self.amount_total
         
-        # Preparar items
+        # Preparar items (y totales en la misma pasada)
         items = []
-        for idx, line in enumerate(self.invoice_line_ids.filtered(lambda l: l.display_type == 'product'), start=1):
+        for line in product_lines:
             # Usar totales que Odoo ya calculó
             igv_linea = line.price_total - line.price_subtotal
             
             # Determinar el tipo de afectación del IGV según NubeFact
             if line.price_unit == 0:
                 # Gratuito
+                total_gratuita += line.price_subtotal
                 tipo_de_igv = 11  # Gravada - Retiro por premio
                 igv_value = "0"
                 precio_unitario = line.price_unit
             elif not line.tax_ids:
                 # Inafecto - Sin impuestos
+                total_inafecta += line.price_subtotal
                 tipo_de_igv = 9  # Inafecto - Operación Onerosa
                 igv_value = "0"
                 precio_unitario = line.price_unit
             elif igv_linea > 0.01:
                 # Gravado - Con IGV
+                total_gravada += line.price_subtotal
+                total_igv += igv_linea
                 tipo_de_igv = 1  # Gravado - Operación Onerosa
                 igv_value = round(igv_linea, 2)
                 # precio_unitario = valor_unitario + IGV
                 precio_unitario = line.price_total / line.quantity if line.quantity > 0 else line.price_unit
             else:
                 # Exonerado - Tiene tax_ids pero IGV = 0
+                total_exonerada += line.price_subtotal
                 tipo_de_igv = 8  # Exonerado - Operación Onerosa
                 igv_value = "0"
                 precio_unitario = line.price_unit  # Sin IGV
             
+            uom_code = uom_codes.get(line.product_uom_id.id)
+            if not uom_code:
+                uom_code = self._get_sunat_uom_code(line.product_uom_id)
+            
             item = {
-                "unidad_de_medida": self._get_sunat_uom_code(line.product_uom_id),
+                "unidad_de_medida": uom_code,
                 "codigo": line.product_id.default_code or str(line.product_id.id),
                 "descripcion": line.name[:250],  # Máximo 250 caracteres
                 "cantidad": round(line.quantity, 10),
@@ -515,39 +480,100 @@ class AccountMove(models.Model):
         return data
     
     def action_send_to_sunat_massive(self):
-        """Acción para enviar múltiples comprobantes a SUNAT"""
-        # Enviar cada factura seleccionada
+        """
+        Acción para enviar múltiples comprobantes a SUNAT.
+        Los payloads se preparan primero y luego se envían en paralelo
+        (según los envíos simultáneos de la configuración). Los resultados
+        se guardan por lotes para no perder lo ya aceptado si la petición
+        se interrumpe.
+        """
         success_count = 0
         error_count = 0
         errors = []
+        latencies = []
         
+        # Validaciones básicas
+        to_send = self.browse()
         for record in self:
-            try:
-                # Validaciones básicas
-                if record.state != 'posted':
-                    errors.append(f"{record.name}: No está confirmada")
-                    error_count += 1
-                    continue
+            if record.state != 'posted':
+                errors.append(f"{record.name}: No está confirmada")
+                error_count += 1
+            elif record.sunat_enviado and record.sunat_estado == 'accepted':
+                errors.append(f"{record.name}: Ya fue aceptada por SUNAT")
+                error_count += 1
+            else:
+                to_send |= record
+        
+        start = time.monotonic()
+        
+        for company in to_send.company_id:
+            moves = to_send.filtered(lambda m: m.company_id == company)
+            config = self.env['nubefact.config']._get_active_config(company)
+            if not config:
+                for move in moves:
+                    errors.append(f"{move.name}: No se ha configurado la conexión con NubeFact")
+                error_count += len(moves)
+                continue
+            
+            batch_size = config.queue_batch_size or 50
+            for i in range(0, len(moves), batch_size):
+                batch = moves[i:i + batch_size]
                 
-                if record.sunat_enviado and record.sunat_estado == 'accepted':
-                    errors.append(f"{record.name}: Ya fue aceptada por SUNAT")
-                    error_count += 1
-                    continue
+                # 1. Preparar todos los payloads del lote
+                batch_to_send = self.browse()
+                payloads = []
+                prepared, prepare_errors = batch._prepare_nubefact_invoice_payloads()
+                for move in batch:
+                    if move.id in prepare_errors:
+                        move.write({
+                            'sunat_estado': 'error',
+                            'sunat_error_message': prepare_errors[move.id],
+                        })
+                        errors.append(f"{move.name}: {prepare_errors[move.id]}")
+                        error_count += 1
+                    else:
+                        payloads.append(prepared[move.id])
+                        batch_to_send |= move
                 
-                # Intentar enviar
-                record.action_send_to_sunat()
-                success_count += 1
+                # 2. Enviar en paralelo
+                results = config._send_payloads(payloads)
                 
-            except Exception as e:
-                errors.append(f"{record.name}: {str(e)}")
-                error_count += 1
+                # 3. Registrar resultados
+                for move, result in zip(batch_to_send, results):
+                    latencies.append((result['elapsed'], move.name))
+                    outcome = move._nubefact_apply_response(result)
+                    if outcome == 'accepted':
+                        success_count += 1
+                    else:
+                        errors.append(f"{move.name}: {move.sunat_error_message or result['error']}")
+                        error_count += 1
+                
+                # Guardar el lote antes de continuar con el siguiente
+                self.env.cr.commit()
+                _logger.info(f"📦 Envío masivo: lote de {len(batch)} comprobantes guardado ({i + len(batch)}/{len(moves)})")
+        
+        elapsed = time.monotonic() - start
         
         # Mostrar resultado
         message = f"✅ Enviadas: {success_count}"
         if error_count > 0:
             message += f"\n❌ Errores: {error_count}"
-            if errors:
-                message += "\n\nDetalles:\n" + "\n".join(errors[:10])  # Mostrar máximo 10 errores
+        
+        if latencies:
+            times = [latency for latency, name in latencies]
+            message += (
+                f"\n\n⏱️ Tiempo total: {elapsed:.1f} s"
+                f" ({len(latencies) / elapsed if elapsed else 0:.1f} comprobantes/s)"
+                f"\nLatencia por comprobante: promedio {sum(times) / len(times):.2f} s,"
+                f" máxima {max(times):.2f} s"
+            )
+            slowest = sorted(latencies, reverse=True)[:10]  # Mostrar máximo 10 comprobantes
+            message += "\n\nMás lentos:\n" + "\n".join(
+                f"{name}: {latency:.2f} s" for latency, name in slowest
+            )
+        
+        if errors:
+            message += "\n\nDetalles:\n" + "\n".join(errors[:10])  # Mostrar máximo 10 errores
         
         return {
             'type': 'ir.actions.client',
@@ -562,64 +588,73 @@ class AccountMove(models.Model):
     
     def write(self, vals):
         """Override write para enviar automáticamente a SUNAT cuando se paga"""
+        track_payment = 'payment_state' in vals or 'amount_residual' in vals
+        
         # Guardar estados previos de pago
-        old_payment_states = {record.id: record.payment_state for record in self}
+        old_payment_states = {record.id: record.payment_state for record in self} if track_payment else {}
         
         # Llamar al write original
         result = super(AccountMove, self).write(vals)
         
         # Detectar cambios en el estado de pago
-        if 'payment_state' in vals or 'amount_residual' in vals:
-            for record in self:
-                old_state = old_payment_states.get(record.id)
-                # Si cambió a "pagado" o "en proceso de pago"
-                if old_state != 'paid' and record.payment_state == 'paid':
-                    # Enviar automáticamente a SUNAT
-                    record._auto_send_to_sunat_on_payment()
+        if track_payment:
+            # Si cambió a "pagado"
+            paid = self.filtered(
+                lambda r: old_payment_states.get(r.id) != 'paid' and r.payment_state == 'paid'
+            )
+            if paid:
+                # Enviar automáticamente a SUNAT
+                paid._auto_send_to_sunat_on_payment()
         
         return result
     
     def _auto_send_to_sunat_on_payment(self):
-        """Envío automático a SUNAT cuando se registra el pago (1 intento)"""
-        self.ensure_one()
-        
-        # Solo para compañías peruanas
-        if self.company_id.country_code != 'PE':
-            return
-        
-        # Solo para facturas y boletas de venta
-        if self.move_type not in ['out_invoice', 'out_refund']:
-            return
-        
-        # Solo si está confirmada
-        if self.state != 'posted':
+        """
+        Envío automático a SUNAT cuando se registra el pago.
+        Los comprobantes se agregan a la cola de envío al confirmar la
+        transacción del pago y se envían en segundo plano, por lo que el
+        registro del pago no depende de NubeFact.
+        """
+        to_send = self.filtered(
+            # Solo facturas y boletas de venta confirmadas, de compañías peruanas, no enviadas antes
+            lambda m: m.company_id.country_code == 'PE'
+            and m.move_type in ['out_invoice', 'out_refund']
+            and m.state == 'posted'
+            and not m.sunat_enviado
+        )
+        if not to_send:
             return
         
-        # Solo si NO ha sido enviada antes
-        if self.sunat_enviado:
+        # Se acumulan los comprobantes de toda la transacción y se encolan juntos
+        pending_ids = self.env.cr.precommit.data.setdefault('nubefact_sunat.auto_send_ids', set())
+        if not pending_ids:
+            self.env.cr.precommit.add(self._enqueue_auto_send_to_sunat)
+        pending_ids.update(to_send.ids)
+    
+    def _enqueue_auto_send_to_sunat(self):
+        """Encola en un solo lote los comprobantes pagados en la transacción"""
+        move_ids = self.env.cr.precommit.data.pop('nubefact_sunat.auto_send_ids', set())
+        moves = self.env['account.move'].sudo().browse(move_ids).exists().filtered(
+            lambda m: m.state == 'posted' and not m.sunat_enviado
+        )
+        if not moves:
             return
         
-        # Verificar que haya configuración de NubeFact
-        config = self.env['nubefact.config'].search([
-            ('company_id', '=', self.company_id.id),
+        # Verificar que haya configuración de NubeFact (una búsqueda para todas las compañías)
+        configs = self.env['nubefact.config'].sudo().search([
+            ('company_id', 'in', moves.company_id.ids),
             ('active', '=', True)
-        ], limit=1)
-        
-        if not config:
-            _logger.warning(f"No hay configuración de NubeFact para enviar automáticamente {self.name}")
-            return
+        ])
+        without_config = moves.filtered(lambda m: m.company_id not in configs.company_id)
+        if without_config:
+            _logger.warning(
+                f"No hay configuración de NubeFact para enviar automáticamente: "
+                f"{', '.join(without_config.mapped('name'))}"
+            )
         
-        # Intentar enviar (1 solo intento, sin lanzar error)
-        try:
-            _logger.info(f"🤖 Enviando automáticamente a SUNAT: {self.name}")
-            self.action_send_to_sunat()
-        except Exception as e:
-            # Registrar el error pero no fallar el pago
-            _logger.error(f"Error al enviar automáticamente {self.name} a SUNAT: {str(e)}")
-            self.sudo().write({
-                'sunat_estado': 'error',
-                'sunat_error_message': f"Error en envío automático: {str(e)}"
-            })
+        jobs = self.env['nubefact.queue'].sudo()._enqueue(moves - without_config, origin='payment')
+        jobs.flush_recordset()
+        _logger.info(f"🤖 {len(jobs)} comprobantes pagados agregados a la cola de envío a SUNAT")
     
     def action_send_to_sunat(self):
         """Acción para enviar el comprobante a SUNAT mediante NubeFact"""
@@ -633,10 +668,7 @@ class AccountMove(models.Model):
             raise UserError(_('Este comprobante ya fue aceptado por SUNAT. Use "Consultar en SUNAT" para actualizar la información.'))
         
         # Obtener configuración de NubeFact
-        config = self.env['nubefact.config'].search([
-            ('company_id', '=', self.company_id.id),
-            ('active', '=', True)
-        ], limit=1)
+        config = self.env['nubefact.config']._get_active_config(self.company_id)
         
         if not config:
             raise UserError(_('No se ha configurado la conexión con NubeFact. '
@@ -646,95 +678,48 @@ class AccountMove(models.Model):
             # Preparar datos según documentación de NubeFact
             invoice_data = self._prepare_nubefact_invoice_data()
             
-            # URL de la API de NubeFact (ya incluye el endpoint completo)
-            url = config.get_api_url()
-            
-            # Headers según documentación oficial de NubeFact
-            # Authorization solo contiene el token, sin prefijo
-            headers = {
-                'Authorization': config.token,
-                'Content-Type': 'application/json'
-            }
-            
             _logger.info(f"📤 Enviando factura {self.name} a NubeFact")
-            _logger.info(f"URL: {url}")
-            _logger.info(f"📋 Datos completos enviados a NubeFact:\n{json.dumps(invoice_data, indent=2, ensure_ascii=False)}")
             
             # Realizar petición POST a NubeFact
-            response = requests.post(
-                url,
-                headers=headers,
-                json=invoice_data,
-                timeout=30
-            )
+            result = config._send_payload(invoice_data)
             
-            _logger.info(f"Respuesta de NubeFact: Status {response.status_code}, Body: {response.text}")
+            _logger.info(f"Respuesta de NubeFact: Status {result['status_code']} en {result['elapsed']:.2f} s")
             
-            # Procesar respuesta
-            if response.status_code == 200:
-                response_data = response.json()
-                
-                # Actualizar campos
-                self.write({
-                    'sunat_enviado': True,
-                    'sunat_fecha_envio': fields.Datetime.now(),
-                    'sunat_response': json.dumps(response_data, indent=2),
-                })
-                
-                # Verificar si SUNAT aceptó el comprobante
-                if response_data.get('aceptada_por_sunat'):
-                    self.write({
-                        'sunat_estado': 'accepted',
-                        'sunat_enlace_pdf': response_data.get('enlace_del_pdf', ''),
-                        'sunat_enlace_xml': response_data.get('enlace_del_xml', ''),
-                        'sunat_enlace_cdr': response_data.get('enlace_del_cdr', ''),
-                        'sunat_codigo_hash': response_data.get('codigo_hash', ''),
-                        'sunat_numero_ticket': response_data.get('numero_ticket', ''),
-                    })
-                    
-                    return {
-                        'type': 'ir.actions.client',
-                        'tag': 'display_notification',
-                        'params': {
-                            'title': _('Éxito'),
-                            'message': _('El comprobante fue aceptado por SUNAT correctamente.'),
-                            'type': 'success',
-                            'sticky': False,
-                        }
+            if result['status_code'] is None:
+                # Error de conexión o timeout
+                raise UserError(result['error'])
+            
+            outcome = self._nubefact_apply_response(result)
+            
+            if outcome == 'accepted':
+                return {
+                    'type': 'ir.actions.client',
+                    'tag': 'display_notification',
+                    'params': {
+                        'title': _('Éxito'),
+                        'message': _('El comprobante fue aceptado por SUNAT correctamente.'),
+                        'type': 'success',
+                        'sticky': False,
                     }
-                else:
-                    # SUNAT rechazó el comprobante
-                    error_msg = response_data.get('sunat_description', '') or response_data.get('errors', '')
-                    self.write({
-                        'sunat_estado': 'rejected',
-                        'sunat_error_message': error_msg,
-                    })
-                    
-                    return {
-                        'type': 'ir.actions.client',
-                        'tag': 'display_notification',
-                        'params': {
-                            'title': _('Rechazado por SUNAT'),
-                            'message': f"{_('El comprobante fue rechazado')}: {error_msg}",
-                            'type': 'warning',
-                            'sticky': True,
-                        }
+                }
+            elif outcome == 'rejected':
+                return {
+                    'type': 'ir.actions.client',
+                    'tag': 'display_notification',
+                    'params': {
+                        'title': _('Rechazado por SUNAT'),
+                        'message': f"{_('El comprobante fue rechazado')}: {self.sunat_error_message}",
+                        'type': 'warning',
+                        'sticky': True,
                     }
+                }
             else:
-                # Error en la API
-                error_msg = response.text
-                self.write({
-                    'sunat_estado': 'error',
-                    'sunat_error_message': error_msg,
-                    'sunat_response': error_msg,
-                })
-                
                 return {
                     'type': 'ir.actions.client',
                     'tag': 'display_notification',
                     'params': {
                         'title': _('Error'),
-                        'message': f"{_('Error al enviar a NubeFact')}: {error_msg}",
+                        'message': f"{_('Error al enviar a NubeFact')}: {result['error']}",
                         'type': 'danger',
                         'sticky': True,
                     }
@@ -749,6 +734,212 @@ class AccountMove(models.Model):
             
             raise UserError(_('Error al enviar a SUNAT: %s') % str(e))
     
+    def _nubefact_apply_response(self, result):
+        """
+        Registra en el comprobante la respuesta de NubeFact a un envío.
+        
+        Args:
+            result: respuesta normalizada de nubefact.config._send_payload
+        
+        Returns:
+            'accepted', 'rejected' o 'error'
+        """
+        self.ensure_one()
+        
+        # Un nuevo envío reinicia la consulta automática
+        poll_vals = {
+            'sunat_poll_count': 0,
+            'sunat_next_poll': False,
+        }
+        
+        if result['error']:
+            # Error en la API o en la conexión. Si fue temporal (corte, timeout,
+            # error del servidor) o la respuesta 200 no se pudo leer, NubeFact
+            # pudo haberlo registrado: se consulta luego
+            error_msg = result['error']
+            self.write(dict(
+                poll_vals,
+                sunat_estado='error',
+                sunat_error_message=error_msg,
+                sunat_response=result['text'] or error_msg,
+                sunat_submitted=self.sunat_submitted or bool(result['transient'] or result['status_code'] == 200),
+            ))
+            return 'error'
+        
+        response_data = result['data']
+        
+        # Actualizar campos
+        vals = {
+            **poll_vals,
+            'sunat_submitted': True,
+            'sunat_enviado': True,
+            'sunat_fecha_envio': fields.Datetime.now(),
+            'sunat_response': json.dumps(response_data, indent=2),
+        }
+        
+        # Verificar si SUNAT aceptó el comprobante
+        if response_data.get('aceptada_por_sunat'):
+            vals.update({
+                'sunat_estado': 'accepted',
+                'sunat_enlace_pdf': response_data.get('enlace_del_pdf', ''),
+                'sunat_enlace_xml': response_data.get('enlace_del_xml', ''),
+                'sunat_enlace_cdr': response_data.get('enlace_del_cdr', ''),
+                'sunat_codigo_hash': response_data.get('codigo_hash', ''),
+                'sunat_numero_ticket': response_data.get('numero_ticket', ''),
+            })
+            self.write(vals)
+            return 'accepted'
+        
+        # SUNAT rechazó el comprobante
+        vals.update({
+            'sunat_estado': 'rejected',
+            'sunat_error_message': response_data.get('sunat_description', '') or response_data.get('errors', ''),
+        })
+        self.write(vals)
+        return 'rejected'
+    
+    def action_send_to_sunat_queue(self):
+        """Agrega los comprobantes a la cola de envío en segundo plano"""
+        to_send = self.filtered(
+            lambda m: m.state == 'posted'
+            and m.move_type in ['out_invoice', 'out_refund']
+            and m.sunat_estado != 'accepted'
+        )
+        jobs = self.env['nubefact.queue']._enqueue(to_send, origin='manual')
+        skipped = len(self) - len(jobs)
+        
+        message = _('%s comprobante(s) agregados a la cola de envío.') % len(jobs)
+        if skipped:
+            message += '\n' + _('%s omitido(s): no confirmados, ya aceptados o ya en cola.') % skipped
+        
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Envío a SUNAT en Segundo Plano'),
+                'message': message,
+                'type': 'success' if not skipped else 'warning',
+                'sticky': False,
+            }
+        }
+    
+    def _prepare_nubefact_query_data(self):
+        """Prepara los datos para consultar el comprobante en NubeFact"""
+        self.ensure_one()
+        
+        # Validar serie y número
+        if not self.serie_comprobante:
+            raise UserError(_('No se pudo determinar la serie del comprobante.'))
+        
+        if not self.numero_comprobante:
+            raise UserError(_('No se pudo determinar el número del comprobante.'))
+        
+        # Limpiar el número de comprobante
+        numero_limpio = self.numero_comprobante.lstrip('0') or '1'
+        try:
+            numero = int(numero_limpio)
+        except ValueError:
+            raise UserError(_('El número de comprobante "%s" no es válido.') % self.numero_comprobante)
+        
+        # Preparar datos de consulta según documentación
+        return {
+            "operacion": "consultar_comprobante",
+            "tipo_de_comprobante": self._get_tipo_comprobante(),
+            "serie": self.serie_comprobante,
+            "numero": numero
+        }
+    
+    def _nubefact_apply_query_response(self, response_data):
+        """
+        Actualiza el comprobante con la respuesta de una consulta a NubeFact.
+        
+        Returns:
+            True si el documento existe en NubeFact, False si no se encontró
+        """
+        self.ensure_one()
+        if response_data.get('errors'):
+            return False
+        
+        # Actualizar campos con la información de NubeFact
+        self.write({
+            'sunat_enviado': True,
+            'sunat_estado': 'accepted' if response_data.get('aceptada_por_sunat') else 'rejected',
+            'sunat_enlace_pdf': response_data.get('enlace_del_pdf', ''),
+            'sunat_enlace_xml': response_data.get('enlace_del_xml', ''),
+            'sunat_enlace_cdr': response_data.get('enlace_del_cdr', ''),
+            'sunat_codigo_hash': response_data.get('codigo_hash', ''),
+            'sunat_response': json.dumps(response_data, indent=2),
+        })
+        return True
+    
+    @api.model
+    def _cron_poll_sunat_status(self):
+        """
+        Cron: consulta en NubeFact el estado de los comprobantes que llegaron
+        (o pudieron llegar) a NubeFact sin respuesta definitiva, en lotes
+        paralelos y con límite de peticiones por segundo. La espera entre
+        consultas de un mismo comprobante se duplica cada vez, hasta
+        POLL_MAX_ATTEMPTS consultas.
+        """
+        configs = self.env['nubefact.config'].search([('active', '=', True)])
+        resolved = 0
+        polled = 0
+        
+        for config in configs:
+            now = fields.Datetime.now()
+            moves = self.search([
+                ('company_id', '=', config.company_id.id),
+                ('state', '=', 'posted'),
+                ('move_type', 'in', ['out_invoice', 'out_refund']),
+                ('sunat_estado', 'in', ['sent', 'error']),
+                ('sunat_submitted', '=', True),
+                ('sunat_poll_count', '<', POLL_MAX_ATTEMPTS),
+                '|', ('sunat_next_poll', '=', False), ('sunat_next_poll', '<=', now),
+            ], limit=config.poll_batch_size or 100, order='sunat_next_poll asc nulls first, id')
+            
+            # Los comprobantes en cola se resuelven al enviarse
+            queued = self.env['nubefact.queue'].search([
+                ('move_id', 'in', moves.ids),
+                ('state', '=', 'pending'),
+            ])
+            moves -= queued.move_id
+            if not moves:
+                continue
+            
+            # 1. Preparar consultas (acceso al ORM, en el hilo principal)
+            to_query = self.browse()
+            payloads = []
+            for move in moves:
+                try:
+                    payloads.append(move._prepare_nubefact_query_data())
+                    to_query |= move
+                except UserError as e:
+                    _logger.warning(f"No se puede consultar {move.name} en NubeFact: {str(e)}")
+            
+            # 2. Consultar en paralelo, con límite de peticiones por segundo
+            results = config._send_payloads(payloads, rate_limit=config.poll_rate_limit)
+            
+            # 3. Registrar resultados
+            for move, result in zip(to_query, results):
+                if not result['error'] and move._nubefact_apply_query_response(result['data']):
+                    resolved += 1
+            
+            # 4. Reprogramar los no resueltos con espera creciente
+            now = fields.Datetime.now()
+            moves.write({'sunat_last_poll': now})
+            pending = moves.filtered(lambda m: m.sunat_estado in ('sent', 'error'))
+            for count, count_moves in pending.grouped('sunat_poll_count').items():
+                delay = (config.poll_interval or 30) * 2 ** count
+                count_moves.write({
+                    'sunat_poll_count': count + 1,
+                    'sunat_next_poll': now + timedelta(minutes=delay),
+                })
+            polled += len(moves)
+            self.env.cr.commit()
+        
+        _logger.info(f"🔄 Consulta automática SUNAT: {resolved} de {polled} comprobantes resueltos")
+        return resolved
+    
     def action_consultar_sunat(self):
         """Consulta el estado de un comprobante en NubeFact/SUNAT"""
         self.ensure_one()
@@ -767,66 +958,25 @@ class AccountMove(models.Model):
             raise UserError(_('No se ha configurado la conexión con NubeFact.'))
         
         try:
-            # Validar serie y número
-            if not self.serie_comprobante:
-                raise UserError(_('No se pudo determinar la serie del comprobante.'))
-            
-            if not self.numero_comprobante:
-                raise UserError(_('No se pudo determinar el número del comprobante.'))
-            
-            # Limpiar el número de comprobante
-            numero_limpio = self.numero_comprobante.lstrip('0') or '1'
-            try:
-                numero = int(numero_limpio)
-            except ValueError:
-                raise UserError(_('El número de comprobante "%s" no es válido.') % self.numero_comprobante)
-            
-            # Preparar datos de consulta según documentación
-            consulta_data = {
-                "operacion": "consultar_comprobante",
-                "tipo_de_comprobante": self._get_tipo_comprobante(),
-                "serie": self.serie_comprobante,
-                "numero": numero
-            }
-            
-            # URL de la API de NubeFact
-            url = config.get_api_url()
-            
-            # Headers según documentación oficial
-            headers = {
-                'Authorization': config.token,
-                'Content-Type': 'application/json'
-            }
+            consulta_data = self._prepare_nubefact_query_data()
             
             _logger.info(f"Consultando factura {self.name} en NubeFact")
             
             # Realizar petición
-            response = requests.post(
-                url,
-                headers=headers,
-                json=consulta_data,
-                timeout=30
-            )
+            result = config._send_payload(consulta_data)
+            
+            _logger.info(f"Respuesta de consulta NubeFact: Status {result['status_code']} en {result['elapsed']:.2f} s")
             
-            _logger.info(f"Respuesta de consulta NubeFact: Status {response.status_code}, Body: {response.text}")
+            if result['status_code'] is None:
+                # Error de conexión o timeout
+                raise UserError(result['error'])
             
             # Procesar respuesta
-            if response.status_code == 200:
-                response_data = response.json()
+            if not result['error']:
+                response_data = result['data']
                 
                 # Si el documento existe en NubeFact
-                if 'errors' not in response_data or not response_data['errors']:
-                    # Actualizar campos con la información de NubeFact
-                    self.write({
-                        'sunat_enviado': True,
-                        'sunat_estado': 'accepted' if response_data.get('aceptada_por_sunat') else 'rejected',
-                        'sunat_enlace_pdf': response_data.get('enlace_del_pdf', ''),
-                        'sunat_enlace_xml': response_data.get('enlace_del_xml', ''),
-                        'sunat_enlace_cdr': response_data.get('enlace_del_cdr', ''),
-                        'sunat_codigo_hash': response_data.get('codigo_hash', ''),
-                        'sunat_response': json.dumps(response_data, indent=2),
-                    })
-                    
+                if self._nubefact_apply_query_response(response_data):
                     if response_data.get('aceptada_por_sunat'):
                         return {
                             'type': 'ir.actions.client',
@@ -863,7 +1013,7 @@ class AccountMove(models.Model):
                         }
                     }
             else:
-                error_msg = response.text
+                error_msg = result['error']
                 return {
                     'type': 'ir.actions.client',
                     'tag': 'display_notification',
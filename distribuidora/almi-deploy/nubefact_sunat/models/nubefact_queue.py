@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import time
+from datetime import timedelta
+
+from odoo import api, fields, models, _
+
+_logger = logging.getLogger(__name__)
+
+# Segundos máximos de una ejecución del cron (menos que su intervalo de 5 min);
+# si quedan envíos listos, el cron se vuelve a programar de inmediato
+CRON_TIME_BUDGET = 240
+
+
+class NubefactQueue(models.Model):
+    """
+    Cola de envíos a NubeFact.
+    Cada registro representa un comprobante pendiente de enviar a SUNAT
+    en segundo plano, fuera de la transacción del usuario.
+    """
+    _name = 'nubefact.queue'
+    _description = 'Cola de Envíos a NubeFact'
+    _order = 'next_attempt_date, id'
+    _rec_name = 'move_id'
+    
+    move_id = fields.Many2one(
+        'account.move',
+        string='Comprobante',
+        required=True,
+        ondelete='cascade',
+        index=True
+    )
+    
+    company_id = fields.Many2one(
+        'res.company',
+        string='Compañía',
+        related='move_id.company_id',
+        store=True,
+        index=True
+    )
+    
+    state = fields.Selection([
+        ('pending', 'Pendiente'),
+        ('done', 'Procesado'),
+        ('failed', 'Fallido'),
+    ], string='Estado', default='pending', required=True, index=True)
+    
+    origin = fields.Selection([
+        ('manual', 'Manual'),
+        ('payment', 'Pago Registrado'),
+    ], string='Origen', default='manual', required=True,
+       help='Acción que generó el envío en cola')
+    
+    attempts = fields.Integer(
+        string='Intentos',
+        default=0,
+        readonly=True
+    )
+    
+    next_attempt_date = fields.Datetime(
+        string='Próximo Intento',
+        default=fields.Datetime.now,
+        index=True,
+        help='El envío no se procesa antes de esta fecha (espera entre reintentos)'
+    )
+    
+    date_done = fields.Datetime(
+        string='Fecha de Proceso',
+        readonly=True
+    )
+    
+    last_error = fields.Text(
+        string='Último Error',
+        readonly=True
+    )
+    
+    def init(self):
+        # Un comprobante solo puede tener un envío pendiente a la vez
+        self.env.cr.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS nubefact_queue_move_pending_uniq
+            ON nubefact_queue (move_id) WHERE state = 'pending'
+        """)
+    
+    @api.model
+    def _enqueue(self, moves, origin='manual'):
+        """
+        Agrega los comprobantes a la cola (omitiendo los que ya tienen un
+        envío pendiente) y despierta al cron para procesarlos.
+        """
+        if not moves:
+            return self.browse()
+        
+        pending = self.search([
+            ('move_id', 'in', moves.ids),
+            ('state', '=', 'pending'),
+        ])
+        to_enqueue = moves - pending.move_id
+        jobs = self.create([{
+            'move_id': move.id,
+            'origin': origin,
+        } for move in to_enqueue])
+        
+        if jobs:
+            self._trigger_cron()
+        return jobs
+    
+    def _claim(self, company, limit):
+        """
+        Bloquea y retorna los envíos listos para procesar de la compañía.
+        Los registros bloqueados por otro proceso se omiten (SKIP LOCKED).
+        """
+        self.env.cr.execute("""
+            SELECT id FROM nubefact_queue
+            WHERE state = 'pending'
+              AND company_id = %s
+              AND next_attempt_date <= (now() at time zone 'UTC')
+            ORDER BY next_attempt_date, id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (company.id, limit))
+        return self.browse([row[0] for row in self.env.cr.fetchall()])
+    
+    @api.model
+    def _cron_process_queue(self):
+        """
+        Cron: procesa los envíos pendientes de todas las compañías, lote por
+        lote hasta vaciar la cola o agotar el tiempo de la ejecución. Si se
+        agota el tiempo con envíos listos, se vuelve a programar de inmediato.
+        """
+        deadline = time.monotonic() + CRON_TIME_BUDGET
+        configs = self.env['nubefact.config'].search([('active', '=', True)])
+        for config in configs:
+            while True:
+                if time.monotonic() >= deadline:
+                    self._trigger_cron()
+                    return True
+                jobs = self._claim(config.company_id, config.queue_batch_size or 50)
+                if not jobs:
+                    break
+                jobs._process(config)
+                # Confirmar cada lote para no repetir envíos si el cron se interrumpe
+                self.env.cr.commit()
+        return True
+    
+    @api.model
+    def _trigger_cron(self):
+        """Programa el cron de la cola para ejecutarse de inmediato"""
+        cron = self.env.ref('nubefact_sunat.ir_cron_nubefact_queue', raise_if_not_found=False)
+        if cron:
+            cron._trigger()
+    
+    def _process(self, config):
+        """Prepara los comprobantes, los envía en paralelo y registra los resultados"""
+        now = fields.Datetime.now()
+        jobs_to_send = self.browse()
+        payloads = []
+        
+        # 1. Preparar payloads de todo el lote (acceso al ORM, en el hilo principal)
+        to_prepare = self.filtered(
+            lambda j: j.move_id.state == 'posted' and j.move_id.sunat_estado != 'accepted'
+        )
+        (self - to_prepare).write({'state': 'done', 'date_done': now})
+        prepared, errors = to_prepare.move_id._prepare_nubefact_invoice_payloads()
+        
+        for job in to_prepare:
+            move = job.move_id
+            if move.id in errors:
+                # Datos incompletos: reintentar no lo va a resolver
+                move.write({
+                    'sunat_estado': 'error',
+                    'sunat_error_message': errors[move.id],
+                })
+                job.write({
+                    'state': 'failed',
+                    'attempts': job.attempts + 1,
+                    'last_error': errors[move.id],
+                    'date_done': now,
+                })
+            else:
+                payloads.append(prepared[move.id])
+                jobs_to_send |= job
+        
+        # 2. Enviar en paralelo (sin acceso al ORM)
+        results = config._send_payloads(payloads)
+        
+        # 3. Registrar resultados
+        for job, result in zip(jobs_to_send, results):
+            job._handle_result(config, result)
+    
+    def _handle_result(self, config, result):
+        """Aplica la respuesta al comprobante y reprograma si es un error temporal"""
+        self.ensure_one()
+        now = fields.Datetime.now()
+        attempts = self.attempts + 1
+        self.move_id._nubefact_apply_response(result)
+        
+        if result['error'] and result['transient'] and attempts < (config.queue_max_attempts or 1):
+            # Backoff exponencial: espera base × 2^(intentos - 1)
+            delay = (config.queue_retry_delay or 60) * 2 ** (attempts - 1)
+            self.write({
+                'attempts': attempts,
+                'last_error': result['error'],
+                'next_attempt_date': now + timedelta(seconds=delay),
+            })
+            _logger.info(
+                f"Reintento {attempts} de {self.move_id.name} programado en {delay} s"
+            )
+        else:
+            self.write({
+                'state': 'failed' if result['error'] else 'done',
+                'attempts': attempts,
+                'last_error': result['error'] or False,
+                'date_done': now,
+            })
+    
+    def action_retry(self):
+        """Vuelve a poner en cola los envíos fallidos"""
+        failed = self.filtered(lambda j: j.state == 'failed')
+        return self._enqueue(failed.move_id, origin='manual')
+    
+    @api.model
+    def action_process_now(self):
+        """Procesa la cola inmediatamente (sin esperar al cron)"""
+        configs = self.env['nubefact.config'].search([('active', '=', True)])
+        processed = 0
+        for config in configs:
+            jobs = self._claim(config.company_id, config.queue_batch_size or 50)
+            jobs._process(config)
+            processed += len(jobs)
+        
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Cola de Envíos a SUNAT'),
+                'message': _('Se procesaron %s comprobantes.') % processed,
+                'type': 'success',
+                'sticky': False,
+            }
+        }
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Prueba de carga del envío masivo a NubeFact contra el simulador local
+(tools/mock_server.py).
+
+Toma los payloads de comprobantes confirmados de la base (cambiando el número
+para que no se repitan), apunta temporalmente la configuración de NubeFact de
+la compañía al simulador y los envía con nubefact.config._send_payloads, igual
+que el envío masivo y la cola. Al terminar revierte la transacción.
+
+Uso:
+    python3 nubefact_sunat/tools/mock_server.py --port 8099 --latency-ms 150
+    odoo-bin shell -d mi_base --no-http
+    >>> from odoo.addons.nubefact_sunat.tools.load_test import run
+    >>> run(env, count=500, workers=8)
+"""
+
+import time
+
+DEFAULT_URL = 'http://127.0.0.1:8099/api/v1/mock'
+
+
+def _percentile(values, percent):
+    """Percentil por interpolación lineal de una lista ordenada"""
+    if not values:
+        return 0.0
+    position = (len(values) - 1) * percent / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def _build_payloads(env, count):
+    """Prepara `count` payloads a partir de comprobantes confirmados de la base"""
+    moves = env['account.move'].search([
+        ('state', '=', 'posted'),
+        ('move_type', 'in', ['out_invoice', 'out_refund']),
+        ('company_id', '=', env.company.id),
+    ], limit=min(count, 200), order='id desc')
+    prepared, errors = moves._prepare_nubefact_invoice_payloads()
+    templates = list(prepared.values())
+    if not templates:
+        raise ValueError(
+            f"No hay comprobantes confirmados válidos para generar la carga ({len(errors)} con errores)"
+        )
+    
+    # Numeración propia de la prueba para que el simulador no los rechace como duplicados
+    first_number = int(time.time()) % 1000000 * 1000
+    return [
+        dict(templates[i % len(templates)], serie='FPRB', numero=first_number + i)
+        for i in range(count)
+    ]
+
+
+def run(env, count=500, workers=None, batch_size=None, url=DEFAULT_URL, rate_limit=0):
+    """
+    Envía `count` comprobantes al simulador y muestra rendimiento y latencias.
+    
+    Args:
+        workers: envíos simultáneos (por defecto, los de la configuración)
+        batch_size: comprobantes por lote (por defecto, los de la configuración)
+        rate_limit: peticiones por segundo (0 = sin límite)
+    """
+    config = env['nubefact.config']._get_active_config(env.company)
+    if not config:
+        raise ValueError('La compañía actual no tiene configuración de NubeFact activa')
+    
+    workers = workers or config.max_workers
+    batch_size = batch_size or config.queue_batch_size or 50
+    
+    try:
+        config.write({
+            'api_url': url,
+            'max_workers': workers,
+            'log_level': 'none',
+        })
+        payloads = _build_payloads(env, count)
+        
+        results = []
+        start = time.perf_counter()
+        for i in range(0, len(payloads), batch_size):
+            results += config._send_payloads(payloads[i:i + batch_size], rate_limit=rate_limit)
+        elapsed = time.perf_counter() - start
+    finally:
+        env.cr.rollback()
+    
+    latencies = sorted(result['elapsed'] * 1000 for result in results)
+    accepted = sum(1 for result in results if not result['error'] and result['data'].get('aceptada_por_sunat'))
+    rejected = sum(1 for result in results if not result['error'] and not result['data'].get('aceptada_por_sunat'))
+    failed = len(results) - accepted - rejected
+    transient = sum(1 for result in results if result['transient'])
+    
+    print(f"Comprobantes: {len(results)} en {elapsed:.2f} s ({len(results) / elapsed:.1f} comprobantes/s)")
+    print(f"Envíos simultáneos: {workers}, lote: {batch_size}")
+    print(f"Aceptados: {accepted}, rechazados: {rejected}, errores: {failed} (temporales: {transient})")
+    print(
+        f"Latencia (ms): p50 {_percentile(latencies, 50):.0f}, p90 {_percentile(latencies, 90):.0f}, "
+        f"p95 {_percentile(latencies, 95):.0f}, p99 {_percentile(latencies, 99):.0f}, "
+        f"máx {latencies[-1] if latencies else 0:.0f}"
+    )
+    return {
+        'count': len(results),
+        'elapsed': elapsed,
+        'throughput': len(results) / elapsed if elapsed else 0.0,
+        'accepted': accepted,
+        'rejected': rejected,
+        'errors': failed,
+        'p50': _percentile(latencies, 50),
+        'p95': _percentile(latencies, 95),
+        'p99': _percentile(latencies, 99),
+    }
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Servidor local que simula la API JSON de NubeFact, para pruebas y
+mediciones de rendimiento sin llamar al servicio real.
+
+Implementa las operaciones generar_comprobante, consultar_comprobante,
+generar_guia y consultar_guia, con latencia, errores y rechazos configurables.
+Solo usa la librería estándar de Python.
+
+Uso:
+    python3 nubefact_sunat/tools/mock_server.py --port 8099 \\
+        --latency-ms 150 --jitter-ms 100 --error-rate 0.02 --reject-rate 0.05
+
+Luego, en la configuración de NubeFact (de una base de pruebas), usar como
+URL http://localhost:8099/api/v1/mock y cualquier token (o el de --token).
+GET /stats retorna los contadores de peticiones atendidas.
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Códigos de error de NubeFact usados por el simulador
+ERROR_TOKEN = 10
+ERROR_NOT_FOUND = 24
+ERROR_DUPLICATED = 23
+ERROR_FORMAT = 20
+
+TIPOS_COMPROBANTE = {1: 'FACTURA', 2: 'BOLETA', 3: 'NOTA DE CRÉDITO', 4: 'NOTA DE DÉBITO', 9: 'GUÍA DE REMISIÓN'}
+
+
+class MockState:
+    """Documentos recibidos y contadores, compartidos entre hilos"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.documents = {}
+        self.stats = {}
+    
+    def count(self, key):
+        with self.lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+
+class MockNubefactHandler(BaseHTTPRequestHandler):
+    """Atiende las peticiones POST con el formato de la API JSON de NubeFact"""
+    
+    server_version = 'MockNubeFact/1.0'
+    protocol_version = 'HTTP/1.1'  # Conexiones persistentes (keep-alive)
+    
+    def log_message(self, format, *args):
+        if self.server.options.verbose:
+            super().log_message(format, *args)
+    
+    def _reply(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _error(self, status, codigo, message):
+        self.server.state.count(f'error_{status}')
+        self._reply(status, {'errors': message, 'codigo': codigo})
+    
+    def do_GET(self):
+        if self.path.rstrip('/') == '/stats':
+            with self.server.state.lock:
+                stats = dict(self.server.state.stats, documents=len(self.server.state.documents))
+            self._reply(200, stats)
+        else:
+            self._error(404, ERROR_FORMAT, 'Ruta no encontrada')
+    
+    def do_POST(self):
+        options = self.server.options
+        state = self.server.state
+        
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length)
+        
+        # Latencia simulada
+        delay = max(0.0, options.latency_ms + random.uniform(-options.jitter_ms, options.jitter_ms)) / 1000
+        if options.timeout_rate and random.random() < options.timeout_rate:
+            delay = options.timeout_s
+        time.sleep(delay)
+        
+        if options.token and self.headers.get('Authorization') != options.token:
+            return self._error(401, ERROR_TOKEN, 'El token enviado no es válido')
+        
+        if options.error_rate and random.random() < options.error_rate:
+            return self._error(random.choice([500, 502, 503]), ERROR_FORMAT, 'Error interno simulado')
+        
+        try:
+            payload = json.loads(raw or b'{}')
+        except ValueError:
+            return self._error(400, ERROR_FORMAT, 'El archivo enviado no cumple con el formato establecido')
+        
+        operation = payload.get('operacion')
+        state.count(operation or 'sin_operacion')
+        handler = {
+            'generar_comprobante': self._generate,
+            'generar_guia': self._generate,
+            'consultar_comprobante': self._query,
+            'consultar_guia': self._query,
+        }.get(operation)
+        if not handler:
+            return self._error(400, ERROR_FORMAT, f'Operación no soportada: {operation}')
+        return handler(payload)
+    
+    def _key(self, payload):
+        tipo = 9 if payload.get('operacion', '').endswith('guia') else payload.get('tipo_de_comprobante')
+        return (tipo, payload.get('serie'), str(payload.get('numero')))
+    
+    def _generate(self, payload):
+        options = self.server.options
+        state = self.server.state
+        key = self._key(payload)
+        if not key[1] or not payload.get('numero'):
+            return self._error(400, ERROR_FORMAT, 'Debe indicar la serie y el número del documento')
+        
+        with state.lock:
+            if key in state.documents and not options.allow_duplicates:
+                duplicated = True
+            else:
+                duplicated = False
+                rejected = bool(options.reject_rate) and random.random() < options.reject_rate
+                state.documents[key] = self._document(key, rejected)
+            document = state.documents[key]
+        
+        if duplicated:
+            return self._error(400, ERROR_DUPLICATED, 'Este documento ya existe en NubeFact')
+        self.server.state.count('rejected' if not document['aceptada_por_sunat'] else 'accepted')
+        return self._reply(200, document)
+    
+    def _query(self, payload):
+        with self.server.state.lock:
+            document = self.server.state.documents.get(self._key(payload))
+        if not document:
+            return self._error(400, ERROR_NOT_FOUND, 'El documento no existe')
+        return self._reply(200, document)
+    
+    def _document(self, key, rejected):
+        tipo, serie, numero = key
+        base_url = f"http://{self.server.server_address[0]}:{self.server.server_address[1]}/cpe/{serie}-{numero}"
+        codigo_hash = hashlib.sha1(f"{tipo}{serie}{numero}".encode()).hexdigest()[:28]
+        return {
+            'tipo_de_comprobante': tipo,
+            'serie': serie,
+            'numero': int(numero) if numero.isdigit() else numero,
+            'enlace': base_url,
+            'enlace_del_pdf': f"{base_url}.pdf",
+            'enlace_del_xml': f"{base_url}.xml",
+            'enlace_del_cdr': f"{base_url}.zip",
+            'aceptada_por_sunat': not rejected,
+            'sunat_description': (
+                'El comprobante ha sido rechazado (simulado)' if rejected
+                else f"La {TIPOS_COMPROBANTE.get(tipo, 'DOCUMENTO')} número {serie}-{numero}, ha sido aceptada"
+            ),
+            'sunat_note': None,
+            'sunat_responsecode': '2800' if rejected else '0',
+            'sunat_soap_error': '',
+            'codigo_hash': codigo_hash,
+            'numero_ticket': f"T{codigo_hash[:12]}",
+            'cadena_para_codigo_qr': f"{serie}|{numero}|{codigo_hash}",
+        }
+
+
+def build_server(options):
+    """Crea el servidor (sin iniciarlo) con las opciones de simulación"""
+    server = ThreadingHTTPServer((options.host, options.port), MockNubefactHandler)
+    server.daemon_threads = True
+    server.options = options
+    server.state = MockState()
+    return server
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Simulador local de la API de NubeFact')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--token', default='', help='Si se indica, se exige este token en Authorization')
+    parser.add_argument('--latency-ms', type=float, default=150.0, help='Latencia media de cada respuesta')
+    parser.add_argument('--jitter-ms', type=float, default=50.0, help='Variación aleatoria de la latencia (±)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fracción de respuestas 5xx')
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help='Fracción de respuestas demoradas')
+    parser.add_argument('--timeout-s', type=float, default=60.0, help='Demora de las respuestas demoradas')
+    parser.add_argument('--reject-rate', type=float, default=0.0, help='Fracción de documentos rechazados por SUNAT')
+    parser.add_argument('--allow-duplicates', action='store_true', help='Aceptar documentos ya enviados')
+    parser.add_argument('--verbose', action='store_true', help='Registrar cada petición')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    server = build_server(options)
+    print(f"Simulador de NubeFact escuchando en http://{options.host}:{options.port}/api/v1/mock")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
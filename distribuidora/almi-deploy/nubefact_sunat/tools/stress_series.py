@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Prueba de concurrencia de la numeración de facturas y boletas.
+
+Varios hilos, cada uno con su propio cursor, crean comprobantes en borrador
+por lotes (alternando un cliente con RUC y otro con DNI) y confirman sus
+transacciones, como lo harían varios usuarios o trabajadores a la vez.
+Al final verifica que no haya números repetidos y, con secuencias
+"Sin huecos", que la numeración sea continua.
+
+ATENCIÓN: confirma transacciones y consume números reales de las series.
+Usar solo en una base de pruebas. Con cleanup=True elimina los comprobantes
+creados, pero los números consumidos no se recuperan.
+
+Uso (desde el shell de Odoo):
+    odoo-bin shell -d base_pruebas --no-http
+    >>> from odoo.addons.nubefact_sunat.tools.stress_series import run
+    >>> run(env, total=2000, workers=8, mode='no_gap')
+"""
+
+import re
+import threading
+import time
+from collections import Counter
+
+from psycopg2 import errors
+
+from odoo import api
+
+MAX_RETRIES = 10
+
+
+def _worker(registry, uid, context, partner_ids, batches, results, lock):
+    """Crea los lotes asignados con un cursor propio, reintentando conflictos"""
+    for batch_size in batches:
+        for attempt in range(MAX_RETRIES):
+            try:
+                with registry.cursor() as cr:
+                    env = api.Environment(cr, uid, context)
+                    moves = env['account.move'].create([{
+                        'move_type': 'out_invoice',
+                        'partner_id': partner_ids[i % len(partner_ids)],
+                    } for i in range(batch_size)])
+                    created = [(move.id, move.name) for move in moves]
+                with lock:
+                    results['created'] += created
+                    results['retries'] += attempt
+                break
+            except errors.SerializationFailure:
+                # Igual que Odoo: reintentar la transacción completa
+                time.sleep(0.01 * (attempt + 1))
+        else:
+            with lock:
+                results['failed'] += batch_size
+
+
+def _check_contiguous(names):
+    """Retorna los números que faltan entre el menor y el mayor de cada serie"""
+    missing = {}
+    series = {}
+    for name in names:
+        match = re.match(r'^(.*?)(\d+)$', name or '')
+        if match:
+            series.setdefault(match.group(1), []).append(int(match.group(2)))
+    for prefix, numbers in series.items():
+        expected = set(range(min(numbers), max(numbers) + 1))
+        holes = sorted(expected - set(numbers))
+        if holes:
+            missing[prefix] = holes
+    return missing
+
+
+def run(env, total=2000, workers=8, batch_size=20, mode=None, cleanup=True):
+    """
+    Ejecuta la prueba e imprime los resultados.
+    
+    Args:
+        total: comprobantes a crear
+        workers: hilos simultáneos
+        batch_size: comprobantes por transacción
+        mode: 'standard' o 'no_gap' para cambiar temporalmente la implementación
+              de las secuencias (None = dejar la configurada)
+        cleanup: eliminar los comprobantes creados al terminar
+    """
+    company = env.company
+    allocator = env['nubefact.series.allocator']
+    sequences = allocator._get_sequence(company, 'invoice') | allocator._get_sequence(company, 'boleta')
+    for serie_type in ('invoice', 'boleta'):
+        if not allocator._get_journal_id(company, serie_type):
+            raise ValueError(f"No existe el diario de {serie_type} para {company.name}")
+    
+    original_mode = {sequence.id: sequence.implementation for sequence in sequences}
+    partners = env['res.partner'].create([
+        {'name': 'Cliente Prueba Series RUC', 'vat': '20100070970'},
+        {'name': 'Cliente Prueba Series DNI', 'vat': '45678912'},
+    ])
+    if mode:
+        sequences.write({'implementation': mode})
+    env.cr.commit()
+    
+    batches = [min(batch_size, total - i) for i in range(0, total, batch_size)]
+    results = {'created': [], 'retries': 0, 'failed': 0}
+    lock = threading.Lock()
+    threads = [
+        threading.Thread(target=_worker, args=(
+            env.registry, env.uid, dict(env.context, allowed_company_ids=[company.id]),
+            partners.ids, batches[i::workers], results, lock,
+        ))
+        for i in range(workers)
+    ]
+    
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    
+    names = [name for _id, name in results['created']]
+    duplicated = {name: count for name, count in Counter(names).items() if count > 1}
+    implementation = mode or ', '.join(sorted(set(original_mode.values())))
+    missing = _check_contiguous(names) if implementation == 'no_gap' else {}
+    
+    print(f"Comprobantes: {len(names)} en {elapsed:.2f} s ({len(names) / elapsed:.1f}/s)")
+    print(f"Hilos: {workers}, lote: {batch_size}, implementación: {implementation}")
+    print(f"Reintentos por conflicto: {results['retries']}, lotes fallidos: {results['failed']}")
+    print(f"Números repetidos: {len(duplicated)}")
+    if implementation == 'no_gap':
+        print(f"Huecos en la numeración: {sum(len(holes) for holes in missing.values())}")
+    
+    env.invalidate_all()
+    if cleanup:
+        env['account.move'].browse([move_id for move_id, _name in results['created']]).unlink()
+        partners.unlink()
+    if mode:
+        for sequence in sequences:
+            sequence.implementation = original_mode[sequence.id]
+    env.cr.commit()
+    
+    return {
+        'count': len(names),
+        'elapsed': elapsed,
+        'retries': results['retries'],
+        'failed': results['failed'],
+        'duplicated': duplicated,
+        'missing': missing,
+    }
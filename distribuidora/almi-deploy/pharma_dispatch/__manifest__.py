@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 {
     'name': 'Gestión de Despacho y Logística Farmacéutica',
-    'version': '18.0.1.0.0',
+    'version': '18.0.1.4.0',
     'category': 'Inventory/Delivery',
     'summary': 'Planificación de rutas, guías de remisión electrónica y recojo en local para farmacéuticas',
     'description': """
@@ -59,6 +59,7 @@
         'data/dispatch_settlement_sequence_data.xml',
         'data/dispatch_motivo_traslado_data.xml',
         'data/stock_location_data.xml',
+        'data/ir_cron_data.xml',
         'views/dispatch_driver_views.xml',
         'views/dispatch_vehicle_views.xml',
         'views/dispatch_sheet_views.xml',
@@ -66,6 +67,7 @@
         'views/dispatch_settlement_views.xml',
         'views/dispatch_collection_sheet_views.xml',
         'views/account_move_views.xml',
+        'views/account_payment_term_views.xml',
         'views/stock_picking_views.xml',
         'views/sale_order_views.xml',
         'wizard/create_sheet_wizard_views.xml',
@@ -2,12 +2,17 @@
 
 import json
 import logging
+from psycopg2 import OperationalError
+from psycopg2.errors import UniqueViolation
 from odoo import http, _
 from odoo.http import request, Response
 from odoo.exceptions import ValidationError, UserError, AccessError
 
 _logger = logging.getLogger(__name__)
 
+# Eventos por llamada a /api/dispatch/sync/events
+MAX_SYNC_EVENTS = 500
+
 
 class DispatchAPI(http.Controller):
     """
@@ -15,22 +20,32 @@ class DispatchAPI(http.Controller):
     Permite a los conductores ver sus rutas, marcar entregas y registrar pagos.
     """
     
+    def _get_request_token(self, token=None):
+        """Token del encabezado Authorization: Bearer <token> (o del parámetro token)"""
+        authorization = request.httprequest.headers.get('Authorization') or ''
+        if authorization.startswith('Bearer '):
+            return authorization[7:].strip()
+        return token
+    
     def _authenticate_driver(self, token=None, driver_id=None):
         """
-        Autentica al conductor usando token o ID.
-        Por simplicidad, validamos que el driver_id exista.
-        En producción, se debería implementar un sistema de tokens más robusto.
+        Autentica al conductor con su token de API.
+        Si se envía driver_id, debe ser el del conductor del token.
         """
-        if not driver_id:
-            return None, {'error': 'driver_id es requerido', 'code': 'MISSING_DRIVER_ID'}
+        token = self._get_request_token(token)
+        if not token:
+            return None, {'error': 'Token de acceso requerido', 'code': 'MISSING_TOKEN'}
         
-        driver = request.env['dispatch.driver'].sudo().search([('id', '=', driver_id)], limit=1)
+        driver = request.env['dispatch.driver']._authenticate_api_token(token)
         if not driver:
-            return None, {'error': 'Conductor no encontrado', 'code': 'DRIVER_NOT_FOUND'}
+            return None, {'error': 'Token inválido o vencido', 'code': 'INVALID_TOKEN'}
+        
+        if driver_id and str(driver_id) != str(driver.id):
+            return None, {'error': 'El token no corresponde al conductor', 'code': 'DRIVER_MISMATCH'}
         
         return driver, None
     
-    def _response(self, data=None, error=None, status=200):
+    def _response(self, data=None, error=None, status=200, headers=None):
         """Genera una respuesta JSON consistente"""
         response_data = {}
         
@@ -44,33 +59,156 @@ class DispatchAPI(http.Controller):
         return Response(
             json.dumps(response_data, ensure_ascii=False, default=str),
             content_type='application/json',
-            status=status
+            status=status,
+            headers=headers
         )
     
+    def _not_modified(self, etag):
+        """Respuesta 304 sin cuerpo: la app ya tiene la última versión"""
+        return Response(status=304, headers=[('ETag', etag), ('Cache-Control', 'no-cache')])
+    
+    @http.route('/api/dispatch/auth/token', type='json', auth='user', methods=['POST'], csrf=False)
+    def issue_token(self, **kwargs):
+        """
+        Genera el token de API del conductor del usuario que inició sesión.
+        El token anterior deja de funcionar. La app lo envía luego en el
+        encabezado Authorization: Bearer <token>.
+        """
+        try:
+            driver = request.env['dispatch.driver']._get_driver_for_user(request.env.user)
+            if not driver:
+                return {
+                    'success': False,
+                    'error': 'No hay un conductor asociado a este usuario'
+                }
+            
+            token, expiry = driver._generate_api_token()
+            return {
+                'success': True,
+                'data': {
+                    'driver_id': driver.id,
+                    'token': token,
+                    'expires_at': expiry.isoformat(),
+                }
+            }
+        
+        except Exception as e:
+            _logger.error(f"Error en issue_token: {str(e)}", exc_info=True)
+            return {
+                'success': False,
+                'error': 'Error interno del servidor'
+            }
+    
+    # ========== DATOS DE LA RUTA ==========
+    
+    def _find_driver_route(self, driver, route_id):
+        """Retorna la ruta si pertenece al conductor (o vacío)"""
+        return request.env['dispatch.route'].sudo().search([
+            ('id', '=', route_id),
+            ('driver_id', '=', driver.id)
+        ], limit=1)
+    
+    def _route_etag(self, route):
+        """ETag de la ruta: cambia con cualquier cambio de la ruta, sus líneas o sus cobranzas"""
+        return f'W/"route-{route.id}-{route.sync_version}"'
+    
+    def _get_route_collection_sheet(self, route):
+        """Hoja de cobranzas de la planilla de la ruta (o vacío)"""
+        if not route.sheet_id:
+            return request.env['dispatch.collection.sheet']
+        settlement = request.env['dispatch.settlement'].sudo().search([
+            ('sheet_id', '=', route.sheet_id.id)
+        ], limit=1)
+        return settlement.collection_sheet_id
+    
+    def _route_header_data(self, route):
+        """Datos de cabecera de la ruta (sin líneas)"""
+        return {
+            'id': route.id,
+            'name': route.name,
+            'route_date': route.route_date.isoformat() if route.route_date else None,
+            'state': route.state,
+            'state_name': dict(route._fields['state'].selection).get(route.state),
+            'driver': {
+                'id': route.driver_id.id,
+                'name': route.driver_id.name,
+                'license_number': route.driver_id.license_number,
+            },
+            'vehicle': {
+                'id': route.vehicle_id.id,
+                'license_plate': route.vehicle_id.license_plate,
+                'brand': route.vehicle_id.brand or '',
+                'model': route.vehicle_id.model or '',
+            },
+            'totals': {
+                'total_orders': route.total_orders,
+                'pending_orders': route.pending_orders,
+                'delivered_orders': route.delivered_orders,
+                'failed_orders': route.failed_orders,
+            },
+            'sync_token': str(route.sync_version),
+        }
+    
+    def _route_line_data(self, line):
+        """Datos de una línea de ruta"""
+        return {
+            'id': line.id,
+            'sequence': line.sequence,
+            'state': line.state,
+            'state_name': dict(line._fields['state'].selection).get(line.state),
+            'order': {
+                'id': line.order_id.id,
+                'name': line.order_id.name,
+                'amount_total': float(line.order_amount_total),
+            },
+            'partner': {
+                'id': line.partner_id.id,
+                'name': line.partner_name,
+                'address': line.partner_address,
+                'phone': line.partner_phone,
+            },
+            'delivery_datetime': line.delivery_datetime.isoformat() if line.delivery_datetime else None,
+            'notes': line.notes,
+        }
+    
+    def _collection_line_data(self, col_line):
+        """Datos de una línea de cobranza"""
+        return {
+            'id': col_line.id,
+            'invoice_id': col_line.invoice_id.id,
+            'invoice_name': col_line.invoice_id.name,
+            'partner_name': col_line.partner_id.name if col_line.partner_id else '',
+            'invoice_amount_total': float(col_line.invoice_amount_total),  # Monto de la factura
+            'amount': float(col_line.amount),  # Monto cobrado
+            'collection_type': col_line.collection_type,
+            'payment_method': col_line.payment_method,
+            'state': col_line.state,
+        }
+    
     @http.route('/api/dispatch/route/<int:route_id>', type='http', auth='public', 
                 methods=['GET'], csrf=False, cors='*')
     def get_route(self, route_id, driver_id=None, **kwargs):
         """
         Obtiene los detalles de una ruta específica.
+        Soporta If-None-Match: si la ruta no cambió desde la versión que tiene
+        la app, responde 304 sin cuerpo.
         
         Parámetros:
             - route_id: ID de la ruta
-            - driver_id: ID del conductor (para autenticación)
+            - driver_id: ID del conductor (opcional: debe ser el del token)
         
         Retorna:
-            Detalles de la ruta con sus líneas de entrega
+            Detalles de la ruta con sus líneas de entrega y el sync_token
+            para pedir luego solo los cambios (/changes)
         """
         try:
             # Autenticar conductor
-            driver, auth_error = self._authenticate_driver(driver_id=driver_id)
+            driver, auth_error = self._authenticate_driver(kwargs.get('token'), driver_id)
             if auth_error:
                 return self._response(error=auth_error, status=401)
             
             # Buscar la ruta
-            route = request.env['dispatch.route'].sudo().search([
-                ('id', '=', route_id),
-                ('driver_id', '=', driver.id)
-            ], limit=1)
+            route = self._find_driver_route(driver, route_id)
             
             if not route:
                 return self._response(
@@ -79,80 +217,26 @@ class DispatchAPI(http.Controller):
                     status=404
                 )
             
-            # Preparar datos de la ruta
-            route_data = {
-                'id': route.id,
-                'name': route.name,
-                'route_date': route.route_date.isoformat() if route.route_date else None,
-                'state': route.state,
-                'state_name': dict(route._fields['state'].selection).get(route.state),
-                'driver': {
-                    'id': route.driver_id.id,
-                    'name': route.driver_id.name,
-                    'license_number': route.driver_id.license_number,
-                },
-                'vehicle': {
-                    'id': route.vehicle_id.id,
-                    'license_plate': route.vehicle_id.license_plate,
-                    'brand': route.vehicle_id.brand or '',
-                    'model': route.vehicle_id.model or '',
-                },
-                'totals': {
-                    'total_orders': route.total_orders,
-                    'pending_orders': route.pending_orders,
-                    'delivered_orders': route.delivered_orders,
-                    'failed_orders': route.failed_orders,
-                },
-                'lines': []
-            }
+            etag = self._route_etag(route)
+            if request.httprequest.headers.get('If-None-Match') == etag:
+                return self._not_modified(etag)
             
-            # Agregar líneas de ruta
-            for line in route.line_ids:
-                line_data = {
-                    'id': line.id,
-                    'sequence': line.sequence,
-                    'state': line.state,
-                    'state_name': dict(line._fields['state'].selection).get(line.state),
-                    'order': {
-                        'id': line.order_id.id,
-                        'name': line.order_id.name,
-                        'amount_total': float(line.order_amount_total),
-                    },
-                    'partner': {
-                        'id': line.partner_id.id,
-                        'name': line.partner_name,
-                        'address': line.partner_address,
-                        'phone': line.partner_phone,
-                    },
-                    'delivery_datetime': line.delivery_datetime.isoformat() if line.delivery_datetime else None,
-                    'notes': line.notes,
-                }
-                route_data['lines'].append(line_data)
+            # Preparar datos de la ruta
+            route_data = self._route_header_data(route)
+            route_data['lines'] = [self._route_line_data(line) for line in route.line_ids]
             
             # Agregar líneas de cobranza (facturas disponibles para cobro)
-            sheet = route.sheet_id
-            if sheet:
-                settlement = request.env['dispatch.settlement'].sudo().search([
-                    ('sheet_id', '=', sheet.id)
-                ], limit=1)
-                
-                if settlement and settlement.collection_sheet_id:
-                    collection_lines = []
-                    for col_line in settlement.collection_sheet_id.collection_line_ids:
-                        collection_lines.append({
-                            'id': col_line.id,
-                            'invoice_id': col_line.invoice_id.id,
-                            'invoice_name': col_line.invoice_id.name,
-                            'partner_name': col_line.partner_id.name if col_line.partner_id else '',
-                            'invoice_amount_total': float(col_line.invoice_amount_total),  # Monto de la factura
-                            'amount': float(col_line.amount),  # Monto cobrado
-                            'collection_type': col_line.collection_type,
-                            'payment_method': col_line.payment_method,
-                            'state': col_line.state,
-                        })
-                    route_data['collection_lines'] = collection_lines
+            collection_sheet = self._get_route_collection_sheet(route)
+            if collection_sheet:
+                route_data['collection_lines'] = [
+                    self._collection_line_data(col_line)
+                    for col_line in collection_sheet.collection_line_ids
+                ]
             
-            return self._response(data=route_data)
+            return self._response(
+                data=route_data,
+                headers=[('ETag', etag), ('Cache-Control', 'no-cache')]
+            )
         
         except Exception as e:
             _logger.error(f"Error en get_route: {str(e)}", exc_info=True)
@@ -162,6 +246,227 @@ class DispatchAPI(http.Controller):
                 status=500
             )
     
+    @http.route('/api/dispatch/route/<int:route_id>/changes', type='http', auth='public',
+                methods=['GET'], csrf=False, cors='*')
+    def get_route_changes(self, route_id, driver_id=None, since=None, **kwargs):
+        """
+        Retorna solo lo que cambió en la ruta desde el sync_token de la app.
+        
+        Parámetros:
+            - route_id: ID de la ruta
+            - driver_id: ID del conductor (opcional: debe ser el del token)
+            - since: sync_token de la última sincronización
+        
+        Retorna:
+            - 304 sin cuerpo si no hubo cambios
+            - full_resync=true si la app debe descargar la ruta completa
+              (se eliminaron líneas o el token no es válido para esta ruta)
+            - si no, la cabecera de la ruta y las líneas de ruta y de cobranza
+              cambiadas, con el nuevo sync_token
+        """
+        try:
+            # Autenticar conductor
+            driver, auth_error = self._authenticate_driver(kwargs.get('token'), driver_id)
+            if auth_error:
+                return self._response(error=auth_error, status=401)
+            
+            try:
+                since = int(since)
+            except (TypeError, ValueError):
+                return self._response(
+                    error={'error': 'since debe ser un sync_token válido', 'code': 'INVALID_SYNC_TOKEN'},
+                    status=400
+                )
+            
+            route = self._find_driver_route(driver, route_id)
+            if not route:
+                return self._response(
+                    error={'error': 'Ruta no encontrada o no pertenece al conductor',
+                           'code': 'ROUTE_NOT_FOUND'},
+                    status=404
+                )
+            
+            if since == route.sync_version:
+                return self._not_modified(self._route_etag(route))
+            
+            route_data = self._route_header_data(route)
+            if since < route.sync_reset_version or since > route.sync_version:
+                route_data['full_resync'] = True
+                return self._response(data=route_data)
+            
+            route_data['full_resync'] = False
+            lines = request.env['dispatch.route.line'].sudo().search([
+                ('route_id', '=', route.id),
+                ('sync_version', '>', since),
+            ])
+            route_data['lines'] = [self._route_line_data(line) for line in lines]
+            
+            collection_sheet = self._get_route_collection_sheet(route)
+            if collection_sheet:
+                collection_lines = request.env['dispatch.collection.line'].sudo().search([
+                    ('collection_sheet_id', '=', collection_sheet.id),
+                    ('sync_version', '>', since),
+                ])
+                route_data['collection_lines'] = [
+                    self._collection_line_data(col_line) for col_line in collection_lines
+                ]
+            
+            return self._response(data=route_data)
+        
+        except Exception as e:
+            _logger.error(f"Error en get_route_changes: {str(e)}", exc_info=True)
+            return self._response(
+                error={'error': 'Error interno del servidor', 'code': 'INTERNAL_ERROR'},
+                status=500
+            )
+    
+    # ========== OPERACIONES DEL CONDUCTOR ==========
+    
+    def _find_driver_lines(self, driver, line_ids):
+        """Líneas de ruta del conductor (las que no le pertenecen se omiten)"""
+        return request.env['dispatch.route.line'].sudo().search([
+            ('id', 'in', list(line_ids)),
+            ('route_id.driver_id', '=', driver.id)
+        ])
+    
+    def _apply_delivery(self, line, signature=None, receiver_name=None, notes=None):
+        """Marca la línea como entregada y retorna los datos para la app"""
+        # Actualizar datos opcionales
+        vals = {}
+        if signature:
+            vals['signature'] = signature
+        if receiver_name:
+            vals['receiver_name'] = receiver_name
+        if notes:
+            vals['notes'] = notes
+        
+        if vals:
+            line.write(vals)
+        
+        # Marcar como entregado
+        line.action_mark_delivered()
+        
+        return {
+            'line_id': line.id,
+            'state': line.state,
+            'message': 'Entrega marcada exitosamente'
+        }
+    
+    def _apply_failure(self, line, failure_reason=None, notes=None):
+        """Marca la línea como no entregada y retorna los datos para la app"""
+        # Actualizar motivo y notas
+        vals = {}
+        if failure_reason:
+            vals['failure_reason'] = failure_reason
+        if notes:
+            vals['notes'] = notes
+        
+        if vals:
+            line.write(vals)
+        
+        # Marcar como fallido
+        line.action_mark_failed()
+        
+        return {
+            'line_id': line.id,
+            'state': line.state,
+            'message': 'Entrega marcada como fallida'
+        }
+    
+    def _apply_payment(self, driver, route, invoice_id=None, amount=None, collection_type=None,
+                       payment_method=None, bank_reference=None, notes=None):
+        """
+        Registra o actualiza el pago de una factura de la ruta.
+        Si ya existe una línea de cobranza pendiente para la factura, actualiza su monto.
+        Si no existe, crea una nueva línea.
+        
+        Raises:
+            UserError: si los datos no son válidos para la ruta
+        """
+        if not invoice_id:
+            raise UserError('invoice_id es requerido')
+        
+        # Permitir monto 0 o mayor
+        if amount is None or float(amount) < 0:
+            raise UserError('amount debe ser mayor o igual a cero')
+        
+        if not collection_type:
+            collection_type = 'cash'
+        
+        if not payment_method:
+            payment_method = 'cash'
+        
+        # Obtener la planilla y liquidación
+        sheet = route.sheet_id
+        if not sheet:
+            raise UserError('La ruta no tiene una planilla asociada')
+        
+        settlement = request.env['dispatch.settlement'].sudo().search([
+            ('sheet_id', '=', sheet.id)
+        ], limit=1)
+        
+        if not settlement or not settlement.collection_sheet_id:
+            raise UserError('No se encontró la hoja de cobranzas para esta ruta')
+        
+        # Verificar que la factura esté en la liquidación
+        invoice = request.env['account.move'].sudo().search([
+            ('id', '=', invoice_id),
+            ('id', 'in', settlement.invoice_ids.ids)
+        ], limit=1)
+        
+        if not invoice:
+            raise UserError('Factura no encontrada en esta liquidación')
+        
+        # Buscar si ya existe una línea de cobranza para esta factura
+        existing_line = request.env['dispatch.collection.line'].sudo().search([
+            ('collection_sheet_id', '=', settlement.collection_sheet_id.id),
+            ('invoice_id', '=', invoice.id),
+            ('state', '=', 'pending')
+        ], limit=1)
+        
+        if existing_line:
+            # Actualizar la línea existente
+            update_vals = {
+                'amount': float(amount),
+                'collection_type': collection_type,
+                'payment_method': payment_method,
+            }
+            
+            if notes:
+                update_vals['notes'] = notes
+            if bank_reference:
+                update_vals['bank_reference'] = bank_reference
+            
+            existing_line.write(update_vals)
+            collection_line = existing_line
+            message = 'Pago actualizado exitosamente'
+        else:
+            # Crear nueva línea de cobranza
+            line_vals = {
+                'collection_sheet_id': settlement.collection_sheet_id.id,
+                'invoice_id': invoice.id,
+                'amount': float(amount),
+                'collection_type': collection_type,
+                'payment_method': payment_method,
+                'registered_by': driver.id,
+                'notes': notes,
+            }
+            
+            if bank_reference:
+                line_vals['bank_reference'] = bank_reference
+            
+            collection_line = request.env['dispatch.collection.line'].sudo().create(line_vals)
+            message = 'Pago registrado exitosamente'
+        
+        return {
+            'collection_line_id': collection_line.id,
+            'invoice_id': collection_line.invoice_id.id,
+            'invoice_name': collection_line.invoice_id.name,
+            'amount': float(collection_line.amount),
+            'state': collection_line.state,
+            'message': message
+        }
+    
     @http.route('/api/dispatch/route/line/<int:line_id>/deliver', type='json', 
                 auth='public', methods=['POST'], csrf=False, cors='*')
     def mark_delivered(self, line_id, driver_id=None, signature=None, 
@@ -171,22 +476,19 @@ class DispatchAPI(http.Controller):
         
         Parámetros:
             - line_id: ID de la línea de ruta
-            - driver_id: ID del conductor
+            - driver_id: ID del conductor (opcional: debe ser el del token)
             - signature: Firma del cliente (base64, opcional)
             - receiver_name: Nombre de quien recibió
             - notes: Notas adicionales
         """
         try:
             # Autenticar conductor
-            driver, auth_error = self._authenticate_driver(driver_id=driver_id)
+            driver, auth_error = self._authenticate_driver(kwargs.get('token'), driver_id)
             if auth_error:
                 return auth_error
             
             # Buscar la línea de ruta
-            line = request.env['dispatch.route.line'].sudo().search([
-                ('id', '=', line_id),
-                ('route_id.driver_id', '=', driver.id)
-            ], limit=1)
+            line = self._find_driver_lines(driver, [line_id])
             
             if not line:
                 return {
@@ -194,28 +496,9 @@ class DispatchAPI(http.Controller):
                     'error': 'Línea de ruta no encontrada o no pertenece al conductor'
                 }
             
-            # Actualizar datos opcionales
-            vals = {}
-            if signature:
-                vals['signature'] = signature
-            if receiver_name:
-                vals['receiver_name'] = receiver_name
-            if notes:
-                vals['notes'] = notes
-            
-            if vals:
-                line.write(vals)
-            
-            # Marcar como entregado
-            line.action_mark_delivered()
-            
             return {
                 'success': True,
-                'data': {
-                    'line_id': line.id,
-                    'state': line.state,
-                    'message': 'Entrega marcada exitosamente'
-                }
+                'data': self._apply_delivery(line, signature, receiver_name, notes)
             }
         
         except (ValidationError, UserError) as e:
@@ -240,21 +523,18 @@ class DispatchAPI(http.Controller):
         
         Parámetros:
             - line_id: ID de la línea de ruta
-            - driver_id: ID del conductor
+            - driver_id: ID del conductor (opcional: debe ser el del token)
             - failure_reason: Motivo del fallo
             - notes: Notas adicionales
         """
         try:
             # Autenticar conductor
-            driver, auth_error = self._authenticate_driver(driver_id=driver_id)
+            driver, auth_error = self._authenticate_driver(kwargs.get('token'), driver_id)
             if auth_error:
                 return auth_error
             
             # Buscar la línea de ruta
-            line = request.env['dispatch.route.line'].sudo().search([
-                ('id', '=', line_id),
-                ('route_id.driver_id', '=', driver.id)
-            ], limit=1)
+            line = self._find_driver_lines(driver, [line_id])
             
             if not line:
                 return {
@@ -262,26 +542,9 @@ class DispatchAPI(http.Controller):
                     'error': 'Línea de ruta no encontrada o no pertenece al conductor'
                 }
             
-            # Actualizar motivo y notas
-            vals = {}
-            if failure_reason:
-                vals['failure_reason'] = failure_reason
-            if notes:
-                vals['notes'] = notes
-            
-            if vals:
-                line.write(vals)
-            
-            # Marcar como fallido
-            line.action_mark_failed()
-            
             return {
                 'success': True,
-                'data': {
-                    'line_id': line.id,
-                    'state': line.state,
-                    'message': 'Entrega marcada como fallida'
-                }
+                'data': self._apply_failure(line, failure_reason, notes)
             }
         
         except (ValidationError, UserError) as e:
@@ -308,7 +571,7 @@ class DispatchAPI(http.Controller):
         Si no existe, crea una nueva línea.
         
         Parámetros:
-            - driver_id: ID del conductor
+            - driver_id: ID del conductor (opcional: debe ser el del token)
             - route_id: ID de la ruta
             - invoice_id: ID de la factura (requerido)
             - amount: Monto recibido
@@ -319,7 +582,7 @@ class DispatchAPI(http.Controller):
         """
         try:
             # Autenticar conductor
-            driver, auth_error = self._authenticate_driver(driver_id=driver_id)
+            driver, auth_error = self._authenticate_driver(kwargs.get('token'), driver_id)
             if auth_error:
                 return auth_error
             
@@ -330,30 +593,8 @@ class DispatchAPI(http.Controller):
                     'error': 'route_id es requerido'
                 }
             
-            if not invoice_id:
-                return {
-                    'success': False,
-                    'error': 'invoice_id es requerido'
-                }
-            
-            # Permitir monto 0 o mayor
-            if amount is None or float(amount) < 0:
-                return {
-                    'success': False,
-                    'error': 'amount debe ser mayor o igual a cero'
-                }
-            
-            if not collection_type:
-                collection_type = 'cash'
-            
-            if not payment_method:
-                payment_method = 'cash'
-            
             # Buscar la ruta y validar que pertenezca al conductor
-            route = request.env['dispatch.route'].sudo().search([
-                ('id', '=', route_id),
-                ('driver_id', '=', driver.id)
-            ], limit=1)
+            route = self._find_driver_route(driver, route_id)
             
             if not route:
                 return {
@@ -361,87 +602,12 @@ class DispatchAPI(http.Controller):
                     'error': 'Ruta no encontrada o no pertenece al conductor'
                 }
             
-            # Obtener la planilla y liquidación
-            sheet = route.sheet_id
-            if not sheet:
-                return {
-                    'success': False,
-                    'error': 'La ruta no tiene una planilla asociada'
-                }
-            
-            settlement = request.env['dispatch.settlement'].sudo().search([
-                ('sheet_id', '=', sheet.id)
-            ], limit=1)
-            
-            if not settlement or not settlement.collection_sheet_id:
-                return {
-                    'success': False,
-                    'error': 'No se encontró la hoja de cobranzas para esta ruta'
-                }
-            
-            # Verificar que la factura esté en la liquidación
-            invoice = request.env['account.move'].sudo().search([
-                ('id', '=', invoice_id),
-                ('id', 'in', settlement.invoice_ids.ids)
-            ], limit=1)
-            
-            if not invoice:
-                return {
-                    'success': False,
-                    'error': 'Factura no encontrada en esta liquidación'
-                }
-            
-            # Buscar si ya existe una línea de cobranza para esta factura
-            existing_line = request.env['dispatch.collection.line'].sudo().search([
-                ('collection_sheet_id', '=', settlement.collection_sheet_id.id),
-                ('invoice_id', '=', invoice.id),
-                ('state', '=', 'pending')
-            ], limit=1)
-            
-            if existing_line:
-                # Actualizar la línea existente
-                update_vals = {
-                    'amount': float(amount),
-                    'collection_type': collection_type,
-                    'payment_method': payment_method,
-                }
-                
-                if notes:
-                    update_vals['notes'] = notes
-                if bank_reference:
-                    update_vals['bank_reference'] = bank_reference
-                
-                existing_line.write(update_vals)
-                collection_line = existing_line
-                message = 'Pago actualizado exitosamente'
-            else:
-                # Crear nueva línea de cobranza
-                line_vals = {
-                    'collection_sheet_id': settlement.collection_sheet_id.id,
-                    'invoice_id': invoice.id,
-                    'amount': float(amount),
-                    'collection_type': collection_type,
-                    'payment_method': payment_method,
-                    'registered_by': driver.id,
-                    'notes': notes,
-                }
-                
-                if bank_reference:
-                    line_vals['bank_reference'] = bank_reference
-                
-                collection_line = request.env['dispatch.collection.line'].sudo().create(line_vals)
-                message = 'Pago registrado exitosamente'
-            
             return {
                 'success': True,
-                'data': {
-                    'collection_line_id': collection_line.id,
-                    'invoice_id': collection_line.invoice_id.id,
-                    'invoice_name': collection_line.invoice_id.name,
-                    'amount': float(collection_line.amount),
-                    'state': collection_line.state,
-                    'message': message
-                }
+                'data': self._apply_payment(
+                    driver, route, invoice_id, amount, collection_type,
+                    payment_method, bank_reference, notes
+                )
             }
         
         except (ValidationError, UserError) as e:
@@ -457,6 +623,197 @@ class DispatchAPI(http.Controller):
                 'error': 'Error interno del servidor'
             }
     
+    # ========== EVENTOS EN LOTE (MODO SIN SEÑAL) ==========
+    
+    def _event_error(self, key, error, code):
+        """Resultado de un evento que no se aplicó"""
+        return {'key': key, 'status': 'error', 'error': error, 'code': code}
+    
+    def _apply_sync_event(self, driver, event, route, line):
+        """Aplica un evento de la app y retorna los datos de su resultado"""
+        if event['type'] == 'deliver':
+            return self._apply_delivery(
+                line, event.get('signature'), event.get('receiver_name'), event.get('notes')
+            )
+        if event['type'] == 'fail':
+            return self._apply_failure(line, event.get('failure_reason'), event.get('notes'))
+        return self._apply_payment(
+            driver, route, event.get('invoice_id'), event.get('amount'),
+            event.get('collection_type'), event.get('payment_method'),
+            event.get('bank_reference'), event.get('notes')
+        )
+    
+    @http.route('/api/dispatch/sync/events', type='json', auth='public',
+                methods=['POST'], csrf=False, cors='*')
+    def sync_events(self, driver_id=None, events=None, **kwargs):
+        """
+        Aplica en una sola llamada los eventos que la app acumuló sin señal.
+        
+        Parámetros:
+            - driver_id: ID del conductor (opcional: debe ser el del token)
+            - events: lista ordenada de eventos, cada uno con:
+                - key: clave única generada por la app (idempotencia)
+                - type: deliver, fail o payment
+                - line_id: ID de la línea de ruta (deliver y fail)
+                - route_id: ID de la ruta (payment)
+                - los mismos datos que los endpoints individuales
+                  (signature, receiver_name, failure_reason, invoice_id, amount, ...)
+        
+        Los eventos se aplican en orden, en una transacción por ruta, y cada
+        uno por separado: si uno falla, los demás se aplican igual. Un evento
+        cuya clave ya fue aplicada no se vuelve a aplicar: retorna el
+        resultado guardado con status 'duplicate', así la app puede reenviar
+        toda su cola sin riesgo.
+        
+        Retorna:
+            results: un resultado por evento, en el mismo orden, con status
+            applied, duplicate o error
+        """
+        try:
+            # Autenticar conductor (una sola vez para todo el lote)
+            driver, auth_error = self._authenticate_driver(kwargs.get('token'), driver_id)
+            if auth_error:
+                return auth_error
+            
+            if not isinstance(events, list):
+                return {'success': False, 'error': 'events debe ser una lista'}
+            if len(events) > MAX_SYNC_EVENTS:
+                return {
+                    'success': False,
+                    'error': f'Se permiten como máximo {MAX_SYNC_EVENTS} eventos por llamada'
+                }
+            
+            # Eventos ya aplicados, líneas y rutas: una consulta para cada uno
+            keys = {event.get('key') for event in events if isinstance(event, dict)}
+            keys = [key for key in keys if isinstance(key, str) and key]
+            SyncEvent = request.env['dispatch.sync.event'].sudo()
+            applied = {
+                sync_event.key: sync_event
+                for sync_event in SyncEvent.search([('driver_id', '=', driver.id), ('key', 'in', keys)])
+            }
+            
+            line_ids = set()
+            route_ids = set()
+            for event in events:
+                if not isinstance(event, dict):
+                    continue
+                try:
+                    if event.get('type') in ('deliver', 'fail'):
+                        line_ids.add(int(event.get('line_id')))
+                    elif event.get('type') == 'payment':
+                        route_ids.add(int(event.get('route_id')))
+                except (TypeError, ValueError):
+                    continue
+            lines = {line.id: line for line in self._find_driver_lines(driver, line_ids)}
+            routes = {route.id: route for route in request.env['dispatch.route'].sudo().search([
+                ('id', 'in', list(route_ids)),
+                ('driver_id', '=', driver.id)
+            ])}
+            
+            # Validar y agrupar por ruta, conservando el orden de la app
+            results = [None] * len(events)
+            first_index = {}
+            repeated = []
+            route_events = {}
+            for index, event in enumerate(events):
+                key = event.get('key') if isinstance(event, dict) else None
+                if not isinstance(key, str) or not key:
+                    results[index] = self._event_error(key, 'key es requerido', 'MISSING_KEY')
+                    continue
+                if key in applied:
+                    results[index] = {
+                        'key': key,
+                        'status': 'duplicate',
+                        'data': applied[key]._get_result(),
+                    }
+                    continue
+                if key in first_index:
+                    repeated.append((index, first_index[key]))
+                    continue
+                first_index[key] = index
+                
+                event_type = event.get('type')
+                route = line = None
+                if event_type in ('deliver', 'fail'):
+                    try:
+                        line = lines.get(int(event.get('line_id')))
+                    except (TypeError, ValueError):
+                        line = None
+                    if not line:
+                        results[index] = self._event_error(
+                            key, 'Línea de ruta no encontrada o no pertenece al conductor', 'LINE_NOT_FOUND'
+                        )
+                        continue
+                    route = line.route_id
+                elif event_type == 'payment':
+                    try:
+                        route = routes.get(int(event.get('route_id')))
+                    except (TypeError, ValueError):
+                        route = None
+                    if not route:
+                        results[index] = self._event_error(
+                            key, 'Ruta no encontrada o no pertenece al conductor', 'ROUTE_NOT_FOUND'
+                        )
+                        continue
+                else:
+                    results[index] = self._event_error(
+                        key, 'type debe ser deliver, fail o payment', 'INVALID_TYPE'
+                    )
+                    continue
+                route_events.setdefault(route.id, []).append((index, event, route, line))
+            
+            # Aplicar: una transacción por ruta y un savepoint por evento
+            for batch in route_events.values():
+                for index, event, route, line in batch:
+                    key = event['key']
+                    try:
+                        with request.env.cr.savepoint():
+                            data = self._apply_sync_event(driver, event, route, line)
+                            SyncEvent.create({
+                                'driver_id': driver.id,
+                                'key': key,
+                                'event_type': event['type'],
+                                'route_id': route.id,
+                                'result': json.dumps(data, ensure_ascii=False, default=str),
+                            })
+                        results[index] = {'key': key, 'status': 'applied', 'data': data}
+                    except UniqueViolation:
+                        # Otra llamada con la misma clave lo aplicó al mismo tiempo
+                        results[index] = {'key': key, 'status': 'duplicate', 'data': {}}
+                    except (ValidationError, UserError) as e:
+                        results[index] = self._event_error(key, str(e), 'VALIDATION_ERROR')
+                    except OperationalError:
+                        # Conflicto de concurrencia: Odoo reintenta la llamada completa
+                        # y los eventos ya confirmados se detectan como duplicados
+                        raise
+                    except Exception as e:
+                        _logger.error(f"Error en sync_events ({key}): {str(e)}", exc_info=True)
+                        results[index] = self._event_error(key, 'Error interno del servidor', 'INTERNAL_ERROR')
+                request.env.cr.commit()
+            
+            # Claves repetidas dentro del mismo lote: mismo resultado que la primera
+            for index, original in repeated:
+                result = dict(results[original])
+                if result['status'] == 'applied':
+                    result['status'] = 'duplicate'
+                results[index] = result
+            
+            applied_count = sum(1 for result in results if result['status'] == 'applied')
+            _logger.info(
+                f"📲 Conductor {driver.name}: {applied_count} de {len(events)} eventos aplicados "
+                f"en {len(route_events)} rutas"
+            )
+            return {'success': True, 'data': {'results': results}}
+        
+        except OperationalError:
+            raise
+        except Exception as e:
+            _logger.error(f"Error en sync_events: {str(e)}", exc_info=True)
+            return {
+                'success': False,
+                'error': 'Error interno del servidor'
+            }
+    
     @http.route('/api/dispatch/driver/<int:driver_id>/routes', type='http', 
                 auth='public', methods=['GET'], csrf=False, cors='*')
     def get_driver_routes(self, driver_id, date=None, state=None, **kwargs):
@@ -464,13 +821,13 @@ class DispatchAPI(http.Controller):
         Obtiene las rutas de un conductor.
         
         Parámetros:
-            - driver_id: ID del conductor
+            - driver_id: ID del conductor (debe ser el del token)
             - date: Fecha específica (YYYY-MM-DD, opcional)
             - state: Estado de las rutas (opcional)
         """
         try:
             # Autenticar conductor
-            driver, auth_error = self._authenticate_driver(driver_id=driver_id)
+            driver, auth_error = self._authenticate_driver(kwargs.get('token'), driver_id)
             if auth_error:
                 return self._response(error=auth_error, status=401)
             
@@ -8,7 +8,11 @@ from . import dispatch_sheet
 from . import dispatch_settlement
 from . import dispatch_collection_sheet
 from . import dispatch_collection_line
+from . import dispatch_sync_event
+from . import stock_move
+from . import product_product
 from . import stock_picking
 from . import sale_order
 from . import account_move
 
+from . import account_payment_term
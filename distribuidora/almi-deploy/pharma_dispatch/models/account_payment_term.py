@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+from odoo import api, fields, models
+
+# Palabras del nombre del término de pago que indican contado o crédito
+CASH_TERM_KEYWORDS = ('inmediato', 'contado', 'immediate')
+CREDIT_TERM_KEYWORDS = ('credito', 'crédito', 'credit')
+
+
+class AccountPaymentTerm(models.Model):
+    """
+    Extensión de los términos de pago para clasificar las facturas de las
+    planillas de despacho en contado o crédito.
+    """
+    _inherit = 'account.payment.term'
+    
+    dispatch_collection_type = fields.Selection([
+        ('cash', 'Al Contado'),
+        ('credit', 'Al Crédito'),
+    ], string='Tipo de Cobranza',
+       compute='_compute_dispatch_collection_type',
+       store=True,
+       readonly=False,
+       help='Clasificación de las facturas con este término en liquidaciones y hojas de cobranza. '
+            'Se propone a partir del nombre y de los días de las líneas, y puede modificarse.')
+    
+    @api.depends('name', 'line_ids.nb_days')
+    def _compute_dispatch_collection_type(self):
+        """
+        Crédito si el nombre lo indica; contado si el nombre indica pago
+        inmediato o si todas las líneas vencen a 0 días; crédito en otro caso.
+        """
+        for term in self:
+            term_name = (term.name or '').lower()
+            if any(keyword in term_name for keyword in CREDIT_TERM_KEYWORDS):
+                term.dispatch_collection_type = 'credit'
+            elif any(keyword in term_name for keyword in CASH_TERM_KEYWORDS):
+                term.dispatch_collection_type = 'cash'
+            elif term.line_ids and all(line.nb_days == 0 for line in term.line_ids):
+                term.dispatch_collection_type = 'cash'
+            else:
+                term.dispatch_collection_type = 'credit'
@@ -170,6 +170,46 @@ class DispatchCollectionLine(models.Model):
         help='Línea de ruta asociada a este pago (si aplica)'
     )
     
+    # ========== SINCRONIZACIÓN APP MÓVIL ==========
+    sync_version = fields.Integer(
+        string='Versión de Sincronización',
+        default=0,
+        readonly=True,
+        copy=False,
+        help='Versión de la ruta en la que cambió esta línea por última vez'
+    )
+    
+    def init(self):
+        # Líneas cambiadas desde una versión (sincronización de la app móvil)
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS dispatch_collection_line_sheet_sync_idx
+            ON dispatch_collection_line (collection_sheet_id, sync_version)
+        """)
+    
+    def _touch_sync(self):
+        """Marca las líneas como cambiadas para la sincronización de la app móvil"""
+        self.env['dispatch.route']._stamp_sync_version(
+            self, {line.id: line.collection_sheet_id.sheet_id.route_id.id for line in self}
+        )
+    
+    @api.model_create_multi
+    def create(self, vals_list):
+        lines = super().create(vals_list)
+        lines._touch_sync()
+        return lines
+    
+    def write(self, vals):
+        result = super().write(vals)
+        self._touch_sync()
+        return result
+    
+    def unlink(self):
+        routes = self.collection_sheet_id.sheet_id.route_id
+        result = super().unlink()
+        # La app no recibe eliminaciones por diferencia: debe descargar la ruta completa
+        routes.exists()._bump_sync_version(reset=True)
+        return result
+    
     @api.constrains('amount')
     def _check_amount(self):
         """Valida que el monto sea positivo o cero"""
@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
 
+import logging
+
 from odoo import api, fields, models, _
 from odoo.exceptions import ValidationError, UserError
 
+_logger = logging.getLogger(__name__)
+
 
 class DispatchSheet(models.Model):
     """
@@ -231,40 +235,20 @@ class DispatchSheet(models.Model):
         route = self.env['dispatch.route'].create(route_vals)
         
         # Crear líneas de ruta y generar GRE por cada pedido de las facturas
-        sequence = 10
-        pickings_to_process = self.env['stock.picking']
+        orders = self._get_route_orders()
+        self.env['dispatch.route.line'].create([{
+            'route_id': route.id,
+            'order_id': order.id,
+            'sequence': (index + 1) * 10,
+        } for index, order in enumerate(orders)])
         
-        for invoice in self.invoice_ids:
-            # Obtener el pedido de venta asociado a la factura
-            sale_order = invoice.invoice_line_ids.mapped('sale_line_ids.order_id')
-            
-            if not sale_order:
-                # Si no hay pedido asociado, continuar con la siguiente factura
-                continue
-            
-            # Si hay múltiples pedidos, tomar el primero
-            if len(sale_order) > 1:
-                sale_order = sale_order[0]
-            
-            # Verificar que el pedido esté confirmado
-            if sale_order.state not in ['sale', 'done']:
-                continue
-            
-            # Crear línea de ruta
-            self.env['dispatch.route.line'].create({
-                'route_id': route.id,
-                'order_id': sale_order.id,
-                'sequence': sequence,
-            })
-            sequence += 10
-            
-            # Obtener pickings del pedido para generar GRE
-            # Buscamos pickings de tipo delivery que estén listos o confirmados
-            pickings = sale_order.picking_ids.filtered(
-                lambda p: p.picking_type_code == 'outgoing' and 
-                         p.state in ['confirmed', 'assigned', 'waiting']
-            )
-            pickings_to_process |= pickings
+        # Obtener pickings de los pedidos para generar GRE
+        # Buscamos pickings de tipo delivery que estén listos o confirmados
+        pickings_to_process = self.env['stock.picking'].search([
+            ('sale_id', 'in', orders.ids),
+            ('picking_type_code', '=', 'outgoing'),
+            ('state', 'in', ['confirmed', 'assigned', 'waiting']),
+        ]) if orders else self.env['stock.picking']
         
         # Generar GRE automáticamente para todos los pickings
         if pickings_to_process:
@@ -289,39 +273,41 @@ class DispatchSheet(models.Model):
             'target': 'current',
         }
     
+    def _get_route_orders(self):
+        """
+        Retorna los pedidos confirmados de las facturas de la planilla, en el
+        orden de las facturas y sin repetir.
+        Si una factura tiene varios pedidos, se toma el de su primera línea.
+        Resuelve factura → pedido con unas pocas consultas para todo el lote.
+        """
+        self.ensure_one()
+        invoices = self.invoice_ids
+        lines = self.env['account.move.line'].search_fetch([
+            ('move_id', 'in', invoices.ids),
+            ('sale_line_ids', '!=', False),
+        ], ['move_id', 'sale_line_ids'], order='move_id, sequence, id')
+        lines.sale_line_ids.fetch(['order_id'])
+        lines.sale_line_ids.order_id.fetch(['state'])
+        
+        # Pedido de la primera línea de cada factura
+        order_by_invoice = {}
+        for line in lines:
+            if line.move_id.id not in order_by_invoice:
+                order_by_invoice[line.move_id.id] = line.sale_line_ids[:1].order_id
+        
+        # Solo pedidos confirmados (dict para conservar el orden sin repetir)
+        order_ids = dict.fromkeys(
+            order.id for order in (order_by_invoice.get(invoice.id) for invoice in invoices)
+            if order and order.state in ['sale', 'done']
+        )
+        return self.env['sale.order'].browse(list(order_ids))
+    
     def _generate_gre_for_pickings(self, pickings, route):
         """Prepara los pickings para GRE (sin validarlos aún)"""
-        for picking in pickings:
-            try:
-                # Asignar conductor y vehículo al picking para GRE
-                picking.write({
-                    'driver_id': route.driver_id.id,
-                    'vehicle_id': route.vehicle_id.id,
-                    'is_electronic_guide': True,
-                    'transfer_reason': '01',  # Venta por defecto
-                })
-                
-                # Verificar que el picking tenga los datos necesarios para GRE
-                if not picking.partner_id:
-                    continue
-                
-                # Preparar las cantidades (pero no validar aún)
-                if picking.state in ['confirmed', 'assigned', 'waiting']:
-                    # Reservar disponibilidad si es necesario
-                    if picking.state == 'confirmed':
-                        picking.action_assign()
-                    
-                    # Asignar cantidades done = cantidades demand
-                    for move in picking.move_ids:
-                        if not move.move_line_ids:
-                            continue
-                        for move_line in move.move_line_ids:
-                            if not move_line.quantity:
-                                move_line.quantity = move_line.reserved_uom_qty
-                
-            except Exception as e:
-                # Si hay error, continuar con los demás
-                continue
+        report = route._prepare_gre_pickings(pickings)
+        for line in report:
+            _logger.warning(f"⚠️ No se pudo preparar la GRE de {line['picking'].name}: {line['message']}")
+        return report
     
     def _create_settlement(self):
         """Crea la liquidación y hoja de cobranzas para esta planilla"""
@@ -343,32 +329,18 @@ class DispatchSheet(models.Model):
         settlement.write({'collection_sheet_id': collection_sheet.id})
         
         # Crear líneas de cobranza por cada factura con monto 0
-        # El transportista luego asignará el monto recibido
-        for invoice in self.invoice_ids:
-            # Determinar el tipo de cobranza según el tipo de factura
-            collection_type = 'cash'  # Por defecto al contado
-            
-            # Verificar si es al crédito
-            if invoice.invoice_payment_term_id:
-                term_name = (invoice.invoice_payment_term_id.name or '').lower()
-                if 'credito' in term_name or 'credit' in term_name:
-                    collection_type = 'credit'
-                elif not ('inmediato' in term_name or 'contado' in term_name or 'immediate' in term_name):
-                    # Si tiene término de pago y no es inmediato/contado, asumimos crédito
-                    collection_type = 'credit'
-            
-            # Crear línea de cobranza
-            line_vals = {
-                'collection_sheet_id': collection_sheet.id,
-                'invoice_id': invoice.id,
-                'amount': 0.0,  # Monto inicial en 0, el transportista lo actualizará
-                'collection_type': collection_type,
-                'payment_method': 'cash',  # Método por defecto
-                'state': 'pending',
-                'registered_by': self.driver_id.id,
-                'notes': _('Línea creada automáticamente para factura %s') % invoice.name,
-            }
-            self.env['dispatch.collection.line'].create(line_vals)
+        # El transportista luego asignará el monto recibido.
+        # Sin término de pago es al contado; si no, según el término (ver account.payment.term)
+        self.env['dispatch.collection.line'].create([{
+            'collection_sheet_id': collection_sheet.id,
+            'invoice_id': invoice.id,
+            'amount': 0.0,  # Monto inicial en 0, el transportista lo actualizará
+            'collection_type': invoice.invoice_payment_term_id.dispatch_collection_type or 'cash',
+            'payment_method': 'cash',  # Método por defecto
+            'state': 'pending',
+            'registered_by': self.driver_id.id,
+            'notes': _('Línea creada automáticamente para factura %s') % invoice.name,
+        } for invoice in self.invoice_ids])
         
         return settlement
     
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark de la generación de rutas desde planillas de despacho.
+
+Crea pedidos confirmados y sus facturas de prueba, arma planillas de 10, 100
+y 1000 facturas y mide el tiempo y las consultas SQL de
+dispatch.sheet.action_create_route (líneas de ruta, preparación de GRE y
+liquidación). Revierte todo al terminar (no deja datos en la base).
+
+Requiere al menos un conductor con licencia vigente y un vehículo, y el
+módulo nubefact_sunat en la ruta de addons (usa su medición común de
+benchmarks).
+
+Uso (desde el shell de Odoo):
+    odoo-bin shell -d mi_base --no-http
+    >>> from odoo.addons.pharma_dispatch.tools.benchmark_route import run
+    >>> run(env)
+"""
+
+from odoo import fields
+from odoo.addons.nubefact_sunat.tools.benchmark import benchmark_table, measure
+
+# Columnas de resultados: (título, ancho, formato)
+COLUMNS = [
+    ('Facturas', 9, ''),
+    ('Tiempo (ms)', 12, '.1f'),
+    ('Consultas', 10, ''),
+    ('ms/factura', 11, '.2f'),
+    ('Líneas', 7, ''),
+]
+
+
+def _create_invoices(env, partner, product, count):
+    """Crea `count` pedidos confirmados, cada uno con su factura confirmada"""
+    orders = env['sale.order'].create([{
+        'partner_id': partner.id,
+        'order_line': [(0, 0, {
+            'product_id': product.id,
+            'product_uom_qty': 1 + i % 5,
+            'price_unit': 10.0 + i % 7,
+        })],
+    } for i in range(count)])
+    orders.action_confirm()
+    invoices = orders._create_invoices()
+    invoices.write({'invoice_date': fields.Date.today()})
+    invoices.action_post()
+    return invoices
+
+
+def run(env, sizes=(10, 100, 1000)):
+    """Ejecuta el benchmark e imprime los resultados"""
+    driver = env['dispatch.driver'].search([('license_expired', '=', False)], limit=1)
+    vehicle = env['dispatch.vehicle'].search([], limit=1)
+    if not driver or not vehicle:
+        raise ValueError('Se necesita al menos un conductor con licencia vigente y un vehículo')
+    
+    with benchmark_table(env, COLUMNS) as print_row:
+        partner = env['res.partner'].create({
+            'name': 'Cliente Benchmark Despacho',
+            'vat': '20100070970',
+        })
+        product = env['product.product'].create({
+            'name': 'Producto Benchmark Despacho',
+            'default_code': 'BENCH-DSP',
+            'type': 'consu',
+            'weight': 0.5,
+        })
+        
+        for size in sizes:
+            sheet = env['dispatch.sheet'].create({
+                'driver_id': driver.id,
+                'vehicle_id': vehicle.id,
+                'invoice_ids': [(6, 0, _create_invoices(env, partner, product, size).ids)],
+                'state': 'confirmed',
+            })
+            # La ruta se genera una sola vez por planilla
+            elapsed, queries, _result = measure(env, sheet.action_create_route)
+            print_row(size, elapsed, queries, elapsed / size, len(sheet.route_id.line_ids))
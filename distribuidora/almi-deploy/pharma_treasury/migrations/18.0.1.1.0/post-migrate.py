@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+Completa en las facturas la referencia a su línea de planilla activa
+(account.move.settlement_sheet_line_id) y los campos guardados que dependen
+de ella, por SQL. Antes de esta versión el campo no se mantenía.
+"""
+
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    if not version:
+        return
+    
+    cr.execute("""
+        UPDATE account_move
+        SET settlement_sheet_line_id = NULL
+        WHERE settlement_sheet_line_id IS NOT NULL
+    """)
+    
+    # Si una factura quedó en varias planillas activas, se toma la línea más reciente
+    cr.execute("""
+        UPDATE account_move move
+        SET settlement_sheet_line_id = line.id,
+            settlement_sheet_id = line.sheet_id,
+            sheet_state = line.sheet_state,
+            in_settlement = TRUE
+        FROM (
+            SELECT DISTINCT ON (invoice_id) id, invoice_id, sheet_id, sheet_state
+            FROM treasury_settlement_sheet_line
+            WHERE sheet_state NOT IN ('cancelled', 'closed')
+            ORDER BY invoice_id, id DESC
+        ) line
+        WHERE move.id = line.invoice_id
+    """)
+    _logger.info(f"🧾 Facturas en planillas activas: {cr.rowcount}")
+    
+    cr.execute("""
+        UPDATE account_move
+        SET settlement_sheet_id = NULL,
+            sheet_state = NULL,
+            in_settlement = FALSE
+        WHERE settlement_sheet_line_id IS NULL
+          AND (settlement_sheet_id IS NOT NULL OR in_settlement)
+    """)
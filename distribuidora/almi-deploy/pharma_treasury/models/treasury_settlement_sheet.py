@@ -1,7 +1,19 @@
 # -*- coding: utf-8 -*-
 
+from datetime import timedelta
+
 from odoo import api, fields, models, _
 from odoo.exceptions import UserError, ValidationError
+from odoo.tools.mimetypes import guess_mimetype
+
+from .treasury_settlement_sheet_line import INACTIVE_SHEET_STATES, MAX_ERROR_INVOICES
+
+# Imágenes de evidencia subidas desde la app antes de enviar la liquidación:
+# quedan en la planilla (marcadas con esta descripción) hasta que una línea
+# de liquidación las usa
+EVIDENCE_UPLOAD_DESCRIPTION = 'settlement_evidence_upload'
+EVIDENCE_MAX_SIZE = 5 * 1024 * 1024
+EVIDENCE_UPLOAD_RETENTION_DAYS = 7
 
 
 class TreasurySettlementSheet(models.Model):
@@ -183,6 +195,20 @@ class TreasurySettlementSheet(models.Model):
             vals['name'] = self.env['ir.sequence'].next_by_code('treasury.settlement.sheet') or 'Nuevo'
         return super(TreasurySettlementSheet, self).create(vals)
     
+    def write(self, vals):
+        """Actualiza la línea activa de las facturas si la planilla se activa o desactiva"""
+        if 'state' not in vals:
+            return super().write(vals)
+        
+        active = vals['state'] not in INACTIVE_SHEET_STATES
+        changed = self.filtered(lambda sheet: (sheet.state not in INACTIVE_SHEET_STATES) != active)
+        if active:
+            # Al reactivar, sus facturas no deben estar en otra planilla activa
+            changed.line_ids._check_invoice_not_in_other_sheet()
+        result = super().write(vals)
+        changed.line_ids._sync_invoice_active_line()
+        return result
+    
     @api.depends('line_ids', 'line_ids.amount_total', 'line_ids.amount_collected',
                  'line_ids.delivery_status')
     def _compute_totals(self):
@@ -333,6 +359,7 @@ class TreasurySettlementSheet(models.Model):
             
             sheet.write({'state': 'closed'})
             sheet.message_post(body=_('Planilla cerrada'))
+        self._unlink_evidence_uploads()
     
     def action_cancel(self):
         """Cancela la planilla"""
@@ -347,6 +374,42 @@ class TreasurySettlementSheet(models.Model):
             
             sheet.write({'state': 'cancelled'})
             sheet.message_post(body=_('Planilla cancelada'))
+        self._unlink_evidence_uploads()
+    
+    # ========== EVIDENCIAS DE LA APP MÓVIL ==========
+    
+    @api.model
+    def _check_evidence_image(self, data):
+        """Valida que la evidencia sea una imagen de tamaño permitido"""
+        if not data:
+            raise ValidationError(_('La imagen de evidencia está vacía.'))
+        if len(data) > EVIDENCE_MAX_SIZE:
+            raise ValidationError(_(
+                'La imagen de evidencia supera el tamaño máximo de %s MB.'
+            ) % (EVIDENCE_MAX_SIZE // (1024 * 1024)))
+        if not guess_mimetype(data).startswith('image/'):
+            raise ValidationError(_('La evidencia debe ser una imagen.'))
+    
+    def _get_evidence_uploads_domain(self):
+        return [
+            ('res_model', '=', self._name),
+            ('res_field', '=', False),
+            ('description', '=', EVIDENCE_UPLOAD_DESCRIPTION),
+        ]
+    
+    def _unlink_evidence_uploads(self):
+        """Elimina las evidencias subidas a estas planillas que ninguna liquidación usó"""
+        self.env['ir.attachment'].sudo().search(
+            self._get_evidence_uploads_domain() + [('res_id', 'in', self.ids)]
+        ).unlink()
+    
+    @api.autovacuum
+    def _gc_evidence_uploads(self):
+        """Elimina las evidencias subidas que ninguna liquidación usó tras la retención"""
+        limit_date = fields.Datetime.now() - timedelta(days=EVIDENCE_UPLOAD_RETENTION_DAYS)
+        self.env['ir.attachment'].sudo().search(
+            self._get_evidence_uploads_domain() + [('create_date', '<', limit_date)]
+        ).unlink()
     
     def action_reset_to_draft(self):
         """Reinicia la planilla a borrador"""
@@ -392,6 +455,52 @@ class TreasurySettlementSheet(models.Model):
             'context': {'default_sheet_id': self.id},
         }
     
+    def _add_invoices(self, invoices):
+        """
+        Agrega facturas a la planilla en un solo lote.
+        Valida todo el lote de una vez, crea las líneas con un solo create
+        (los pedidos de venta se obtienen con una consulta agrupada) y los
+        totales de la planilla se recalculan una sola vez.
+        
+        Returns:
+            líneas creadas
+        """
+        self.ensure_one()
+        
+        if self.state != 'draft':
+            raise UserError(_(
+                'Solo se pueden agregar facturas a planillas en estado Borrador.'
+            ))
+        
+        invalid = invoices.filtered(
+            lambda invoice: invoice.move_type != 'out_invoice' or invoice.state != 'posted'
+        )
+        if invalid:
+            raise UserError(_(
+                'Solo se pueden agregar facturas de cliente confirmadas. Revise: %s'
+            ) % ', '.join(invalid[:MAX_ERROR_INVOICES].mapped('display_name')))
+        
+        in_sheet = invoices.filtered('settlement_sheet_line_id')
+        if in_sheet:
+            raise UserError(_(
+                'Las siguientes facturas ya están en una planilla activa: %s'
+            ) % ', '.join(
+                f"{invoice.name} ({invoice.settlement_sheet_line_id.sheet_id.name})"
+                for invoice in in_sheet[:MAX_ERROR_INVOICES]
+            ))
+        
+        # Continuar la secuencia de la planilla
+        [[last_sequence]] = self.env['treasury.settlement.sheet.line']._read_group(
+            [('sheet_id', '=', self.id)], aggregates=['sequence:max']
+        )
+        last_sequence = last_sequence or 0
+        
+        return self.env['treasury.settlement.sheet.line'].create([{
+            'sheet_id': self.id,
+            'invoice_id': invoice.id,
+            'sequence': last_sequence + 10 * index,
+        } for index, invoice in enumerate(invoices, start=1)])
+    
     def action_open_mass_invoice_selection(self):
         """Abre wizard para selección masiva de facturas"""
         self.ensure_one()
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""
+Marca como recibidos por NubeFact (account.move.sunat_submitted) los
+comprobantes sin respuesta definitiva que ya pasaron por un envío (tienen
+respuesta guardada). Los que fallaron antes de enviarse (datos incompletos)
+dejan de consultarse automáticamente.
+"""
+
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    if not version:
+        return
+    
+    cr.execute("""
+        UPDATE account_move
+        SET sunat_submitted = TRUE
+        WHERE sunat_estado IN ('sent', 'error')
+          AND sunat_response IS NOT NULL
+    """)
+    _logger.info(f"🔄 Comprobantes a consultar en NubeFact: {cr.rowcount}")
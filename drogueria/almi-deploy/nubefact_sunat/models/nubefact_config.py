@@ -1,10 +1,129 @@
 # -*- coding: utf-8 -*-
 
-from odoo import api, fields, models
+from odoo import api, fields, models, _
+from concurrent.futures import ThreadPoolExecutor
+import json
 import logging
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 _logger = logging.getLogger(__name__)
 
+# Códigos HTTP de NubeFact que se reintentan automáticamente
+# (el servidor no procesó la petición)
+RETRY_STATUS_CODES = (502, 503, 504)
+
+# Sesiones HTTP por configuración, compartidas en el proceso:
+# {(base de datos, id de configuración): (parámetros, sesión)}
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+class _JitterRetry(Retry):
+    """Retry de urllib3 que agrega una espera aleatoria al backoff exponencial"""
+    
+    def __init__(self, *args, jitter=0.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.jitter = jitter
+    
+    def new(self, **kwargs):
+        retry = super().new(**kwargs)
+        retry.jitter = self.jitter
+        return retry
+    
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        if backoff and self.jitter:
+            backoff += random.uniform(0, self.jitter)
+        return backoff
+
+
+def _build_session(pool_size, max_retries, backoff):
+    """Crea una sesión HTTP con conexiones persistentes y reintentos"""
+    # Solo se reintentan errores de conexión y respuestas 502/503/504:
+    # un timeout de lectura podría duplicar un comprobante ya recibido
+    retry = _JitterRetry(
+        total=max_retries,
+        connect=max_retries,
+        read=0,
+        status=max_retries,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=frozenset(['POST']),
+        backoff_factor=backoff,
+        jitter=backoff,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def _nubefact_post(session, url, token, payload, timeout):
+    """
+    Envía un payload a NubeFact y normaliza la respuesta.
+    No accede al ORM, por lo que puede ejecutarse en hilos secundarios.
+    
+    Args:
+        timeout: tupla (conexión, lectura) en segundos
+    
+    Returns:
+        dict con status_code, data (JSON), text, error, transient
+        (True si el fallo es temporal y tiene sentido reintentar)
+        y elapsed (duración de la llamada en segundos)
+    """
+    result = {
+        'status_code': None,
+        'data': None,
+        'text': '',
+        'error': False,
+        'transient': False,
+        'elapsed': 0.0,
+    }
+    
+    # Headers según documentación oficial de NubeFact
+    # Authorization solo contiene el token, sin prefijo
+    headers = {
+        'Authorization': token,
+        'Content-Type': 'application/json'
+    }
+    
+    start = time.monotonic()
+    try:
+        response = session.post(url, headers=headers, json=payload, timeout=timeout)
+    except requests.exceptions.RequestException as e:
+        # Timeouts y errores de conexión: se pueden reintentar
+        result.update(error=str(e), transient=True, elapsed=time.monotonic() - start)
+        return result
+    result['elapsed'] = time.monotonic() - start
+    
+    result['status_code'] = response.status_code
+    result['text'] = response.text
+    
+    if response.status_code == 200:
+        try:
+            result['data'] = response.json()
+        except ValueError:
+            result['error'] = response.text
+    else:
+        result['error'] = response.text
+        # Errores 5xx del servidor de NubeFact: se pueden reintentar
+        result['transient'] = response.status_code >= 500
+    
+    return result
+
+
+def _truncate(text, max_length):
+    """Recorta un texto para el registro de llamadas"""
+    if not text or not max_length or len(text) <= max_length:
+        return text
+    return text[:max_length] + f"... [{len(text) - max_length} caracteres omitidos]"
+
 
 class NubefactConfig(models.Model):
     _name = 'nubefact.config'
@@ -44,6 +163,114 @@ class NubefactConfig(models.Model):
         default=True
     )
     
+    # Envío en segundo plano
+    max_workers = fields.Integer(
+        string='Envíos Simultáneos',
+        default=4,
+        help='Número máximo de peticiones simultáneas a NubeFact'
+    )
+    
+    queue_batch_size = fields.Integer(
+        string='Comprobantes por Lote',
+        default=50,
+        help='Cantidad de comprobantes que la cola procesa y confirma por lote; cada ejecución '
+             'procesa lotes hasta vaciar la cola. '
+             'En el envío masivo, los resultados se guardan cada este número de comprobantes.'
+    )
+    
+    queue_max_attempts = fields.Integer(
+        string='Intentos Máximos',
+        default=5,
+        help='Intentos antes de marcar un envío en cola como fallido'
+    )
+    
+    queue_retry_delay = fields.Integer(
+        string='Espera Base de Reintento (s)',
+        default=60,
+        help='Espera antes del primer reintento. Se duplica en cada intento fallido.'
+    )
+    
+    # Consulta automática de estados
+    poll_interval = fields.Integer(
+        string='Intervalo de Consulta (min)',
+        default=30,
+        help='Espera entre dos consultas automáticas del mismo documento. '
+             'Se duplica en cada consulta sin respuesta definitiva.'
+    )
+    
+    poll_batch_size = fields.Integer(
+        string='Documentos por Consulta',
+        default=100,
+        help='Cantidad máxima de documentos que la consulta automática verifica en cada ejecución'
+    )
+    
+    poll_rate_limit = fields.Float(
+        string='Consultas por Segundo',
+        default=5.0,
+        help='Límite de consultas por segundo a NubeFact (0 = sin límite)'
+    )
+    
+    # Registro de llamadas
+    log_level = fields.Selection([
+        ('none', 'Desactivado'),
+        ('errors', 'Solo Errores'),
+        ('summary', 'Resumen'),
+        ('full', 'Completo'),
+    ], string='Registro de Llamadas', default='summary', required=True,
+       help='Resumen: guarda operación, documento, código HTTP y duración de cada llamada. '
+            'Completo: además guarda los datos enviados y la respuesta (truncados).')
+    
+    log_sample_rate = fields.Float(
+        string='Muestreo de Llamadas Exitosas',
+        default=1.0,
+        help='Fracción de llamadas exitosas que se registran (1 = todas, 0.1 = una de cada diez). '
+             'Las llamadas con error siempre se registran.'
+    )
+    
+    log_max_length = fields.Integer(
+        string='Longitud Máxima de Datos',
+        default=4000,
+        help='Caracteres máximos que se guardan de los datos enviados, la respuesta y el error'
+    )
+    
+    log_retention_days = fields.Integer(
+        string='Conservar Registros (días)',
+        default=30,
+        help='Los registros de llamadas más antiguos se eliminan automáticamente'
+    )
+    
+    # Conexión HTTP
+    pool_size = fields.Integer(
+        string='Conexiones Persistentes',
+        default=10,
+        help='Conexiones a NubeFact que se mantienen abiertas (keep-alive) y se reutilizan entre envíos'
+    )
+    
+    connect_timeout = fields.Float(
+        string='Timeout de Conexión (s)',
+        default=5.0,
+        help='Espera máxima para establecer la conexión con NubeFact'
+    )
+    
+    read_timeout = fields.Float(
+        string='Timeout de Respuesta (s)',
+        default=30.0,
+        help='Espera máxima de la respuesta de NubeFact una vez enviada la petición'
+    )
+    
+    http_max_retries = fields.Integer(
+        string='Reintentos de Conexión',
+        default=2,
+        help='Reintentos inmediatos ante errores de conexión o respuestas 502/503/504'
+    )
+    
+    http_retry_backoff = fields.Float(
+        string='Espera entre Reintentos (s)',
+        default=0.5,
+        help='Espera base entre reintentos de conexión. Crece exponencialmente y se le suma '
+             'una espera aleatoria para no saturar a NubeFact.'
+    )
+    
     _sql_constraints = [
         ('company_unique', 'UNIQUE(company_id)', 'Ya existe una configuración para esta compañía.')
     ]
@@ -54,3 +281,162 @@ class NubefactConfig(models.Model):
         # Remover espacios y @ si los hay
         url = self.api_url.strip().lstrip('@')
         return url
+    
+    @api.model
+    def _get_active_config(self, company):
+        """Retorna la configuración activa de la compañía (o vacío)"""
+        return self.search([
+            ('company_id', '=', company.id),
+            ('active', '=', True)
+        ], limit=1)
+    
+    def _get_session(self):
+        """
+        Retorna la sesión HTTP de esta configuración, compartida por todos
+        los envíos del proceso. Se recrea si cambian los parámetros.
+        """
+        self.ensure_one()
+        key = (self.env.cr.dbname, self.id)
+        params = (
+            max(self.pool_size or 1, self.max_workers or 1),
+            max(self.http_max_retries, 0),
+            max(self.http_retry_backoff, 0.0),
+        )
+        with _sessions_lock:
+            cached = _sessions.get(key)
+            if cached and cached[0] == params:
+                return cached[1]
+            if cached:
+                cached[1].close()
+            session = _build_session(*params)
+            _sessions[key] = (params, session)
+            return session
+    
+    def _get_http_client(self):
+        """
+        Retorna (sesión, url, token, timeout) para enviar a NubeFact.
+        Se leen del ORM en el hilo principal antes de usarse en otros hilos.
+        """
+        self.ensure_one()
+        timeout = (self.connect_timeout or 5.0, self.read_timeout or 30.0)
+        return self._get_session(), self.get_api_url(), self.token, timeout
+    
+    def _send_payload(self, payload):
+        """Envía un único payload a NubeFact (comprobantes, guías o consultas)"""
+        self.ensure_one()
+        return self._send_payloads([payload])[0]
+    
+    def _send_payloads(self, payloads, rate_limit=0):
+        """
+        Envía varios payloads a NubeFact en paralelo, con un máximo de
+        `max_workers` peticiones simultáneas y, opcionalmente, un máximo de
+        `rate_limit` peticiones por segundo.
+        Los valores de la configuración se leen antes de lanzar los hilos,
+        que no acceden al ORM.
+        
+        Returns:
+            lista de resultados en el mismo orden que los payloads
+        """
+        self.ensure_one()
+        if not payloads:
+            return []
+        
+        session, url, token, timeout = self._get_http_client()
+        workers = max(1, min(self.max_workers or 1, len(payloads)))
+        interval = 1.0 / rate_limit if rate_limit and rate_limit > 0 else 0.0
+        
+        if workers == 1 and not interval:
+            results = [_nubefact_post(session, url, token, payload, timeout) for payload in payloads]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = []
+                for payload in payloads:
+                    if futures and interval:
+                        # Espaciar las peticiones para respetar el límite por segundo
+                        time.sleep(interval)
+                    futures.append(executor.submit(_nubefact_post, session, url, token, payload, timeout))
+                results = [future.result() for future in futures]
+        
+        self._log_requests(payloads, results)
+        return results
+    
+    def _log_requests(self, payloads, results):
+        """
+        Registra las llamadas a NubeFact según el nivel de detalle configurado.
+        Los errores siempre se registran; las llamadas exitosas según el muestreo.
+        El volcado completo del payload solo se construye si el log DEBUG está activo.
+        Se guarda en una transacción propia, para medir también los envíos
+        fallidos cuya transacción termina revertida.
+        """
+        self.ensure_one()
+        
+        if _logger.isEnabledFor(logging.DEBUG):
+            for payload, result in zip(payloads, results):
+                _logger.debug(
+                    f"📋 NubeFact {payload.get('operacion')}: {result['elapsed']:.3f} s\n"
+                    f"Datos enviados:\n{json.dumps(payload, indent=2, ensure_ascii=False)}\n"
+                    f"Respuesta ({result['status_code']}):\n{result['text']}"
+                )
+        
+        level = self.log_level or 'summary'
+        if level == 'none':
+            return
+        
+        max_length = self.log_max_length
+        vals_list = []
+        for payload, result in zip(payloads, results):
+            if not result['error'] and (level == 'errors' or random.random() >= self.log_sample_rate):
+                continue
+            
+            serie, numero = payload.get('serie'), payload.get('numero')
+            vals = {
+                'config_id': self.id,
+                'operation': payload.get('operacion'),
+                'document': f"{serie}-{numero}" if serie and numero else False,
+                'status_code': result['status_code'] or 0,
+                'success': not result['error'],
+                'duration_ms': int(result['elapsed'] * 1000),
+                'error': _truncate(result['error'], max_length) if result['error'] else False,
+            }
+            if level == 'full':
+                vals.update({
+                    'request_payload': _truncate(json.dumps(payload, ensure_ascii=False), max_length),
+                    'response_body': _truncate(result['text'], max_length),
+                })
+            vals_list.append(vals)
+        
+        if not vals_list:
+            return
+        # Cursor propio: el registro se conserva aunque la transacción del
+        # envío se revierta (ej: UserError tras un envío fallido)
+        try:
+            with self.env.registry.cursor() as cr:
+                self.env(cr=cr)['nubefact.request.log'].sudo().create(vals_list)
+        except Exception as e:
+            _logger.warning(f"⚠️ No se pudo guardar el registro de llamadas a NubeFact: {e}")
+    
+    def action_view_latency_stats(self):
+        """Muestra los percentiles de latencia de NubeFact de los últimos 7 días"""
+        self.ensure_one()
+        stats = self.env['nubefact.request.log']._get_latency_stats(self, days=7)
+        
+        if stats:
+            message = "\n".join(
+                f"{stat['operation']}: {stat['count']} llamadas, "
+                f"promedio {stat['avg']:.0f} ms, p50 {stat['p50']:.0f} ms, "
+                f"p90 {stat['p90']:.0f} ms, p95 {stat['p95']:.0f} ms, p99 {stat['p99']:.0f} ms"
+                for stat in stats
+            )
+        else:
+            message = _('No hay llamadas registradas en los últimos 7 días.')
+        
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Latencia de NubeFact (7 días)'),
+                'message': message,
+                'type': 'info',
+                'sticky': True,
+            }
+        }
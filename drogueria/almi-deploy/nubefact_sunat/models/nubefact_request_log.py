@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+from datetime import timedelta
+
+from odoo import api, fields, models
+
+
+class NubefactRequestLog(models.Model):
+    """
+    Registro de llamadas a la API de NubeFact.
+    Guarda la duración y el resultado de cada llamada y, según el nivel
+    de detalle de la configuración, el payload y la respuesta truncados.
+    """
+    _name = 'nubefact.request.log'
+    _description = 'Registro de Llamadas a NubeFact'
+    _order = 'id desc'
+    _rec_name = 'document'
+    
+    config_id = fields.Many2one(
+        'nubefact.config',
+        string='Configuración',
+        required=True,
+        ondelete='cascade',
+        index=True
+    )
+    
+    company_id = fields.Many2one(
+        'res.company',
+        string='Compañía',
+        related='config_id.company_id',
+        store=True
+    )
+    
+    operation = fields.Char(
+        string='Operación',
+        index=True,
+        help='Operación de NubeFact (generar_comprobante, consultar_comprobante, generar_guia, ...)'
+    )
+    
+    document = fields.Char(
+        string='Documento',
+        help='Serie y número del documento enviado o consultado'
+    )
+    
+    status_code = fields.Integer(
+        string='Código HTTP',
+        help='0 si no hubo respuesta (timeout o error de conexión)'
+    )
+    
+    success = fields.Boolean(
+        string='Exitoso',
+        index=True
+    )
+    
+    duration_ms = fields.Integer(
+        string='Duración (ms)',
+        aggregator='avg'
+    )
+    
+    error = fields.Text(
+        string='Error'
+    )
+    
+    request_payload = fields.Text(
+        string='Datos Enviados'
+    )
+    
+    response_body = fields.Text(
+        string='Respuesta'
+    )
+    
+    @api.model
+    def _get_latency_stats(self, config, days=7):
+        """
+        Calcula percentiles de latencia por operación en los últimos días.
+        
+        Returns:
+            lista de dicts con operation, count, avg, p50, p90, p95 y p99 (ms)
+        """
+        self.flush_model()
+        self.env.cr.execute("""
+            SELECT operation,
+                   count(*),
+                   avg(duration_ms),
+                   percentile_cont(ARRAY[0.5, 0.9, 0.95, 0.99]) WITHIN GROUP (ORDER BY duration_ms)
+            FROM nubefact_request_log
+            WHERE config_id = %s
+              AND create_date >= %s
+            GROUP BY operation
+            ORDER BY count(*) DESC
+        """, (config.id, fields.Datetime.now() - timedelta(days=days)))
+        return [{
+            'operation': operation or '-',
+            'count': count,
+            'avg': avg or 0.0,
+            'p50': percentiles[0],
+            'p90': percentiles[1],
+            'p95': percentiles[2],
+            'p99': percentiles[3],
+        } for operation, count, avg, percentiles in self.env.cr.fetchall()]
+    
+    @api.autovacuum
+    def _gc_request_logs(self):
+        """Elimina los registros más antiguos que la retención configurada"""
+        for config in self.env['nubefact.config'].with_context(active_test=False).search([]):
+            limit_date = fields.Datetime.now() - timedelta(days=config.log_retention_days or 30)
+            self.search([
+                ('config_id', '=', config.id),
+                ('create_date', '<', limit_date),
+            ]).unlink()
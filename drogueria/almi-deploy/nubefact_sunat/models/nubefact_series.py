@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import zlib
+
+from odoo import api, models
+
+from ..tools.local_cache import LocalCache
+
+_logger = logging.getLogger(__name__)
+
+# Series electrónicas por tipo: (código de secuencia, xmlid, nombre, prefijo, nombre del diario)
+PE_SERIES = {
+    'invoice': ('account.move.invoice.pe', 'nubefact_sunat.sequence_invoice_pe',
+                'Facturas Electrónicas PE', 'F001-', 'Factura'),
+    'boleta': ('account.move.boleta.pe', 'nubefact_sunat.sequence_boleta_pe',
+               'Boletas de Venta PE', 'B001-', 'Boleta'),
+}
+
+# Diarios y secuencias por compañía y tipo de serie
+_series_cache = LocalCache(size=256, ttl=60)
+
+
+class NubefactSeriesAllocator(models.AbstractModel):
+    """
+    Asignación de números de las series electrónicas (facturas y boletas).
+    
+    Los diarios y secuencias de cada compañía se buscan una sola vez por
+    proceso (caché propia) y los números se reservan por lotes. Si la secuencia
+    está configurada "Sin huecos", la reserva bloquea la fila de la
+    secuencia hasta el fin de la transacción: los números no se pierden
+    aunque la transacción se revierta y no se repiten entre procesos.
+    """
+    _name = 'nubefact.series.allocator'
+    _description = 'Asignación de Series Electrónicas'
+    
+    @api.model
+    def _get_serie_type(self, tipo_doc):
+        """Factura para clientes con RUC, boleta para el resto"""
+        return 'invoice' if tipo_doc == '6' else 'boleta'
+    
+    # ========== DIARIOS ==========
+    
+    @api.model
+    def _clear_series_cache(self):
+        """Limpia solo la caché de diarios y secuencias de las series"""
+        _series_cache.clear()
+    
+    @api.model
+    def _lookup_journal_id(self, company_id, serie_type):
+        def compute():
+            journal = self.env['account.journal'].sudo().search([
+                ('name', '=', PE_SERIES[serie_type][4]),
+                ('type', '=', 'sale'),
+                ('company_id', '=', company_id)
+            ], limit=1, order='id')
+            return journal.id
+        return _series_cache.get(self.env, ('journal', company_id, serie_type), compute)
+    
+    @api.model
+    def _get_journal_id(self, company, serie_type):
+        """Retorna el id del diario de la serie (False si no existe)"""
+        return self._lookup_journal_id(company.id, serie_type)
+    
+    # ========== SECUENCIAS ==========
+    
+    @api.model
+    def _lookup_sequence_id(self, company_id, serie_type):
+        def compute():
+            code, xmlid = PE_SERIES[serie_type][:2]
+            sequence = self.env['ir.sequence'].sudo().search([
+                ('code', '=', code),
+                ('company_id', '=', company_id)
+            ], limit=1, order='id')
+            
+            if not sequence:
+                # Si no existe, buscar la secuencia del módulo
+                sequence = self.env.ref(xmlid, raise_if_not_found=False)
+            return sequence.id if sequence else False
+        return _series_cache.get(self.env, ('sequence', company_id, serie_type), compute)
+    
+    @api.model
+    def _get_sequence(self, company, serie_type):
+        """Obtiene o crea la secuencia de la serie para la compañía"""
+        sequence_id = self._lookup_sequence_id(company.id, serie_type)
+        sequence = self.env['ir.sequence'].sudo().browse(sequence_id).exists()
+        if sequence:
+            return sequence
+        
+        # La secuencia no existe (o fue eliminada): crearla una sola vez.
+        # El bloqueo evita que dos procesos la creen a la vez.
+        code, xmlid, name, prefix = PE_SERIES[serie_type][:4]
+        self.env.cr.execute(
+            "SELECT pg_advisory_xact_lock(%s)",
+            (zlib.crc32(f"{code}-{company.id}".encode()),)
+        )
+        self._clear_series_cache()
+        sequence = self.env['ir.sequence'].sudo().browse(self._lookup_sequence_id(company.id, serie_type))
+        if not sequence:
+            sequence = self.env['ir.sequence'].sudo().create({
+                'name': name,
+                'code': code,
+                'prefix': prefix,
+                'padding': 6,
+                'number_increment': 1,
+                'number_next': 1,
+                'implementation': 'standard',
+                'company_id': company.id,
+            })
+            self._clear_series_cache()
+            _logger.info(f"✅ Secuencia {name} creada para {company.name}")
+        return sequence
+    
+    # ========== RESERVA DE NÚMEROS ==========
+    
+    @api.model
+    def _reserve_names(self, company, serie_type, count):
+        """
+        Reserva `count` números consecutivos de la serie.
+        
+        Returns:
+            lista de nombres (ej: F001-000123) en orden
+        """
+        if count <= 0:
+            return []
+        sequence = self._get_sequence(company, serie_type)
+        if sequence.use_date_range:
+            # Secuencias por rango de fechas: usar el mecanismo estándar de Odoo
+            return [sequence.next_by_id() for _i in range(count)]
+        return [sequence.get_next_char(number) for number in self._reserve_numbers(sequence, count)]
+    
+    @api.model
+    def _reserve_numbers(self, sequence, count):
+        """Reserva `count` números de la secuencia con una sola consulta"""
+        if sequence.implementation == 'no_gap':
+            # Sin huecos: el UPDATE bloquea la fila hasta el fin de la transacción.
+            # Otro proceso que reserve en la misma serie espera (o Odoo reintenta
+            # su transacción si hubo un conflicto de serialización).
+            self.env.cr.execute("""
+                UPDATE ir_sequence
+                SET number_next = number_next + number_increment * %s
+                WHERE id = %s
+                RETURNING number_next - number_increment * %s, number_increment
+            """, (count, sequence.id, count))
+            first, increment = self.env.cr.fetchone()
+            sequence.invalidate_recordset(['number_next', 'number_next_actual'])
+            return [first + increment * i for i in range(count)]
+        
+        # Estándar: secuencia de PostgreSQL, sin bloqueos (puede dejar huecos si se revierte)
+        self.env.cr.execute(
+            "SELECT nextval(%s) FROM generate_series(1, %s)",
+            (f"ir_sequence_{sequence.id:03d}", count)
+        )
+        return [row[0] for row in self.env.cr.fetchall()]
+
+
+class AccountJournal(models.Model):
+    _inherit = 'account.journal'
+    
+    @api.model_create_multi
+    def create(self, vals_list):
+        journals = super().create(vals_list)
+        # Diarios de series electrónicas cacheados en nubefact.series.allocator
+        self.env['nubefact.series.allocator']._clear_series_cache()
+        return journals
+    
+    def write(self, vals):
+        result = super().write(vals)
+        if {'name', 'type', 'company_id', 'active'} & set(vals):
+            self.env['nubefact.series.allocator']._clear_series_cache()
+        return result
+    
+    def unlink(self):
+        result = super().unlink()
+        self.env['nubefact.series.allocator']._clear_series_cache()
+        return result
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+from odoo import api, fields, models
+
+from ..tools.local_cache import LocalCache
+
+# Mapeo por defecto de nombres de unidades de Odoo a códigos SUNAT (Catálogo 03).
+# Solo se usa para proponer el código al crear o instalar; luego manda el código
+# guardado en cada unidad de medida.
+SUNAT_UOM_NAME_MAP = {
+    # Unidades
+    'unit': 'NIU',
+    'units': 'NIU',
+    'unidad': 'NIU',
+    'unidades': 'NIU',
+    'u': 'NIU',
+    'und': 'NIU',
+    'pieza': 'NIU',
+    'piezas': 'NIU',
+    
+    # Peso
+    'kg': 'KGM',
+    'kgs': 'KGM',
+    'kilogramo': 'KGM',
+    'kilogramos': 'KGM',
+    'g': 'GRM',
+    'gramo': 'GRM',
+    'gramos': 'GRM',
+    't': 'TNE',
+    'ton': 'TNE',
+    'tonelada': 'TNE',
+    'toneladas': 'TNE',
+    'lb': 'LBR',
+    'lbs': 'LBR',
+    'libra': 'LBR',
+    
+    # Longitud
+    'm': 'MTR',
+    'metro': 'MTR',
+    'metros': 'MTR',
+    'cm': 'CMT',
+    'centimetro': 'CMT',
+    'centímetro': 'CMT',
+    'centimetros': 'CMT',
+    'mm': 'MMT',
+    'milimetro': 'MMT',
+    'milimetros': 'MMT',
+    
+    # Volumen
+    'l': 'LTR',
+    'litro': 'LTR',
+    'litros': 'LTR',
+    'ml': 'MLT',
+    'mililitro': 'MLT',
+    'mililitros': 'MLT',
+    'gal': 'GLL',
+    'galon': 'GLL',
+    'galón': 'GLL',
+    
+    # Cantidad
+    'dozens': 'DZN',
+    'docena': 'DZN',
+    'docenas': 'DZN',
+    'caja': 'BX',
+    'cajas': 'BX',
+    'paquete': 'PK',
+    'paquetes': 'PK',
+    'pack': 'PK',
+    'bolsa': 'BG',
+    'bolsas': 'BG',
+    'millar': 'MIL',
+    'millares': 'MIL',
+    
+    # Servicios
+    'servicio': 'ZZ',
+    'servicios': 'ZZ',
+    'hours': 'HUR',
+    'hora': 'HUR',
+    'horas': 'HUR',
+    'days': 'DAY',
+    'dia': 'DAY',
+    'dias': 'DAY',
+    'mes': 'MON',
+    'meses': 'MON',
+}
+
+
+# Códigos SUNAT por unidad de medida
+_sunat_code_cache = LocalCache(size=8, ttl=60)
+
+
+class UomUom(models.Model):
+    _inherit = 'uom.uom'
+    
+    sunat_code = fields.Char(
+        string='Código SUNAT',
+        compute='_compute_sunat_code',
+        store=True,
+        readonly=False,
+        precompute=True,
+        help='Código de la unidad de medida según el Catálogo 03 de SUNAT (ej: NIU, KGM, BX). '
+             'Se propone a partir del nombre y puede modificarse.'
+    )
+    
+    @api.depends('name')
+    def _compute_sunat_code(self):
+        for uom in self:
+            # No sobrescribir un código ya asignado
+            if not uom.sunat_code:
+                uom.sunat_code = SUNAT_UOM_NAME_MAP.get((uom.name or '').lower().strip(), False)
+    
+    @api.model
+    def _get_sunat_code_map(self):
+        """Retorna {id de unidad: código SUNAT}, cacheado por proceso"""
+        def compute():
+            uoms = self.sudo().with_context(active_test=False).search_read(
+                [('sunat_code', '!=', False)], ['sunat_code']
+            )
+            return {uom['id']: uom['sunat_code'].strip().upper() for uom in uoms}
+        return _sunat_code_cache.get(self.env, 'sunat_code_map', compute)
+    
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        _sunat_code_cache.clear()
+        return records
+    
+    def write(self, vals):
+        result = super().write(vals)
+        if 'sunat_code' in vals or 'name' in vals:
+            _sunat_code_cache.clear()
+        return result
+    
+    def unlink(self):
+        result = super().unlink()
+        _sunat_code_cache.clear()
+        return result
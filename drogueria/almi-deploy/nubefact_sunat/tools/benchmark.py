@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Medición común de los benchmarks (tiempo y consultas SQL con la caché fría).
+
+Cada benchmark solo arma sus datos de prueba y llama a measure() dentro de
+benchmark_table(), que imprime la tabla de resultados y revierte todo al
+terminar (no deja datos en la base).
+"""
+
+import time
+from contextlib import contextmanager
+
+# Columnas de los benchmarks por cantidad de líneas: (título, ancho, formato)
+LINE_COLUMNS = [
+    ('Líneas', 8, ''),
+    ('Tiempo (ms)', 12, '.1f'),
+    ('Consultas', 10, ''),
+    ('ms/línea', 10, '.3f'),
+]
+
+
+def measure(env, func, repeat=1):
+    """
+    Ejecuta func() `repeat` veces con la caché del entorno vacía.
+    Retorna (mejor tiempo en ms, consultas SQL, resultado de la última ejecución)
+    """
+    best = None
+    queries = 0
+    result = None
+    for _i in range(repeat):
+        env.invalidate_all()
+        count_before = env.cr.sql_log_count
+        start = time.perf_counter()
+        result = func()
+        env.flush_all()
+        elapsed = (time.perf_counter() - start) * 1000
+        queries = env.cr.sql_log_count - count_before
+        best = elapsed if best is None else min(best, elapsed)
+    return best, queries, result
+
+
+@contextmanager
+def benchmark_table(env, columns=LINE_COLUMNS):
+    """
+    Imprime el encabezado y entrega la función que imprime cada fila.
+    Al salir revierte la transacción, aunque el benchmark falle.
+    """
+    def print_row(*values):
+        print(' '.join(
+            f"{value:>{width}{fmt}}" for value, (_title, width, fmt) in zip(values, columns)
+        ))
+    
+    try:
+        print(' '.join(f"{title:>{width}}" for title, width, _fmt in columns))
+        yield print_row
+    finally:
+        env.cr.rollback()
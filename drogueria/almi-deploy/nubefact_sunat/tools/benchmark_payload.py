@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark de la construcción de payloads de NubeFact.
+
+Crea y confirma facturas de prueba con 1, 100 y 1000 líneas, mide el tiempo
+y las consultas SQL de _prepare_nubefact_invoice_payloads con la caché fría
+y revierte todo al terminar (no deja datos en la base).
+
+Uso (desde el shell de Odoo):
+    odoo-bin shell -d mi_base --no-http
+    >>> from odoo.addons.nubefact_sunat.tools.benchmark_payload import run
+    >>> run(env)
+"""
+
+from odoo import fields
+
+from .benchmark import benchmark_table, measure
+
+
+def _create_invoice(env, partner, product, line_count):
+    """Crea y confirma una factura de venta con `line_count` líneas"""
+    move = env['account.move'].create({
+        'move_type': 'out_invoice',
+        'partner_id': partner.id,
+        'invoice_date': fields.Date.today(),
+        'invoice_line_ids': [(0, 0, {
+            'product_id': product.id,
+            'name': f"{product.name} {i}",
+            'quantity': 1 + i % 5,
+            'price_unit': 10.0 + i % 7,
+        }) for i in range(line_count)],
+    })
+    move.action_post()
+    return move
+
+
+def _measure(env, moves, repeat):
+    """Retorna (mejor tiempo en ms, consultas SQL) de construir los payloads"""
+    elapsed, queries, (_payloads, errors) = measure(
+        env, moves._prepare_nubefact_invoice_payloads, repeat
+    )
+    if errors:
+        raise ValueError(f"No se pudieron preparar los payloads: {errors}")
+    return elapsed, queries
+
+
+def run(env, sizes=(1, 100, 1000), repeat=3):
+    """Ejecuta el benchmark e imprime los resultados"""
+    with benchmark_table(env) as print_row:
+        partner = env['res.partner'].create({
+            'name': 'Cliente Benchmark NubeFact',
+            'vat': '20100070970',
+        })
+        product = env['product.product'].create({
+            'name': 'Producto Benchmark NubeFact',
+            'default_code': 'BENCH-001',
+        })
+        
+        for size in sizes:
+            move = _create_invoice(env, partner, product, size)
+            elapsed, queries = _measure(env, move, repeat)
+            print_row(size, elapsed, queries, elapsed / size)
+        
+        # Lote de facturas: el número de consultas no debe crecer por factura
+        moves = env['account.move'].browse([
+            _create_invoice(env, partner, product, 100).id for _i in range(10)
+        ])
+        elapsed, queries = _measure(env, moves, repeat)
+        print(f"\n10 facturas × 100 líneas: {elapsed:.1f} ms, {queries} consultas")
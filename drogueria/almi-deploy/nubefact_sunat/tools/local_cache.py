@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Caché en memoria propia de un modelo, separada de la caché del registro.
+
+Limpiarla no vacía la caché general de Odoo (reglas de acceso, vistas, etc.)
+ni obliga a los demás procesos a invalidar la suya. A cambio, cada proceso
+tiene su copia: se limpia de inmediato en el proceso que hizo el cambio y,
+en los demás, un dato modificado sigue vigente hasta que vence (`ttl`
+segundos como máximo). Usarla solo para datos de configuración que cambian
+poco y donde ese retraso es aceptable.
+"""
+
+import time
+
+from odoo.tools.lru import LRU
+
+
+class LocalCache:
+    
+    def __init__(self, size, ttl):
+        self._lru = LRU(size)
+        self._ttl = ttl
+    
+    def get(self, env, key, compute):
+        """Valor de `key` para la base de `env`; si no está o venció, lo calcula con compute()"""
+        full_key = (env.cr.dbname, key)
+        now = time.monotonic()
+        entry = self._lru.get(full_key)
+        if entry and entry[0] > now:
+            return entry[1]
+        value = compute()
+        self._lru[full_key] = (now + self._ttl, value)
+        return value
+    
+    def clear(self):
+        self._lru.clear()
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Precalcula el peso de los movimientos de stock (stock.move.dispatch_weight)
+por SQL y por bloques, para que la actualización no lo calcule con el ORM
+registro por registro. Luego recalcula el peso total de los pickings
+abiertos. Los pickings hechos o cancelados conservan su peso guardado
+(pudo editarse a mano para la guía).
+"""
+
+import logging
+
+_logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 50000
+
+
+def _id_range(cr, table):
+    cr.execute(f"SELECT min(id), max(id) FROM {table}")
+    return cr.fetchone()
+
+
+def migrate(cr, version):
+    if not version:
+        return
+    
+    cr.execute("ALTER TABLE stock_move ADD COLUMN IF NOT EXISTS dispatch_weight numeric")
+    
+    # Peso de los movimientos: cantidad realizada si está hecho, demandada si no
+    first, last = _id_range(cr, 'stock_move')
+    if first is not None:
+        for start in range(first, last + 1, CHUNK_SIZE):
+            cr.execute("""
+                UPDATE stock_move sm
+                SET dispatch_weight = COALESCE(pp.weight, 0) *
+                    CASE WHEN sm.state = 'done' THEN COALESCE(sm.quantity, 0)
+                         ELSE COALESCE(sm.product_uom_qty, 0) END
+                FROM product_product pp
+                WHERE pp.id = sm.product_id
+                  AND sm.id >= %s AND sm.id < %s
+            """, (start, start + CHUNK_SIZE))
+            _logger.info(f"⚖️ Peso de movimientos: ids {start} a {start + CHUNK_SIZE - 1} ({cr.rowcount} actualizados)")
+    
+    # Peso total de los pickings abiertos
+    first, last = _id_range(cr, 'stock_picking')
+    if first is not None:
+        for start in range(first, last + 1, CHUNK_SIZE):
+            cr.execute("""
+                UPDATE stock_picking sp
+                SET total_weight = COALESCE((
+                    SELECT sum(sm.dispatch_weight)
+                    FROM stock_move sm
+                    WHERE sm.picking_id = sp.id
+                ), 0)
+                WHERE sp.state NOT IN ('done', 'cancel')
+                  AND sp.id >= %s AND sp.id < %s
+            """, (start, start + CHUNK_SIZE))
+            _logger.info(f"⚖️ Peso de pickings: ids {start} a {start + CHUNK_SIZE - 1} ({cr.rowcount} actualizados)")
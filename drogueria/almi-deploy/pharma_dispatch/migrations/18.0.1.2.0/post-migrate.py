@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+Recalcula por SQL los contadores por estado de las rutas que quedaron en
+NULL (rutas creadas después de que los contadores dejaron de ser campos
+calculados y antes de que tuvieran valor por defecto).
+"""
+
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    if not version:
+        return
+    
+    cr.execute("""
+        UPDATE dispatch_route route
+        SET pending_orders = (
+                SELECT count(*) FROM dispatch_route_line line
+                WHERE line.route_id = route.id AND line.state = 'pending'),
+            delivered_orders = (
+                SELECT count(*) FROM dispatch_route_line line
+                WHERE line.route_id = route.id AND line.state = 'delivered'),
+            failed_orders = (
+                SELECT count(*) FROM dispatch_route_line line
+                WHERE line.route_id = route.id AND line.state = 'failed')
+        WHERE route.pending_orders IS NULL
+           OR route.delivered_orders IS NULL
+           OR route.failed_orders IS NULL
+    """)
+    _logger.info(f"🚚 Contadores de rutas recalculados: {cr.rowcount}")
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""
+Inicializa en 0 las versiones de sincronización de la app móvil que
+quedaron en NULL (rutas, líneas de ruta y líneas de cobranza creadas
+antes de que estos campos tuvieran valor por defecto).
+"""
+
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    if not version:
+        return
+    
+    cr.execute("""
+        UPDATE dispatch_route
+        SET sync_version = COALESCE(sync_version, 0),
+            sync_reset_version = COALESCE(sync_reset_version, 0)
+        WHERE sync_version IS NULL OR sync_reset_version IS NULL
+    """)
+    _logger.info(f"🔄 Versiones de sincronización de rutas inicializadas: {cr.rowcount}")
+    
+    for table in ('dispatch_route_line', 'dispatch_collection_line'):
+        cr.execute(f"UPDATE {table} SET sync_version = 0 WHERE sync_version IS NULL")
+        _logger.info(f"🔄 Versiones de sincronización de {table} inicializadas: {cr.rowcount}")
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+"""
+Marca como recibidas por NubeFact (stock.picking.gre_submitted) las guías
+cuyo envío se cortó sin respuesta (error sin respuesta guardada). Las que
+NubeFact respondió con un error ya no se consultan automáticamente.
+"""
+
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    if not version:
+        return
+    
+    cr.execute("""
+        UPDATE stock_picking
+        SET gre_submitted = TRUE
+        WHERE is_electronic_guide
+          AND gre_state = 'rejected'
+          AND gre_sent_date IS NULL
+          AND gre_response IS NULL
+    """)
+    _logger.info(f"🔄 Guías a consultar en NubeFact: {cr.rowcount}")
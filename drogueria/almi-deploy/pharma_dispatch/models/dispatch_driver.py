@@ -1,8 +1,15 @@
 # -*- coding: utf-8 -*-
 
+import hashlib
+import secrets
+from datetime import timedelta
+
 from odoo import api, fields, models, _
 from odoo.exceptions import ValidationError
 
+# Vigencia del token de acceso a la API de la app móvil
+API_TOKEN_VALIDITY_DAYS = 90
+
 
 class DispatchDriver(models.Model):
     """
@@ -103,6 +110,7 @@ class DispatchDriver(models.Model):
         string='Usuario de Sistema',
         readonly=True,
         copy=False,
+        index='btree_not_null',
         help='Usuario de Odoo asociado para acceso a la aplicación móvil'
     )
     
@@ -147,6 +155,23 @@ class DispatchDriver(models.Model):
         help='Rutas de reparto asignadas'
     )
     
+    # ========== ACCESO A LA API ==========
+    api_token_hash = fields.Char(
+        string='Hash del Token de API',
+        readonly=True,
+        copy=False,
+        index='btree_not_null',
+        groups='base.group_system',
+        help='SHA-256 del token de la app móvil (el token no se guarda)'
+    )
+    
+    api_token_expiry = fields.Datetime(
+        string='Vencimiento del Token de API',
+        readonly=True,
+        copy=False,
+        help='Fecha y hora en que vence el token de la app móvil'
+    )
+    
     # ========== CAMPOS COMPUTADOS ==========
     vehicle_count = fields.Integer(
         string='Cantidad de Vehículos',
@@ -219,6 +244,73 @@ class DispatchDriver(models.Model):
         
         return result
     
+    # ========== TOKENS DE LA API ==========
+    
+    @api.model
+    def _hash_api_token(self, token):
+        return hashlib.sha256(token.encode()).hexdigest()
+    
+    @api.model
+    def _authenticate_api_token(self, token):
+        """
+        Retorna el conductor (sudo) del token si es válido y no venció, o vacío.
+        El token se busca por su hash (indexado) en cada llamada, para que un
+        token revocado o un conductor archivado dejen de servir de inmediato
+        en todos los procesos.
+        """
+        if not token or not isinstance(token, str):
+            return self.sudo().browse()
+        return self.sudo().search([
+            ('api_token_hash', '=', self._hash_api_token(token)),
+            ('api_token_expiry', '>=', fields.Datetime.now()),
+        ], limit=1)
+    
+    @api.model
+    def _get_driver_for_user(self, user):
+        """Conductor (sudo) asociado al usuario, o vacío"""
+        return self.sudo().search([('user_id', '=', user.id)], limit=1)
+    
+    def _generate_api_token(self):
+        """
+        Genera un nuevo token para la app móvil y revoca el anterior.
+        
+        Returns:
+            (token, vencimiento). El token solo se conoce en este momento:
+            se guarda únicamente su hash.
+        """
+        self.ensure_one()
+        token = secrets.token_urlsafe(32)
+        expiry = fields.Datetime.now() + timedelta(days=API_TOKEN_VALIDITY_DAYS)
+        self.sudo().write({
+            'api_token_hash': self._hash_api_token(token),
+            'api_token_expiry': expiry,
+        })
+        return token, expiry
+    
+    def action_generate_api_token(self):
+        """Genera el token de la app móvil y lo muestra una sola vez"""
+        self.ensure_one()
+        token, expiry = self._generate_api_token()
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Token de API de %s') % self.name,
+                'message': _('Copie el token, no se volverá a mostrar: %s (vence el %s)') % (
+                    token, fields.Datetime.to_string(expiry)
+                ),
+                'type': 'warning',
+                'sticky': True,
+            }
+        }
+    
+    def action_revoke_api_token(self):
+        """Revoca el token de la app móvil"""
+        self.sudo().write({
+            'api_token_hash': False,
+            'api_token_expiry': False,
+        })
+    
     @api.depends('license_expiry_date')
     def _compute_license_expired(self):
         """Calcula si la licencia está vencida"""
@@ -1,8 +1,18 @@
 # -*- coding: utf-8 -*-
 
+import logging
+from collections import defaultdict
+
+from psycopg2 import errors
+
 from odoo import api, fields, models, _
 from odoo.exceptions import ValidationError, UserError
 
+_logger = logging.getLogger(__name__)
+
+# Máximo de guías con error que se detallan en la notificación
+GRE_REPORT_MAX_LINES = 10
+
 
 class DispatchRoute(models.Model):
     """
@@ -83,23 +93,26 @@ class DispatchRoute(models.Model):
     
     pending_orders = fields.Integer(
         string='Pedidos Pendientes',
-        compute='_compute_totals',
-        store=True,
-        help='Número de pedidos pendientes de entrega'
+        default=0,
+        readonly=True,
+        copy=False,
+        help='Número de pedidos pendientes de entrega (se actualiza con cada cambio de estado de las líneas)'
     )
     
     delivered_orders = fields.Integer(
         string='Pedidos Entregados',
-        compute='_compute_totals',
-        store=True,
-        help='Número de pedidos entregados'
+        default=0,
+        readonly=True,
+        copy=False,
+        help='Número de pedidos entregados (se actualiza con cada cambio de estado de las líneas)'
     )
     
     failed_orders = fields.Integer(
         string='Pedidos Fallidos',
-        compute='_compute_totals',
-        store=True,
-        help='Número de pedidos no entregados'
+        default=0,
+        readonly=True,
+        copy=False,
+        help='Número de pedidos no entregados (se actualiza con cada cambio de estado de las líneas)'
     )
     
     total_weight = fields.Float(
@@ -135,6 +148,24 @@ class DispatchRoute(models.Model):
         help='Notas adicionales sobre la ruta'
     )
     
+    # ========== SINCRONIZACIÓN APP MÓVIL ==========
+    sync_version = fields.Integer(
+        string='Versión de Sincronización',
+        default=0,
+        readonly=True,
+        copy=False,
+        help='Contador de cambios de la ruta, sus líneas y sus líneas de cobranza'
+    )
+    
+    sync_reset_version = fields.Integer(
+        string='Versión de Reinicio',
+        default=0,
+        readonly=True,
+        copy=False,
+        help='Versión del último cambio que la app no puede aplicar por diferencia '
+             '(líneas eliminadas): los clientes con una versión anterior deben descargar la ruta completa'
+    )
+    
     @api.model_create_multi
     def create(self, vals_list):
         """Genera número secuencial al crear"""
@@ -143,23 +174,125 @@ class DispatchRoute(models.Model):
                 vals['name'] = self.env['ir.sequence'].next_by_code('dispatch.route') or 'Nuevo'
         return super(DispatchRoute, self).create(vals_list)
     
-    @api.depends('line_ids', 'line_ids.state', 'line_ids.order_id')
+    def write(self, vals):
+        result = super().write(vals)
+        # Cambios de la cabecera de la ruta para la app móvil
+        self._bump_sync_version()
+        return result
+    
+    def _bump_sync_version(self, reset=False):
+        """
+        Incrementa la versión de sincronización de las rutas con un UPDATE atómico.
+        
+        Args:
+            reset: marcar la nueva versión como reinicio (la app debe descargar la ruta completa)
+        
+        Returns:
+            {id de ruta: versión nueva}
+        """
+        if not self:
+            return {}
+        reset_sql = ', sync_reset_version = COALESCE(sync_version, 0) + 1' if reset else ''
+        self.env.cr.execute(f"""
+            UPDATE dispatch_route
+            SET sync_version = COALESCE(sync_version, 0) + 1{reset_sql}
+            WHERE id IN %s
+            RETURNING id, sync_version
+        """, (tuple(self.ids),))
+        versions = dict(self.env.cr.fetchall())
+        self.invalidate_recordset(['sync_version', 'sync_reset_version'])
+        return versions
+    
+    @api.model
+    def _stamp_sync_version(self, records, route_by_record):
+        """
+        Marca los registros (líneas de ruta o de cobranza) con la nueva versión
+        de su ruta, para que la app los reciba en la siguiente sincronización.
+        
+        Args:
+            records: registros modificados (con columna sync_version)
+            route_by_record: {id de registro: id de ruta}
+        """
+        record_ids_by_route = defaultdict(list)
+        for record_id, route_id in route_by_record.items():
+            if route_id:
+                record_ids_by_route[route_id].append(record_id)
+        if not record_ids_by_route:
+            return
+        
+        versions = self.browse(list(record_ids_by_route))._bump_sync_version()
+        for route_id, record_ids in record_ids_by_route.items():
+            self.env.cr.execute(
+                f'UPDATE "{records._table}" SET sync_version = %s WHERE id IN %s',
+                (versions[route_id], tuple(record_ids))
+            )
+        records.invalidate_recordset(['sync_version'])
+    
+    @api.depends('line_ids', 'line_ids.order_id.dispatch_weight')
     def _compute_totals(self):
-        """Calcula totales de la ruta"""
+        """
+        Calcula total de pedidos y peso de la ruta (peso precalculado por pedido).
+        No depende del estado de las líneas: los contadores por estado se
+        actualizan por diferencia en dispatch.route.line.
+        """
         for route in self:
             route.total_orders = len(route.line_ids)
-            route.pending_orders = len(route.line_ids.filtered(lambda l: l.state == 'pending'))
-            route.delivered_orders = len(route.line_ids.filtered(lambda l: l.state == 'delivered'))
-            route.failed_orders = len(route.line_ids.filtered(lambda l: l.state == 'failed'))
-            
-            # Calcular peso total desde los pedidos
-            total_weight = 0.0
-            for line in route.line_ids:
-                if line.order_id:
-                    for order_line in line.order_id.order_line:
-                        if order_line.product_id.weight:
-                            total_weight += order_line.product_id.weight * order_line.product_uom_qty
-            route.total_weight = total_weight
+            route.total_weight = sum(route.line_ids.order_id.mapped('dispatch_weight'))
+    
+    def _apply_line_counter_deltas(self, deltas):
+        """
+        Suma a los contadores por estado las diferencias indicadas, con un
+        UPDATE atómico por ruta (costo constante, sin recorrer las líneas).
+        
+        Args:
+            deltas: {id de ruta: {estado de línea: diferencia}}
+        """
+        for route_id, delta in deltas.items():
+            if not any(delta.values()):
+                continue
+            self.env.cr.execute("""
+                UPDATE dispatch_route
+                SET pending_orders = COALESCE(pending_orders, 0) + %s,
+                    delivered_orders = COALESCE(delivered_orders, 0) + %s,
+                    failed_orders = COALESCE(failed_orders, 0) + %s
+                WHERE id = %s
+            """, (delta.get('pending', 0), delta.get('delivered', 0), delta.get('failed', 0), route_id))
+        self.browse(list(deltas)).invalidate_recordset(['pending_orders', 'delivered_orders', 'failed_orders'])
+    
+    def _recompute_line_counters(self):
+        """Recalcula desde cero los contadores por estado (una consulta agrupada)"""
+        self.env['dispatch.route.line'].flush_model(['route_id', 'state'])
+        counts = self.env['dispatch.route.line']._read_group(
+            [('route_id', 'in', self.ids)],
+            ['route_id', 'state'],
+            ['__count'],
+        )
+        totals = {route.id: {'pending': 0, 'delivered': 0, 'failed': 0} for route in self}
+        for route, state, count in counts:
+            totals[route.id][state] = count
+        for route in self:
+            route.write({
+                'pending_orders': totals[route.id]['pending'],
+                'delivered_orders': totals[route.id]['delivered'],
+                'failed_orders': totals[route.id]['failed'],
+            })
+    
+    def action_recompute_totals(self):
+        """Reparación: recalcula todos los totales de las rutas desde sus líneas"""
+        self._recompute_line_counters()
+        self.env.add_to_compute(self._fields['total_orders'], self)
+        self.env.add_to_compute(self._fields['zone_ids'], self)
+        self.flush_recordset()
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Totales Recalculados'),
+                'message': _('Se recalcularon los totales de %s ruta(s).') % len(self),
+                'type': 'success',
+                'sticky': False,
+            }
+        }
     
     @api.depends('line_ids', 'line_ids.partner_id', 'line_ids.partner_id.sale_zone_id')
     def _compute_zones(self):
@@ -168,29 +301,61 @@ class DispatchRoute(models.Model):
             zones = route.line_ids.mapped('partner_id.sale_zone_id')
             route.zone_ids = [(6, 0, zones.ids)]
     
+    def init(self):
+        # Un conductor y un vehículo solo pueden tener una ruta activa por día
+        for column in ('driver_id', 'vehicle_id'):
+            index_name = f"dispatch_route_{column}_date_active_uniq"
+            self.env.cr.execute(f"""
+                SELECT 1 FROM dispatch_route
+                WHERE state NOT IN ('draft', 'cancelled')
+                GROUP BY {column}, route_date
+                HAVING count(*) > 1
+                LIMIT 1
+            """)
+            if self.env.cr.fetchone():
+                _logger.error(
+                    f"❌ No se creó el índice {index_name}: hay rutas activas que comparten "
+                    f"{column} y fecha. Corrija las rutas duplicadas y actualice el módulo."
+                )
+                continue
+            self.env.cr.execute(f"""
+                CREATE UNIQUE INDEX IF NOT EXISTS {index_name}
+                ON dispatch_route ({column}, route_date)
+                WHERE state NOT IN ('draft', 'cancelled')
+            """)
+    
     @api.constrains('driver_id', 'vehicle_id', 'route_date', 'state')
     def _check_driver_vehicle_availability(self):
-        """Valida que el conductor y vehículo no estén asignados a otra ruta el mismo día"""
-        for route in self:
-            if route.state not in ['draft', 'cancelled']:
-                # Buscar otras rutas del mismo día con el mismo conductor o vehículo
-                overlapping_routes = self.search([
-                    ('id', '!=', route.id),
-                    ('route_date', '=', route.route_date),
-                    ('state', 'not in', ['draft', 'cancelled']),
-                    '|',
-                    ('driver_id', '=', route.driver_id.id),
-                    ('vehicle_id', '=', route.vehicle_id.id),
-                ])
-                
-                if overlapping_routes:
-                    conflicting = overlapping_routes[0]
-                    raise ValidationError(_(
-                        'El conductor o vehículo ya está asignado a la ruta %s para la fecha %s.'
-                    ) % (conflicting.name, conflicting.route_date))
+        """
+        Valida que el conductor y vehículo no estén asignados a otra ruta el mismo día.
+        Valida todas las rutas con una sola consulta; los índices únicos
+        parciales lo garantizan también entre confirmaciones simultáneas.
+        """
+        active = self.filtered(lambda r: r.state not in ['draft', 'cancelled'])
+        if not active:
+            return
+        
+        self.flush_model(['driver_id', 'vehicle_id', 'route_date', 'state'])
+        self.env.cr.execute("""
+            SELECT other.id
+            FROM dispatch_route route
+            JOIN dispatch_route other
+              ON other.route_date = route.route_date
+             AND other.id != route.id
+             AND other.state NOT IN ('draft', 'cancelled')
+             AND (other.driver_id = route.driver_id OR other.vehicle_id = route.vehicle_id)
+            WHERE route.id IN %s
+            LIMIT 1
+        """, (tuple(active.ids),))
+        row = self.env.cr.fetchone()
+        if row:
+            conflicting = self.browse(row[0])
+            raise ValidationError(_(
+                'El conductor o vehículo ya está asignado a la ruta %s para la fecha %s.'
+            ) % (conflicting.name, conflicting.route_date))
     
     def action_assign(self):
-        """Confirma la asignación de la ruta"""
+        """Confirma la asignación de las rutas (todas juntas, validadas en una sola consulta)"""
         for route in self:
             if not route.line_ids:
                 raise UserError(_('No se puede asignar una ruta sin pedidos.'))
@@ -203,11 +368,20 @@ class DispatchRoute(models.Model):
                     'El conductor %s tiene la licencia vencida. '
                     'No se puede asignar a la ruta.'
                 ) % route.driver_id.name)
-            
-            # Actualizar estado del vehículo
-            route.vehicle_id.write({'status': 'in_use'})
-            
-            route.write({'state': 'assigned'})
+        
+        # Actualizar estado de los vehículos
+        self.vehicle_id.write({'status': 'in_use'})
+        
+        try:
+            with self.env.cr.savepoint():
+                self.write({'state': 'assigned'})
+                self.flush_recordset(['state'])
+        except errors.UniqueViolation:
+            # Otra transacción asignó el mismo conductor o vehículo a la vez
+            raise ValidationError(_(
+                'El conductor o vehículo de alguna de las rutas acaba de ser asignado '
+                'a otra ruta para la misma fecha. Actualice la vista e intente nuevamente.'
+            ))
     
     def action_start(self):
         """Inicia la ruta"""
@@ -266,6 +440,191 @@ class DispatchRoute(models.Model):
             
             route.write({'state': 'draft'})
     
+    # ========== GUÍAS DE REMISIÓN ELECTRÓNICAS ==========
+    
+    def _get_gre_pickings(self):
+        """Entregas pendientes de los pedidos de las rutas"""
+        return self.env['stock.picking'].search([
+            ('sale_id', 'in', self.line_ids.order_id.ids),
+            ('picking_type_code', '=', 'outgoing'),
+            ('state', 'in', ['confirmed', 'assigned', 'waiting']),
+        ])
+    
+    def _prepare_gre_pickings(self, pickings):
+        """
+        Prepara en bloque las entregas de la ruta para GRE (sin validarlas):
+        asigna conductor y vehículo con una sola escritura, reserva stock con
+        un solo action_assign y marca como recogidas las cantidades reservadas.
+        Una entrega que no se puede reservar queda en el reporte sin detener
+        la preparación de las demás.
+        
+        Returns:
+            reporte (lista de dicts con picking, state y message) de las
+            entregas que no se pudieron preparar
+        """
+        self.ensure_one()
+        report = []
+        
+        # Sin peso no se puede marcar como guía electrónica
+        no_weight = pickings.filtered(lambda p: p.total_weight <= 0)
+        report += [{
+            'picking': picking,
+            'state': 'error',
+            'message': _('El peso total debe ser mayor a 0. Verifique que los productos tengan peso configurado.'),
+        } for picking in no_weight]
+        pickings -= no_weight
+        if not pickings:
+            return report
+        
+        pickings.write({
+            'driver_id': self.driver_id.id,
+            'vehicle_id': self.vehicle_id.id,
+            'is_electronic_guide': True,
+            'transfer_reason': '01',  # Venta por defecto
+        })
+        
+        # Verificar que el picking tenga los datos necesarios para GRE
+        no_partner = pickings.filtered(lambda p: not p.partner_id)
+        report += [{
+            'picking': picking,
+            'state': 'error',
+            'message': _('Debe especificar el destinatario.'),
+        } for picking in no_partner]
+        pickings -= no_partner
+        
+        # Reservar disponibilidad de todas las entregas a la vez
+        failed = self._assign_gre_pickings(pickings.filtered(lambda p: p.state == 'confirmed'))
+        report += [{
+            'picking': picking,
+            'state': 'error',
+            'message': _('No se pudo reservar el stock: %s') % message,
+        } for picking, message in failed]
+        pickings -= pickings.browse([picking.id for picking, message in failed])
+        
+        # Cantidades a despachar = cantidades reservadas (sin validar aún)
+        pickings.move_ids.filtered(
+            lambda m: m.quantity and not m.picked and m.state not in ['done', 'cancel']
+        ).write({'picked': True})
+        
+        return report
+    
+    def _assign_gre_pickings(self, pickings):
+        """
+        Reserva stock de las entregas con un solo action_assign. Si el lote
+        falla (ej: producto o ubicación mal configurados), reserva entrega por
+        entrega, cada una en su savepoint, para aislar las que fallan.
+        
+        Returns:
+            lista de (picking, mensaje de error) de las entregas no reservadas
+        """
+        if not pickings:
+            return []
+        try:
+            with self.env.cr.savepoint():
+                pickings.action_assign()
+            return []
+        except Exception as e:
+            _logger.warning(f"⚠️ Falló la reserva en lote de {len(pickings)} entregas, se reservan una por una: {e}")
+        
+        failed = []
+        for picking in pickings:
+            try:
+                with self.env.cr.savepoint():
+                    picking.action_assign()
+            except Exception as e:
+                failed.append((picking, str(e)))
+        return failed
+    
+    def _mark_gre_ready(self, pickings):
+        """
+        Completa las direcciones de partida y llegada que falten (una escritura
+        por almacén y por cliente) y deja las guías listas para enviar.
+        
+        Returns:
+            reporte de las entregas que no quedaron listas
+        """
+        report = []
+        
+        no_origin = pickings.filtered(lambda p: not p.origin_address and p.location_id.warehouse_id.partner_id)
+        for warehouse, warehouse_pickings in no_origin.grouped(lambda p: p.location_id.warehouse_id).items():
+            warehouse_pickings.write({'origin_address': warehouse.partner_id.contact_address})
+        
+        no_destination = pickings.filtered(lambda p: not p.destination_address and p.partner_id)
+        for partner, partner_pickings in no_destination.grouped('partner_id').items():
+            partner_pickings.write({'destination_address': partner.contact_address})
+        
+        drafts = pickings.filtered(lambda p: p.gre_state == 'draft')
+        incomplete = drafts.filtered(lambda p: not p.origin_address or not p.destination_address)
+        report += [{
+            'picking': picking,
+            'state': 'error',
+            'message': _('Debe especificar las direcciones de partida y llegada.'),
+        } for picking in incomplete]
+        (drafts - incomplete).write({'gre_state': 'ready'})
+        
+        return report
+    
+    def action_send_gre(self):
+        """
+        Prepara y envía a SUNAT las guías de todas las entregas de las rutas.
+        Las guías de todas las rutas se envían juntas y en paralelo, de modo
+        que el despacho de la mañana no espera llamadas una tras otra.
+        """
+        report = []
+        to_send = self.env['stock.picking']
+        
+        for route in self:
+            if route.state in ['done', 'cancelled']:
+                raise UserError(_('No se pueden enviar guías de la ruta %s (estado: %s).') % (route.name, route.state))
+            
+            pickings = route._get_gre_pickings().filtered(
+                lambda p: p.gre_state not in ['sent', 'accepted', 'cancelled']
+            )
+            route_report = route._prepare_gre_pickings(pickings)
+            failed_ids = {line['picking'].id for line in route_report}
+            pickings = pickings.filtered(lambda p: p.id not in failed_ids)
+            route_report += route._mark_gre_ready(pickings)
+            report += route_report
+            to_send |= pickings.filtered(lambda p: p.gre_state in ['ready', 'rejected'])
+        
+        report += to_send._send_gre_batch()
+        return self._notify_gre_report(report)
+    
+    def _notify_gre_report(self, report):
+        """Registra el reporte de envío de GRE y retorna la notificación con el resumen"""
+        counts = {'accepted': 0, 'rejected': 0, 'error': 0}
+        for line in report:
+            counts[line['state']] += 1
+            if line['state'] != 'accepted':
+                _logger.warning(f"⚠️ GRE {line['picking'].name}: {line['message']}")
+        
+        _logger.info(
+            f"🚚 GRE de {len(self)} ruta(s): {counts['accepted']} aceptadas, "
+            f"{counts['rejected']} rechazadas, {counts['error']} con errores"
+        )
+        
+        message = _(
+            'Guías aceptadas: %s\nRechazadas por SUNAT: %s\nCon errores: %s'
+        ) % (counts['accepted'], counts['rejected'], counts['error'])
+        failed = [line for line in report if line['state'] != 'accepted']
+        if failed:
+            message += '\n\n' + '\n'.join(
+                f"• {line['picking'].name}: {line['message']}" for line in failed[:GRE_REPORT_MAX_LINES]
+            )
+            if len(failed) > GRE_REPORT_MAX_LINES:
+                message += '\n' + _('... y %s más') % (len(failed) - GRE_REPORT_MAX_LINES)
+        
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Envío de Guías de Remisión'),
+                'message': message,
+                'type': 'warning' if failed else 'success',
+                'sticky': bool(failed),
+            }
+        }
+    
     def action_view_orders(self):
         """Ver pedidos de la ruta"""
         self.ensure_one()
@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 
+from collections import defaultdict
+
 from odoo import api, fields, models, _
 from odoo.exceptions import ValidationError
 
@@ -146,11 +148,82 @@ class DispatchRouteLine(models.Model):
         readonly=True
     )
     
+    # ========== SINCRONIZACIÓN APP MÓVIL ==========
+    sync_version = fields.Integer(
+        string='Versión de Sincronización',
+        default=0,
+        readonly=True,
+        copy=False,
+        help='Versión de la ruta en la que cambió esta línea por última vez'
+    )
+    
     _sql_constraints = [
         ('order_unique_per_route', 'UNIQUE(route_id, order_id)',
          'Un pedido no puede estar duplicado en la misma ruta.')
     ]
     
+    def init(self):
+        # Búsqueda de un pedido en rutas activas (validación de líneas)
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS dispatch_route_line_order_route_state_idx
+            ON dispatch_route_line (order_id, route_state)
+        """)
+        # Líneas cambiadas desde una versión (sincronización de la app móvil)
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS dispatch_route_line_route_sync_idx
+            ON dispatch_route_line (route_id, sync_version)
+        """)
+    
+    # ========== CONTADORES DE LA RUTA ==========
+    
+    def _get_route_counter_deltas(self, sign):
+        """Retorna {id de ruta: {estado: diferencia}} de estas líneas con el signo indicado"""
+        deltas = defaultdict(lambda: defaultdict(int))
+        for line in self:
+            if line.route_id:
+                deltas[line.route_id.id][line.state] += sign
+        return deltas
+    
+    def _touch_sync(self):
+        """Marca las líneas como cambiadas para la sincronización de la app móvil"""
+        self.env['dispatch.route']._stamp_sync_version(self, {line.id: line.route_id.id for line in self})
+    
+    @api.model_create_multi
+    def create(self, vals_list):
+        lines = super().create(vals_list)
+        self.env['dispatch.route']._apply_line_counter_deltas(lines._get_route_counter_deltas(1))
+        lines._touch_sync()
+        return lines
+    
+    def write(self, vals):
+        """Actualiza por diferencia los contadores de la ruta si cambia el estado o la ruta"""
+        if 'state' not in vals and 'route_id' not in vals:
+            result = super().write(vals)
+            self._touch_sync()
+            return result
+        
+        deltas = self._get_route_counter_deltas(-1)
+        old_routes = self.route_id
+        result = super().write(vals)
+        for route_id, delta in self._get_route_counter_deltas(1).items():
+            for state, count in delta.items():
+                deltas[route_id][state] += count
+        self.env['dispatch.route']._apply_line_counter_deltas(deltas)
+        
+        # Si las líneas cambiaron de ruta, la ruta anterior las pierde: reinicio para la app
+        (old_routes - self.route_id)._bump_sync_version(reset=True)
+        self._touch_sync()
+        return result
+    
+    def unlink(self):
+        deltas = self._get_route_counter_deltas(-1)
+        routes = self.route_id
+        result = super().unlink()
+        self.env['dispatch.route']._apply_line_counter_deltas(deltas)
+        # La app no recibe eliminaciones por diferencia: debe descargar la ruta completa
+        routes.exists()._bump_sync_version(reset=True)
+        return result
+    
     @api.constrains('order_id')
     def _check_order_state(self):
         """Valida que el pedido esté confirmado"""
@@ -163,19 +236,31 @@ class DispatchRouteLine(models.Model):
     
     @api.constrains('order_id', 'route_id')
     def _check_order_not_in_other_active_route(self):
-        """Valida que el pedido no esté en otra ruta activa"""
-        for line in self:
-            other_lines = self.search([
-                ('id', '!=', line.id),
-                ('order_id', '=', line.order_id.id),
-                ('route_id.state', 'in', ['draft', 'assigned', 'in_progress']),
-            ])
-            
-            if other_lines:
-                route = other_lines[0].route_id
-                raise ValidationError(_(
-                    'El pedido %s ya está asignado a la ruta %s (estado: %s).'
-                ) % (line.order_id.name, route.name, route.state))
+        """
+        Valida que el pedido no esté en otra ruta activa.
+        Valida todas las líneas con una sola consulta (índice por pedido y estado de ruta).
+        """
+        if not self:
+            return
+        
+        self.flush_model(['order_id', 'route_id', 'route_state'])
+        self.env.cr.execute("""
+            SELECT line.id, other.id
+            FROM dispatch_route_line line
+            JOIN dispatch_route_line other
+              ON other.order_id = line.order_id
+             AND other.id != line.id
+             AND other.route_state IN ('draft', 'assigned', 'in_progress')
+            WHERE line.id IN %s
+            LIMIT 1
+        """, (tuple(self.ids),))
+        row = self.env.cr.fetchone()
+        if row:
+            line = self.browse(row[0])
+            route = self.browse(row[1]).route_id
+            raise ValidationError(_(
+                'El pedido %s ya está asignado a la ruta %s (estado: %s).'
+            ) % (line.order_id.name, route.name, route.state))
     
     def action_mark_delivered(self):
         """Marca la entrega como exitosa y valida los pickings"""
@@ -199,45 +199,17 @@ class DispatchSettlement(models.Model):
                 vals['name'] = self.env['ir.sequence'].next_by_code('dispatch.settlement') or 'Nuevo'
         return super(DispatchSettlement, self).create(vals_list)
     
-    @api.depends('invoice_ids', 'invoice_ids.invoice_payment_term_id')
+    @api.depends('invoice_ids', 'invoice_ids.invoice_payment_term_id',
+                 'invoice_ids.invoice_payment_term_id.dispatch_collection_type')
     def _compute_invoice_types(self):
         """Clasifica las facturas en contado y crédito"""
         for settlement in self:
-            cash_invoices = self.env['account.move']
-            credit_invoices = self.env['account.move']
-            
-            for invoice in settlement.invoice_ids:
-                # Si no tiene plazo de pago, es al contado
-                # Si tiene plazo de pago y el nombre contiene "Inmediato" o "Contado", es al contado
-                is_cash = False
-                
-                if not invoice.invoice_payment_term_id:
-                    is_cash = True
-                else:
-                    term_name = (invoice.invoice_payment_term_id.name or '').lower()
-                    if 'inmediato' in term_name or 'contado' in term_name or 'immediate' in term_name:
-                        is_cash = True
-                    # Verificar si todas las líneas del término de pago tienen días en 0
-                    elif invoice.invoice_payment_term_id.line_ids:
-                        # Obtener el campo correcto (puede ser nb_days, days, o delay)
-                        try:
-                            all_zero = all(
-                                getattr(line, 'nb_days', getattr(line, 'days', 999)) == 0 
-                                for line in invoice.invoice_payment_term_id.line_ids
-                            )
-                            if all_zero:
-                                is_cash = True
-                        except:
-                            # Si hay error, asumir que no es al contado
-                            pass
-                
-                if is_cash:
-                    cash_invoices |= invoice
-                else:
-                    credit_invoices |= invoice
-            
+            # Sin plazo de pago es al contado; si no, según la clasificación del término
+            cash_invoices = settlement.invoice_ids.filtered(
+                lambda inv: (inv.invoice_payment_term_id.dispatch_collection_type or 'cash') == 'cash'
+            )
             settlement.cash_invoice_ids = [(6, 0, cash_invoices.ids)]
-            settlement.credit_invoice_ids = [(6, 0, credit_invoices.ids)]
+            settlement.credit_invoice_ids = [(6, 0, (settlement.invoice_ids - cash_invoices).ids)]
     
     @api.depends('invoice_ids', 'cash_invoice_ids', 'credit_invoice_ids')
     def _compute_totals(self):
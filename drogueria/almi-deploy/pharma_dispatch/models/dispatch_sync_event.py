@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import json
+from datetime import timedelta
+
+from odoo import api, fields, models
+
+# Días que se guardan los eventos aplicados (reenvíos de la app tras reconectar)
+SYNC_EVENT_RETENTION_DAYS = 30
+
+
+class DispatchSyncEvent(models.Model):
+    """
+    Eventos de la app móvil ya aplicados (entregas, fallos y pagos).
+    Cada evento trae una clave generada por la app: si la app lo reenvía
+    (por ejemplo al recuperar la señal), se retorna el resultado guardado
+    sin volver a aplicarlo.
+    """
+    _name = 'dispatch.sync.event'
+    _description = 'Evento de Sincronización de la App Móvil'
+    _order = 'id desc'
+    _rec_name = 'key'
+    
+    driver_id = fields.Many2one(
+        'dispatch.driver',
+        string='Conductor',
+        required=True,
+        ondelete='cascade'
+    )
+    
+    key = fields.Char(
+        string='Clave de Idempotencia',
+        required=True,
+        help='Clave única del evento generada por la app móvil'
+    )
+    
+    event_type = fields.Selection([
+        ('deliver', 'Entrega'),
+        ('fail', 'No Entregado'),
+        ('payment', 'Pago'),
+    ], string='Tipo', required=True)
+    
+    route_id = fields.Many2one(
+        'dispatch.route',
+        string='Ruta',
+        ondelete='set null'
+    )
+    
+    result = fields.Text(
+        string='Resultado',
+        help='Respuesta retornada a la app al aplicar el evento (JSON)'
+    )
+    
+    _sql_constraints = [
+        ('driver_key_unique', 'UNIQUE(driver_id, key)',
+         'La clave del evento ya fue usada por este conductor.')
+    ]
+    
+    def _get_result(self):
+        """Resultado guardado del evento"""
+        self.ensure_one()
+        return json.loads(self.result or '{}')
+    
+    @api.autovacuum
+    def _gc_sync_events(self):
+        """Elimina los eventos más antiguos que la retención"""
+        limit_date = fields.Datetime.now() - timedelta(days=SYNC_EVENT_RETENTION_DAYS)
+        self.search([('create_date', '<', limit_date)]).unlink()
@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models
+
+
+class ProductProduct(models.Model):
+    """
+    Extensión de productos: al cambiar el peso se actualiza el peso de los
+    movimientos abiertos (los hechos o cancelados conservan el suyo).
+    """
+    _inherit = 'product.product'
+    
+    def write(self, vals):
+        result = super().write(vals)
+        if 'weight' in vals:
+            self.env['stock.move']._recompute_open_dispatch_weight(self)
+        return result
@@ -91,6 +91,14 @@ class SaleOrder(models.Model):
         help='Línea específica en la ruta'
     )
     
+    dispatch_weight = fields.Float(
+        string='Peso (kg)',
+        compute='_compute_dispatch_weight',
+        store=True,
+        digits=(10, 2),
+        help='Peso total de los productos del pedido, usado en los totales de la ruta'
+    )
+    
     # ========== INFORMACIÓN ADICIONAL ==========
     pickup_notes = fields.Text(
         string='Notas de Recojo',
@@ -107,6 +115,16 @@ class SaleOrder(models.Model):
         help='Documento de identidad de quien recoge'
     )
     
+    @api.depends('order_line.product_uom_qty', 'order_line.product_id.weight')
+    def _compute_dispatch_weight(self):
+        """Calcula el peso total del pedido"""
+        for order in self:
+            order.dispatch_weight = sum(
+                line.product_id.weight * line.product_uom_qty
+                for line in order.order_line
+                if line.product_id.weight
+            )
+    
     @api.onchange('delivery_type')
     def _onchange_delivery_type(self):
         """Actualiza el estado de recojo según el tipo de entrega"""
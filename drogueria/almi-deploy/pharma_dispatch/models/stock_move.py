@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+from odoo import api, fields, models
+
+
+class StockMove(models.Model):
+    """
+    Extensión de los movimientos de stock con el peso precalculado,
+    que se suma por picking para el peso total de la guía.
+    """
+    _inherit = 'stock.move'
+    
+    dispatch_weight = fields.Float(
+        string='Peso (kg)',
+        compute='_compute_dispatch_weight',
+        store=True,
+        digits=(10, 2),
+        help='Peso del movimiento: cantidad realizada si está hecho, cantidad demandada si no'
+    )
+    
+    @api.depends('product_id', 'product_uom_qty', 'quantity', 'state')
+    def _compute_dispatch_weight(self):
+        """
+        Calcula el peso del movimiento.
+        No depende del peso del producto: al cambiarlo solo se recalculan los
+        movimientos abiertos (product.product.write), para no alterar el peso
+        de guías ya emitidas.
+        """
+        for move in self:
+            quantity = move.quantity if move.state == 'done' else move.product_uom_qty
+            move.dispatch_weight = (move.product_id.weight or 0.0) * quantity
+    
+    @api.model
+    def _recompute_open_dispatch_weight(self, products):
+        """Recalcula el peso de los movimientos abiertos de los productos"""
+        moves = self.search([
+            ('product_id', 'in', products.ids),
+            ('state', 'not in', ('done', 'cancel')),
+        ])
+        if moves:
+            self.env.add_to_compute(self._fields['dispatch_weight'], moves)
+            moves.modified(['dispatch_weight'])
@@ -3,13 +3,71 @@
 import logging
 import json
 import base64
-import requests
+from datetime import timedelta
 
 from odoo import api, fields, models, _
 from odoo.exceptions import UserError, ValidationError
 
 _logger = logging.getLogger(__name__)
 
+# Consultas automáticas de una guía sin respuesta definitiva; la espera entre
+# consultas se duplica cada vez (igual que los comprobantes de nubefact_sunat)
+POLL_MAX_ATTEMPTS = 8
+
+# Mapeo de unidades de medida comunes a códigos SUNAT (Catálogo 03).
+# Solo se usa si nubefact_sunat no está instalado; de lo contrario se usa
+# el código SUNAT guardado en cada unidad de medida.
+SUNAT_UOM_NAME_MAP = {
+    # Unidades
+    'unidad': 'NIU',
+    'unidades': 'NIU',
+    'unit': 'NIU',
+    'units': 'NIU',
+    'u': 'NIU',
+    'und': 'NIU',
+    'pieza': 'NIU',
+    'piezas': 'NIU',
+    
+    # Peso
+    'kg': 'KGM',
+    'kilogramo': 'KGM',
+    'kilogramos': 'KGM',
+    'kgs': 'KGM',
+    'gramo': 'GRM',
+    'gramos': 'GRM',
+    'g': 'GRM',
+    'tonelada': 'TNE',
+    'toneladas': 'TNE',
+    
+    # Volumen
+    'litro': 'LTR',
+    'litros': 'LTR',
+    'l': 'LTR',
+    'mililitro': 'MLT',
+    'mililitros': 'MLT',
+    'ml': 'MLT',
+    'galón': 'GLL',
+    'galon': 'GLL',
+    
+    # Longitud
+    'metro': 'MTR',
+    'metros': 'MTR',
+    'm': 'MTR',
+    'centímetro': 'CMT',
+    'centimetro': 'CMT',
+    'cm': 'CMT',
+    
+    # Otros
+    'caja': 'BX',
+    'cajas': 'BX',
+    'paquete': 'PK',
+    'paquetes': 'PK',
+    'docena': 'DZN',
+    'docenas': 'DZN',
+    'millar': 'MIL',
+    'millares': 'MIL',
+}
+
 
 class StockPicking(models.Model):
     """
@@ -135,6 +193,36 @@ class StockPicking(models.Model):
         help='Fecha y hora de envío a SUNAT'
     )
     
+    gre_submitted = fields.Boolean(
+        string='Recibida por NubeFact',
+        readonly=True,
+        copy=False,
+        help='La guía llegó o pudo llegar a NubeFact (respuesta recibida o conexión '
+             'cortada durante el envío). Solo estas guías se consultan automáticamente.'
+    )
+    
+    gre_last_poll = fields.Datetime(
+        string='Última Consulta',
+        readonly=True,
+        copy=False,
+        help='Última vez que la consulta automática verificó el estado de la guía en NubeFact'
+    )
+    
+    gre_next_poll = fields.Datetime(
+        string='Próxima Consulta',
+        readonly=True,
+        copy=False,
+        help='La consulta automática no verifica la guía antes de esta fecha'
+    )
+    
+    gre_poll_count = fields.Integer(
+        string='Consultas',
+        default=0,
+        readonly=True,
+        copy=False,
+        help='Consultas automáticas sin respuesta definitiva desde el último envío'
+    )
+    
     gre_ticket_number = fields.Char(
         string='Número de Ticket',
         readonly=True,
@@ -199,38 +287,38 @@ class StockPicking(models.Model):
         readonly=True
     )
     
-    @api.depends('move_ids', 'move_ids.product_id', 'move_ids.product_uom_qty', 'move_line_ids', 'move_line_ids.quantity')
+    @api.depends('move_ids.dispatch_weight')
     def _compute_total_weight(self):
         """Calcula el peso total de los productos"""
+        weights = self._get_moves_weight()
         for picking in self:
-            total = 0.0
-            # Si el picking está validado (done), usar move_line_ids para cantidades reales
-            if picking.state == 'done' and picking.move_line_ids:
-                for move_line in picking.move_line_ids:
-                    if move_line.product_id.weight:
-                        total += move_line.product_id.weight * move_line.quantity
-            else:
-                # Si está en borrador o asignado, usar product_uom_qty de los moves
-                for move in picking.move_ids:
-                    if move.product_id.weight:
-                        total += move.product_id.weight * move.product_uom_qty
-            picking.total_weight = total
+            picking.total_weight = weights.get(picking.id, 0.0)
+    
+    def _get_moves_weight(self):
+        """
+        Retorna {id de picking: peso total} sumando el peso precalculado de
+        los movimientos con una consulta agrupada.
+        Los pickings aún no guardados se suman en memoria.
+        """
+        weights = {}
+        if self.ids:
+            weights = {
+                picking.id: weight
+                for picking, weight in self.env['stock.move']._read_group(
+                    [('picking_id', 'in', self.ids)],
+                    ['picking_id'],
+                    ['dispatch_weight:sum'],
+                )
+            }
+        for picking in self.filtered(lambda p: not p.id):
+            weights[picking.id] = sum(picking.move_ids.mapped('dispatch_weight'))
+        return weights
     
     def action_recalculate_weight(self):
         """Recalcula manualmente el peso total"""
+        weights = self._get_moves_weight()
         for picking in self:
-            total = 0.0
-            # Si el picking está validado (done), usar move_line_ids para cantidades reales
-            if picking.state == 'done' and picking.move_line_ids:
-                for move_line in picking.move_line_ids:
-                    if move_line.product_id.weight:
-                        total += move_line.product_id.weight * move_line.quantity
-            else:
-                # Si está en borrador o asignado, usar product_uom_qty de los moves
-                for move in picking.move_ids:
-                    if move.product_id.weight:
-                        total += move.product_id.weight * move.product_uom_qty
-            picking.write({'total_weight': total})
+            picking.write({'total_weight': weights.get(picking.id, 0.0)})
     
     @api.constrains('transfer_reason')
     def _check_transfer_reason(self):
@@ -327,6 +415,7 @@ class StockPicking(models.Model):
             picking.write({
                 'gre_state': 'draft',
                 'gre_sent_date': False,
+                'gre_submitted': False,
                 'gre_ticket_number': False,
                 'gre_response': False,
                 'gre_error_message': False,
@@ -375,63 +464,18 @@ class StockPicking(models.Model):
         Convierte las unidades de medida de Odoo a códigos SUNAT (Catálogo 03).
         Retorna el código SUNAT correspondiente.
         """
-        # Mapeo de unidades de medida comunes a códigos SUNAT
-        uom_map = {
-            # Unidades
-            'unidad': 'NIU',
-            'unidades': 'NIU',
-            'unit': 'NIU',
-            'units': 'NIU',
-            'u': 'NIU',
-            'und': 'NIU',
-            'pieza': 'NIU',
-            'piezas': 'NIU',
-            
-            # Peso
-            'kg': 'KGM',
-            'kilogramo': 'KGM',
-            'kilogramos': 'KGM',
-            'kgs': 'KGM',
-            'gramo': 'GRM',
-            'gramos': 'GRM',
-            'g': 'GRM',
-            'tonelada': 'TNE',
-            'toneladas': 'TNE',
-            
-            # Volumen
-            'litro': 'LTR',
-            'litros': 'LTR',
-            'l': 'LTR',
-            'mililitro': 'MLT',
-            'mililitros': 'MLT',
-            'ml': 'MLT',
-            'galón': 'GLL',
-            'galon': 'GLL',
-            
-            # Longitud
-            'metro': 'MTR',
-            'metros': 'MTR',
-            'm': 'MTR',
-            'centímetro': 'CMT',
-            'centimetro': 'CMT',
-            'cm': 'CMT',
-            
-            # Otros
-            'caja': 'BX',
-            'cajas': 'BX',
-            'paquete': 'PK',
-            'paquetes': 'PK',
-            'docena': 'DZN',
-            'docenas': 'DZN',
-            'millar': 'MIL',
-            'millares': 'MIL',
-        }
+        if uom and 'sunat_code' in uom._fields:
+            # Mapeo guardado en las unidades de medida (nubefact_sunat), cacheado por registro
+            code = self.env['uom.uom']._get_sunat_code_map().get(uom.id)
+            if not code:
+                _logger.warning(f"⚠️ La unidad de medida '{uom.name}' no tiene código SUNAT, se envía como NIU")
+            return code or 'NIU'
         
         # Normalizar el nombre de la unidad (minúsculas, sin espacios extra)
         uom_name = uom.name.lower().strip() if uom else ''
         
         # Buscar en el mapeo
-        return uom_map.get(uom_name, 'NIU')  # Por defecto NIU (Unidad) si no se encuentra
+        return SUNAT_UOM_NAME_MAP.get(uom_name, 'NIU')  # Por defecto NIU (Unidad) si no se encuentra
     
     def _prepare_nubefact_gre_data(self):
         """
@@ -609,94 +653,52 @@ class StockPicking(models.Model):
             # Preparar datos de la guía
             gre_data = self._prepare_nubefact_gre_data()
             
-            # URL de la API de NubeFact
             # Nota: NubeFact usa el mismo endpoint base pero con operacion "generar_guia"
-            url = config.get_api_url()
+            _logger.info(f"📤 Enviando GRE {self.name} a NubeFact/SUNAT")
             
-            # Headers según documentación de NubeFact
-            headers = {
-                'Authorization': config.token,
-                'Content-Type': 'application/json'
-            }
+            # Realizar petición POST a NubeFact (conexión compartida de la configuración)
+            result = config._send_payload(gre_data)
             
-            _logger.info(f"📤 Enviando GRE {self.name} a NubeFact/SUNAT")
-            _logger.info(f"URL: {url}")
-            _logger.info(f"📋 Datos GRE enviados:\n{json.dumps(gre_data, indent=2, ensure_ascii=False)}")
-            
-            # Realizar petición POST a NubeFact
-            response = requests.post(
-                url,
-                headers=headers,
-                json=gre_data,
-                timeout=30
-            )
+            _logger.info(f"Respuesta de NubeFact: Status {result['status_code']} en {result['elapsed']:.2f} s")
             
-            _logger.info(f"Respuesta de NubeFact: Status {response.status_code}, Body: {response.text}")
+            if result['status_code'] is None:
+                # Error de conexión o timeout
+                raise UserError(result['error'])
             
             # Procesar respuesta
-            if response.status_code == 200:
-                response_data = response.json()
-                
-                # Actualizar campos
-                self.write({
-                    'gre_sent_date': fields.Datetime.now(),
-                    'gre_response': json.dumps(response_data, indent=2),
-                })
-                
-                # Verificar si SUNAT aceptó la guía
-                if response_data.get('aceptada_por_sunat'):
-                    self.write({
-                        'gre_state': 'accepted',
-                        'gre_pdf_url': response_data.get('enlace_del_pdf', ''),
-                        'gre_xml_url': response_data.get('enlace_del_xml', ''),
-                        'gre_cdr_url': response_data.get('enlace_del_cdr', ''),
-                        'gre_hash_code': response_data.get('codigo_hash', ''),
-                        'gre_ticket_number': response_data.get('numero_ticket', ''),
-                    })
-                    
-                    return {
-                        'type': 'ir.actions.client',
-                        'tag': 'display_notification',
-                        'params': {
-                            'title': _('Éxito'),
-                            'message': _('La guía de remisión fue aceptada por SUNAT correctamente.'),
-                            'type': 'success',
-                            'sticky': False,
-                        }
+            gre_state, message = self._gre_apply_send_result(result)
+            
+            if gre_state == 'accepted':
+                return {
+                    'type': 'ir.actions.client',
+                    'tag': 'display_notification',
+                    'params': {
+                        'title': _('Éxito'),
+                        'message': _('La guía de remisión fue aceptada por SUNAT correctamente.'),
+                        'type': 'success',
+                        'sticky': False,
                     }
-                else:
-                    # SUNAT rechazó la guía
-                    error_msg = response_data.get('sunat_description', '') or response_data.get('errors', '')
-                    self.write({
-                        'gre_state': 'rejected',
-                        'gre_error_message': error_msg,
-                    })
-                    
-                    return {
-                        'type': 'ir.actions.client',
-                        'tag': 'display_notification',
-                        'params': {
-                            'title': _('Rechazado por SUNAT'),
-                            'message': f"{_('La guía fue rechazada')}: {error_msg}",
-                            'type': 'warning',
-                            'sticky': True,
-                        }
+                }
+            elif not result['error']:
+                # SUNAT rechazó la guía
+                return {
+                    'type': 'ir.actions.client',
+                    'tag': 'display_notification',
+                    'params': {
+                        'title': _('Rechazado por SUNAT'),
+                        'message': f"{_('La guía fue rechazada')}: {message}",
+                        'type': 'warning',
+                        'sticky': True,
                     }
+                }
             else:
                 # Error en la API
-                error_msg = response.text
-                self.write({
-                    'gre_state': 'rejected',
-                    'gre_error_message': error_msg,
-                    'gre_response': error_msg,
-                })
-                
                 return {
                     'type': 'ir.actions.client',
                     'tag': 'display_notification',
                     'params': {
                         'title': _('Error'),
-                        'message': f"{_('Error al enviar a NubeFact')}: {error_msg}",
+                        'message': f"{_('Error al enviar a NubeFact')}: {message}",
                         'type': 'danger',
                         'sticky': True,
                     }
@@ -711,6 +713,216 @@ class StockPicking(models.Model):
             
             raise UserError(_('Error al enviar GRE a SUNAT: %s') % str(e))
     
+    def _gre_apply_send_result(self, result):
+        """
+        Actualiza la guía con el resultado de un envío a NubeFact.
+        
+        Returns:
+            (estado GRE resultante, mensaje)
+        """
+        self.ensure_one()
+        
+        # Un nuevo envío reinicia la consulta automática
+        poll_vals = {
+            'gre_poll_count': 0,
+            'gre_next_poll': False,
+        }
+        
+        if result['error']:
+            # Error de conexión, timeout o error en la API. Si fue temporal (corte,
+            # timeout, error del servidor) o la respuesta 200 no se pudo leer,
+            # NubeFact pudo haberla registrado: se consulta luego
+            error_msg = result['error']
+            vals = dict(
+                poll_vals,
+                gre_state='rejected',
+                gre_error_message=error_msg,
+                gre_submitted=self.gre_submitted or bool(result['transient'] or result['status_code'] == 200),
+            )
+            if result['status_code'] is not None:
+                vals['gre_response'] = error_msg
+            self.write(vals)
+            return 'rejected', error_msg
+        
+        response_data = result['data']
+        vals = {
+            **poll_vals,
+            'gre_submitted': True,
+            'gre_sent_date': fields.Datetime.now(),
+            'gre_response': json.dumps(response_data, indent=2),
+        }
+        
+        # Verificar si SUNAT aceptó la guía
+        if response_data.get('aceptada_por_sunat'):
+            vals.update({
+                'gre_state': 'accepted',
+                'gre_pdf_url': response_data.get('enlace_del_pdf', ''),
+                'gre_xml_url': response_data.get('enlace_del_xml', ''),
+                'gre_cdr_url': response_data.get('enlace_del_cdr', ''),
+                'gre_hash_code': response_data.get('codigo_hash', ''),
+                'gre_ticket_number': response_data.get('numero_ticket', ''),
+            })
+            self.write(vals)
+            return 'accepted', _('Aceptada por SUNAT')
+        
+        # SUNAT rechazó la guía
+        error_msg = response_data.get('sunat_description', '') or response_data.get('errors', '')
+        vals.update({
+            'gre_state': 'rejected',
+            'gre_error_message': error_msg,
+        })
+        self.write(vals)
+        return 'rejected', error_msg
+    
+    def _send_gre_batch(self):
+        """
+        Envía varias guías a NubeFact en paralelo, con el máximo de envíos
+        simultáneos de la configuración de cada compañía. Una guía con datos
+        incompletos no detiene el envío de las demás.
+        
+        Returns:
+            lista de dicts con picking, state (accepted, rejected o error) y message
+        """
+        try:
+            Config = self.env['nubefact.config']
+        except KeyError:
+            raise UserError(_(
+                'No se encontró el módulo nubefact_sunat. '
+                'Por favor, instale el módulo de integración con NubeFact.'
+            ))
+        
+        report = []
+        for company, pickings in self.grouped('company_id').items():
+            config = Config._get_active_config(company)
+            if not config:
+                message = _('No se ha configurado la conexión con NubeFact.')
+                report += [{'picking': picking, 'state': 'error', 'message': message} for picking in pickings]
+                continue
+            
+            to_send = self.env['stock.picking']
+            payloads = []
+            for picking in pickings:
+                if not picking.is_electronic_guide or picking.gre_state not in ['ready', 'rejected']:
+                    report.append({
+                        'picking': picking,
+                        'state': 'error',
+                        'message': _('La guía no está lista para enviar.'),
+                    })
+                    continue
+                try:
+                    payloads.append(picking._prepare_nubefact_gre_data())
+                    to_send |= picking
+                except UserError as e:
+                    report.append({'picking': picking, 'state': 'error', 'message': str(e)})
+            
+            _logger.info(f"📤 Enviando {len(payloads)} GRE a NubeFact/SUNAT ({config.max_workers} en paralelo)")
+            results = config._send_payloads(payloads)
+            
+            for picking, result in zip(to_send, results):
+                gre_state, message = picking._gre_apply_send_result(result)
+                report.append({'picking': picking, 'state': gre_state, 'message': message})
+        
+        return report
+    
+    def _prepare_nubefact_gre_query_data(self):
+        """Prepara los datos para consultar la guía en NubeFact"""
+        self.ensure_one()
+        if self.gre_number and not self.gre_number.strip().isdigit():
+            raise UserError(_('El número de la guía %s no es válido: %s') % (self.name, self.gre_number))
+        return {
+            "operacion": "consultar_guia",
+            "tipo_de_comprobante": "09",
+            "serie": self.gre_serie or "T001",
+            "numero": int(self.gre_number) if self.gre_number else 1,
+        }
+    
+    def _gre_apply_query_response(self, response_data):
+        """
+        Actualiza la guía con la respuesta de una consulta a NubeFact.
+        
+        Returns:
+            True si SUNAT aceptó la guía
+        """
+        self.ensure_one()
+        if not response_data.get('aceptada_por_sunat'):
+            return False
+        
+        self.write({
+            'gre_state': 'accepted',
+            'gre_pdf_url': response_data.get('enlace_del_pdf') or self.gre_pdf_url,
+            'gre_xml_url': response_data.get('enlace_del_xml') or self.gre_xml_url,
+            'gre_cdr_url': response_data.get('enlace_del_cdr') or self.gre_cdr_url,
+            'gre_hash_code': response_data.get('codigo_hash') or self.gre_hash_code,
+            'gre_response': json.dumps(response_data, indent=2),
+        })
+        return True
+    
+    @api.model
+    def _cron_poll_gre_status(self):
+        """
+        Cron: consulta en NubeFact el estado de las guías que llegaron (o
+        pudieron llegar) a NubeFact sin respuesta definitiva, en lotes
+        paralelos y con límite de peticiones por segundo. La espera entre
+        consultas de una misma guía se duplica cada vez, hasta
+        POLL_MAX_ATTEMPTS consultas.
+        """
+        try:
+            configs = self.env['nubefact.config'].search([('active', '=', True)])
+        except KeyError:
+            # Módulo nubefact_sunat no instalado
+            return 0
+        
+        resolved = 0
+        polled = 0
+        
+        for config in configs:
+            now = fields.Datetime.now()
+            pickings = self.search([
+                ('company_id', '=', config.company_id.id),
+                ('is_electronic_guide', '=', True),
+                # Error antes de recibir una respuesta definitiva de NubeFact
+                ('gre_state', '=', 'rejected'),
+                ('gre_sent_date', '=', False),
+                ('gre_submitted', '=', True),
+                ('gre_poll_count', '<', POLL_MAX_ATTEMPTS),
+                '|', ('gre_next_poll', '=', False), ('gre_next_poll', '<=', now),
+            ], limit=config.poll_batch_size or 100, order='gre_next_poll asc nulls first, id')
+            if not pickings:
+                continue
+            
+            # 1. Preparar consultas; una guía con datos inválidos no detiene a las demás
+            to_query = self.browse()
+            payloads = []
+            for picking in pickings:
+                try:
+                    payloads.append(picking._prepare_nubefact_gre_query_data())
+                    to_query |= picking
+                except UserError as e:
+                    _logger.warning(f"No se puede consultar la guía {picking.name} en NubeFact: {str(e)}")
+            
+            # 2. Consultar en paralelo, con límite de peticiones por segundo
+            results = config._send_payloads(payloads, rate_limit=config.poll_rate_limit)
+            
+            for picking, result in zip(to_query, results):
+                if not result['error'] and picking._gre_apply_query_response(result['data']):
+                    resolved += 1
+            
+            # 3. Reprogramar las no resueltas con espera creciente
+            now = fields.Datetime.now()
+            pickings.write({'gre_last_poll': now})
+            pending = pickings.filtered(lambda p: p.gre_state == 'rejected')
+            for count, count_pickings in pending.grouped('gre_poll_count').items():
+                delay = (config.poll_interval or 30) * 2 ** count
+                count_pickings.write({
+                    'gre_poll_count': count + 1,
+                    'gre_next_poll': now + timedelta(minutes=delay),
+                })
+            polled += len(pickings)
+            self.env.cr.commit()
+        
+        _logger.info(f"🔄 Consulta automática GRE: {resolved} de {polled} guías resueltas")
+        return resolved
+    
     def action_query_gre_status(self):
         """Consulta el estado de una guía en SUNAT"""
         self.ensure_one()
@@ -732,34 +944,17 @@ class StockPicking(models.Model):
         
         try:
             # Preparar datos de consulta
-            consulta_data = {
-                "operacion": "consultar_guia",
-                "tipo_de_comprobante": "09",
-                "serie": self.gre_serie or "T001",
-                "numero": int(self.gre_number) if self.gre_number else 1,
-            }
-            
-            url = config.get_api_url()
-            headers = {
-                'Authorization': config.token,
-                'Content-Type': 'application/json'
-            }
+            consulta_data = self._prepare_nubefact_gre_query_data()
             
             _logger.info(f"🔍 Consultando estado de GRE {self.name}")
             
-            response = requests.post(
-                url,
-                headers=headers,
-                json=consulta_data,
-                timeout=30
-            )
+            result = config._send_payload(consulta_data)
             
-            if response.status_code == 200:
-                response_data = response.json()
+            if not result['error']:
+                response_data = result['data']
                 
                 # Actualizar estado si es necesario
-                if response_data.get('aceptada_por_sunat'):
-                    self.write({'gre_state': 'accepted'})
+                if self._gre_apply_query_response(response_data):
                     message = _('La guía está aceptada por SUNAT.')
                 else:
                     message = _('Estado: %s') % response_data.get('sunat_description', 'Desconocido')
@@ -775,7 +970,7 @@ class StockPicking(models.Model):
                     }
                 }
             else:
-                raise UserError(_('Error al consultar: %s') % response.text)
+                raise UserError(_('Error al consultar: %s') % result['error'])
                 
         except Exception as e:
             _logger.error(f"Error al consultar estado GRE: {str(e)}", exc_info=True)
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark de la validación de líneas de ruta (pedido en otra ruta activa).
+
+Crea rutas en borrador de distintos tamaños con pedidos confirmados de
+prueba y mide el tiempo y las consultas SQL de
+dispatch.route.line._check_order_not_in_other_active_route sobre todas sus
+líneas. Con la validación por conjunto, las consultas no deben crecer con
+el tamaño de la ruta. Revierte todo al terminar (no deja datos en la base).
+
+Requiere al menos un conductor y un vehículo, y el módulo nubefact_sunat en
+la ruta de addons (usa su medición común de benchmarks).
+
+Uso (desde el shell de Odoo):
+    odoo-bin shell -d mi_base --no-http
+    >>> from odoo.addons.pharma_dispatch.tools.benchmark_route_lines import run
+    >>> run(env)
+"""
+
+from odoo.addons.nubefact_sunat.tools.benchmark import benchmark_table, measure
+
+
+def _create_orders(env, partner, product, count):
+    """Crea `count` pedidos de venta confirmados"""
+    orders = env['sale.order'].create([{
+        'partner_id': partner.id,
+        'order_line': [(0, 0, {
+            'product_id': product.id,
+            'product_uom_qty': 1,
+            'price_unit': 10.0,
+        })],
+    } for _i in range(count)])
+    orders.action_confirm()
+    return orders
+
+
+def run(env, sizes=(10, 50, 200, 1000), repeat=3):
+    """Ejecuta el benchmark e imprime los resultados"""
+    driver = env['dispatch.driver'].search([], limit=1)
+    vehicle = env['dispatch.vehicle'].search([], limit=1)
+    if not driver or not vehicle:
+        raise ValueError('Se necesita al menos un conductor y un vehículo')
+    
+    with benchmark_table(env) as print_row:
+        partner = env['res.partner'].create({'name': 'Cliente Benchmark Rutas'})
+        product = env['product.product'].create({
+            'name': 'Producto Benchmark Rutas',
+            'default_code': 'BENCH-RUT',
+            'type': 'consu',
+        })
+        
+        for size in sizes:
+            orders = _create_orders(env, partner, product, size)
+            route = env['dispatch.route'].create({
+                'driver_id': driver.id,
+                'vehicle_id': vehicle.id,
+                'line_ids': [(0, 0, {
+                    'order_id': order.id,
+                    'sequence': (index + 1) * 10,
+                }) for index, order in enumerate(orders)],
+            })
+            elapsed, queries, _result = measure(
+                env, route.line_ids._check_order_not_in_other_active_route, repeat
+            )
+            print_row(size, elapsed, queries, elapsed / size)
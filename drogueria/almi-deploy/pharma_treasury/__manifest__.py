@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 {
     'name': 'Gestión de Liquidación y Tesorería Farmacéutica',
-    'version': '18.0.1.0.0',
+    'version': '18.0.1.1.0',
     'category': 'Accounting/Treasury',
     'summary': 'Planillas de reparto, liquidaciones de transportistas y hojas de cobranza',
     'description': """
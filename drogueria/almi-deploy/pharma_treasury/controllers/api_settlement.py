@@ -1,14 +1,22 @@
 # -*- coding: utf-8 -*-
 
+import base64
+import binascii
 import json
 import logging
 from datetime import datetime, timedelta
+from psycopg2.errors import UniqueViolation
 from odoo import http, fields, _
 from odoo.http import request
 from odoo.exceptions import ValidationError, UserError
 
+from ..models.treasury_settlement_sheet import EVIDENCE_MAX_SIZE, EVIDENCE_UPLOAD_DESCRIPTION
+
 _logger = logging.getLogger(__name__)
 
+# Restricción única (planilla, clave de envío) de treasury.settlement
+SUBMISSION_KEY_CONSTRAINT = 'treasury_settlement_sheet_submission_key_unique'
+
 
 class TreasurySettlementAPI(http.Controller):
     """
@@ -16,8 +24,17 @@ class TreasurySettlementAPI(http.Controller):
     Permite consultar rutas y enviar liquidaciones.
     """
     
+    def _get_request_token(self):
+        """Token de API del conductor (encabezado Authorization: Bearer <token>)"""
+        authorization = request.httprequest.headers.get('Authorization') or ''
+        if authorization.startswith('Bearer '):
+            return authorization[7:].strip()
+        return None
+    
     def _authenticate(self):
-        """Verifica la autenticación del usuario"""
+        """Verifica la autenticación: token de API del conductor o sesión de usuario"""
+        if self._get_request_token():
+            return None, 200
         if not request.env.user or request.env.user._is_public():
             return {
                 'error': True,
@@ -26,10 +43,30 @@ class TreasurySettlementAPI(http.Controller):
         return None, 200
     
     def _get_driver_for_user(self):
-        """Obtiene el conductor asociado al usuario actual"""
-        driver = request.env['dispatch.driver'].sudo().search([
-            ('user_id', '=', request.env.user.id)
-        ], limit=1)
+        """
+        Obtiene el conductor del token o, sin token, el asociado al usuario actual.
+        Ambos se resuelven con la caché de dispatch.driver, sin consultar la base.
+        
+        Con token, la petición pasa a ejecutarse como el usuario del conductor
+        (no como el usuario público), para que las liquidaciones, mensajes y
+        actividades queden a su nombre.
+        """
+        token = self._get_request_token()
+        if token:
+            driver = request.env['dispatch.driver']._authenticate_api_token(token)
+            if not driver:
+                return None, {
+                    'error': True,
+                    'message': _('Invalid or expired token')
+                }, 401
+            if not driver.user_id:
+                return None, {
+                    'error': True,
+                    'message': _('The driver has no associated user')
+                }, 403
+            request.update_env(user=driver.user_id.id)
+        else:
+            driver = request.env['dispatch.driver']._get_driver_for_user(request.env.user)
         
         if not driver:
             return None, {
@@ -39,7 +76,7 @@ class TreasurySettlementAPI(http.Controller):
         
         return driver, None, 200
     
-    @http.route('/api/settlement/my_routes', type='json', auth='user', methods=['GET', 'POST'], csrf=False)
+    @http.route('/api/settlement/my_routes', type='json', auth='public', methods=['GET', 'POST'], csrf=False)
     def get_my_routes(self, **kwargs):
         """
         Retorna las rutas asignadas al transportista autenticado.
@@ -107,7 +144,7 @@ class TreasurySettlementAPI(http.Controller):
                 'message': str(e)
             }
     
-    @http.route('/api/settlement/route/<int:route_id>', type='json', auth='user', methods=['GET', 'POST'], csrf=False)
+    @http.route('/api/settlement/route/<int:route_id>', type='json', auth='public', methods=['GET', 'POST'], csrf=False)
     def get_route_detail(self, route_id, **kwargs):
         """
         Retorna el detalle de una ruta con planilla y facturas.
@@ -206,14 +243,178 @@ class TreasurySettlementAPI(http.Controller):
                 'message': str(e)
             }
     
-    @http.route('/api/settlement/submit', type='json', auth='user', methods=['POST'], csrf=False)
+    # ========== ENVÍO DE LIQUIDACIONES ==========
+    
+    def _find_submitted_settlement(self, sheet_id, submission_key):
+        """Liquidación ya enviada con la misma clave para la planilla (o vacío)"""
+        return request.env['treasury.settlement'].sudo().search([
+            ('sheet_id', '=', sheet_id),
+            ('submission_key', '=', submission_key),
+        ], limit=1)
+    
+    def _settlement_result(self, settlement, duplicate=False):
+        """Respuesta del envío de una liquidación"""
+        return {
+            'success': True,
+            'message': _('Settlement already submitted') if duplicate else _('Settlement submitted successfully'),
+            'data': {
+                'settlement_id': settlement.id,
+                'settlement_name': settlement.name,
+                'state': settlement.state,
+                'total_collected': float(settlement.total_collected),
+                'total_to_collect': float(settlement.total_to_collect),
+                'duplicate': duplicate,
+            }
+        }
+    
+    def _decode_evidence(self, evidence_base64):
+        """Bytes de una evidencia en base64 (acepta también data URL)"""
+        if evidence_base64.startswith('data:') and ',' in evidence_base64:
+            evidence_base64 = evidence_base64.split(',', 1)[1]
+        try:
+            data = base64.b64decode(evidence_base64, validate=True)
+        except (binascii.Error, ValueError):
+            raise ValidationError(_('Invalid evidence image'))
+        request.env['treasury.settlement.sheet']._check_evidence_image(data)
+        return data
+    
+    def _get_uploaded_evidences(self, sheet, collections):
+        """Adjuntos subidos con /api/settlement/evidence para la planilla, por id"""
+        attachment_ids = set()
+        for collection in collections:
+            try:
+                if collection.get('evidence_attachment_id'):
+                    attachment_ids.add(int(collection['evidence_attachment_id']))
+            except (TypeError, ValueError):
+                raise ValidationError(_('Invalid evidence attachment'))
+        if not attachment_ids:
+            return {}
+        attachments = request.env['ir.attachment'].sudo().search([
+            ('id', 'in', list(attachment_ids)),
+            ('res_model', '=', 'treasury.settlement.sheet'),
+            ('res_id', '=', sheet.id),
+            ('res_field', '=', False),
+            ('description', '=', EVIDENCE_UPLOAD_DESCRIPTION),
+        ])
+        return {attachment.id: attachment for attachment in attachments}
+    
+    def _attach_evidences(self, lines, evidences):
+        """
+        Guarda la evidencia de cada línea como adjunto de su campo collection_evidence.
+        Las imágenes ya subidas se enlazan a la línea; las enviadas en base64 se
+        decodifican directamente a un adjunto, sin pasar por el campo binario.
+        """
+        vals_list = []
+        for index, evidence, filename in evidences:
+            link = {
+                'res_model': 'treasury.settlement.line',
+                'res_field': 'collection_evidence',
+                'res_id': lines[index].id,
+            }
+            if isinstance(evidence, bytes):
+                vals_list.append(dict(link, name=filename, raw=evidence))
+            else:
+                evidence.write(dict(link, description=False))
+        if vals_list:
+            request.env['ir.attachment'].sudo().create(vals_list)
+        lines.invalidate_recordset(['collection_evidence'])
+    
+    @http.route('/api/settlement/evidence', type='http', auth='public', methods=['POST'], csrf=False)
+    def upload_evidence(self, sheet_id=None, file=None, **kwargs):
+        """
+        Sube una imagen de evidencia antes de enviar la liquidación, para no
+        enviarla en base64 dentro del JSON.
+        
+        Parámetros (multipart/form-data):
+        - sheet_id: ID de la planilla
+        - file: imagen (máximo 5 MB)
+        
+        Las imágenes que ninguna liquidación usa se eliminan al cerrar o
+        cancelar la planilla, o a los 7 días.
+        
+        Retorna attachment_id, que se envía luego en
+        collections[].evidence_attachment_id de /api/settlement/submit
+        """
+        try:
+            # Verificar autenticación
+            auth_error, status = self._authenticate()
+            if auth_error:
+                return request.make_json_response(auth_error, status=status)
+            
+            # Obtener conductor
+            driver, error, status = self._get_driver_for_user()
+            if error:
+                return request.make_json_response(error, status=status)
+            
+            try:
+                sheet = request.env['treasury.settlement.sheet'].sudo().browse(int(sheet_id or 0))
+            except (TypeError, ValueError):
+                sheet = request.env['treasury.settlement.sheet']
+            if not sheet.exists() or sheet.route_id.driver_id.id != driver.id:
+                return request.make_json_response({
+                    'error': True,
+                    'message': _('Invalid settlement sheet')
+                }, status=404)
+            
+            if sheet.state in ('closed', 'cancelled'):
+                return request.make_json_response({
+                    'error': True,
+                    'message': _('The settlement sheet is closed')
+                }, status=400)
+            
+            if not file:
+                return request.make_json_response({
+                    'error': True,
+                    'message': _('file is required')
+                }, status=400)
+            
+            # Leer como máximo un byte más del límite para detectar archivos grandes
+            data = file.read(EVIDENCE_MAX_SIZE + 1)
+            try:
+                sheet._check_evidence_image(data)
+            except ValidationError as e:
+                return request.make_json_response({
+                    'error': True,
+                    'message': str(e)
+                }, status=400)
+            
+            attachment = request.env['ir.attachment'].sudo().create({
+                'name': file.filename or 'evidence.jpg',
+                'raw': data,
+                'res_model': 'treasury.settlement.sheet',
+                'res_id': sheet.id,
+                'description': EVIDENCE_UPLOAD_DESCRIPTION,
+            })
+            
+            return request.make_json_response({
+                'success': True,
+                'data': {
+                    'attachment_id': attachment.id,
+                    'name': attachment.name,
+                }
+            })
+        
+        except Exception as e:
+            _logger.error('Error in upload_evidence: %s', str(e))
+            return request.make_json_response({
+                'error': True,
+                'message': str(e)
+            }, status=500)
+    
+    @http.route('/api/settlement/submit', type='json', auth='public', methods=['POST'], csrf=False)
     def submit_settlement(self, **kwargs):
         """
         Crea liquidación y envía a revisión.
         
+        Un reenvío con la misma submission_key (por ejemplo tras un corte de
+        conexión) no crea otra liquidación: retorna la ya creada con
+        duplicate=true.
+        
         Parámetros esperados:
         - route_id: ID de la ruta
         - sheet_id: ID de la planilla
+        - submission_key: Clave única del envío generada por la app (recomendada;
+          también se acepta en el encabezado Idempotency-Key)
         - driver_notes: Notas del transportista (opcional)
         - collections: Lista de cobros por factura
           [
@@ -223,7 +424,8 @@ class TreasurySettlementAPI(http.Controller):
               "payment_method": str,
               "delivery_status": str,
               "notes": str (opcional),
-              "evidence_base64": str (opcional),
+              "evidence_attachment_id": int (opcional, de /api/settlement/evidence),
+              "evidence_base64": str (opcional, si no se subió antes),
               "latitude": float (opcional),
               "longitude": float (opcional)
             }
@@ -245,6 +447,7 @@ class TreasurySettlementAPI(http.Controller):
             sheet_id = kwargs.get('sheet_id')
             collections = kwargs.get('collections', [])
             driver_notes = kwargs.get('driver_notes', '')
+            submission_key = kwargs.get('submission_key') or request.httprequest.headers.get('Idempotency-Key')
             
             if not route_id or not sheet_id:
                 return {
@@ -274,30 +477,39 @@ class TreasurySettlementAPI(http.Controller):
                     'message': _('Invalid settlement sheet')
                 }
             
-            # Crear liquidación
-            settlement_vals = {
-                'sheet_id': sheet_id,
-                'date': fields.Date.today(),
-                'driver_notes': driver_notes,
-            }
-            settlement = request.env['treasury.settlement'].sudo().create(settlement_vals)
+            # La liquidación queda a nombre del usuario del conductor
+            if request.env.user != driver.user_id:
+                return {
+                    'error': True,
+                    'message': _('Settlements must be submitted by the driver user')
+                }
+            
+            # Reenvío del mismo envío: retornar la liquidación ya creada
+            if submission_key:
+                settlement = self._find_submitted_settlement(sheet_id, submission_key)
+                if settlement:
+                    return self._settlement_result(settlement, duplicate=True)
             
-            # Crear líneas de liquidación
+            # Línea de planilla por factura (una sola pasada)
+            sheet_line_by_invoice = {line.invoice_id.id: line for line in sheet.line_ids}
+            uploaded_evidences = self._get_uploaded_evidences(sheet, collections)
+            
+            # Preparar las líneas de liquidación y sus evidencias
+            line_vals_list = []
+            evidences = []
             for collection in collections:
                 invoice_id = collection.get('invoice_id')
                 
                 if not invoice_id:
                     continue
                 
-                # Buscar línea de planilla
-                sheet_line = sheet.line_ids.filtered(lambda l: l.invoice_id.id == invoice_id)
+                sheet_line = sheet_line_by_invoice.get(invoice_id)
                 
                 if not sheet_line:
                     _logger.warning(f'Invoice {invoice_id} not found in sheet {sheet_id}')
                     continue
                 
                 line_vals = {
-                    'settlement_id': settlement.id,
                     'sheet_line_id': sheet_line.id,
                     'invoice_id': invoice_id,
                     'amount_invoice': collection.get('amount_invoice', sheet_line.amount_total),
@@ -313,27 +525,49 @@ class TreasurySettlementAPI(http.Controller):
                     line_vals['latitude'] = collection.get('latitude')
                     line_vals['longitude'] = collection.get('longitude')
                 
-                # Agregar evidencia si está disponible
-                if collection.get('evidence_base64'):
-                    line_vals['collection_evidence'] = collection.get('evidence_base64')
-                    line_vals['collection_evidence_filename'] = f'evidence_{invoice_id}.jpg'
+                # Evidencia: adjunto ya subido o imagen en base64
+                if collection.get('evidence_attachment_id'):
+                    attachment = uploaded_evidences.get(int(collection['evidence_attachment_id']))
+                    if not attachment:
+                        raise ValidationError(_('Invalid evidence attachment for invoice %s') % invoice_id)
+                    evidences.append((len(line_vals_list), attachment, attachment.name))
+                    line_vals['collection_evidence_filename'] = attachment.name
+                elif collection.get('evidence_base64'):
+                    filename = f'evidence_{invoice_id}.jpg'
+                    evidences.append((len(line_vals_list), self._decode_evidence(collection['evidence_base64']), filename))
+                    line_vals['collection_evidence_filename'] = filename
                 
-                request.env['treasury.settlement.line'].sudo().create(line_vals)
-            
-            # Enviar para revisión
-            settlement.sudo().action_submit_for_review()
+                line_vals_list.append(line_vals)
             
-            return {
-                'success': True,
-                'message': _('Settlement submitted successfully'),
-                'data': {
-                    'settlement_id': settlement.id,
-                    'settlement_name': settlement.name,
-                    'state': settlement.state,
-                    'total_collected': float(settlement.total_collected),
-                    'total_to_collect': float(settlement.total_to_collect),
+            try:
+                with request.env.cr.savepoint():
+                    # Crear liquidación y sus líneas en lote
+                    settlement = request.env['treasury.settlement'].sudo().create({
+                        'sheet_id': sheet_id,
+                        'date': fields.Date.today(),
+                        'driver_notes': driver_notes,
+                        'submission_key': submission_key or False,
+                    })
+                    lines = request.env['treasury.settlement.line'].sudo().create([
+                        dict(line_vals, settlement_id=settlement.id) for line_vals in line_vals_list
+                    ])
+                    self._attach_evidences(lines, evidences)
+                    
+                    # Enviar para revisión
+                    settlement.action_submit_for_review()
+            except UniqueViolation as e:
+                if e.diag.constraint_name != SUBMISSION_KEY_CONSTRAINT:
+                    raise
+                # Otro envío con la misma clave se confirmó al mismo tiempo. Esta
+                # transacción no lo ve (su instantánea es anterior): la app debe
+                # reintentar y recibirá la liquidación ya creada como duplicada
+                return {
+                    'error': True,
+                    'retry': True,
+                    'message': _('Settlement is being submitted by another request, retry')
                 }
-            }
+            
+            return self._settlement_result(settlement)
             
         except ValidationError as e:
             _logger.error('Validation error in submit_settlement: %s', str(e))
@@ -348,7 +582,7 @@ class TreasurySettlementAPI(http.Controller):
                 'message': str(e)
             }
     
-    @http.route('/api/settlement/status/<int:settlement_id>', type='json', auth='user', methods=['GET', 'POST'], csrf=False)
+    @http.route('/api/settlement/status/<int:settlement_id>', type='json', auth='public', methods=['GET', 'POST'], csrf=False)
     def get_settlement_status(self, settlement_id, **kwargs):
         """
         Consulta el estado de una liquidación.
@@ -22,7 +22,12 @@ class AccountMove(models.Model):
     settlement_sheet_line_id = fields.Many2one(
         'treasury.settlement.sheet.line',
         string='Línea de Planilla',
-        help='Línea específica de planilla'
+        readonly=True,
+        copy=False,
+        index='btree_not_null',
+        ondelete='set null',
+        help='Línea de la planilla activa en la que está la factura '
+             '(la mantienen las líneas y los cambios de estado de la planilla)'
     )
     
     in_settlement = fields.Boolean(
@@ -108,14 +113,11 @@ class AccountMove(models.Model):
             else:
                 move.settlement_sheet_id = False
     
-    @api.depends('settlement_sheet_id', 'settlement_sheet_id.state')
+    @api.depends('settlement_sheet_line_id')
     def _compute_in_settlement(self):
         """Verifica si está en una planilla activa"""
         for move in self:
-            move.in_settlement = bool(
-                move.settlement_sheet_id and 
-                move.settlement_sheet_id.state not in ['cancelled', 'closed']
-            )
+            move.in_settlement = bool(move.settlement_sheet_line_id)
     
     @api.depends('amount_collected', 'amount_total')
     def _compute_collection_status(self):
@@ -134,6 +136,30 @@ class AccountMove(models.Model):
         for move in self:
             move.collection_sheet_count = len(move.collection_sheet_ids)
     
+    def _get_sale_order_ids_by_invoice(self):
+        """
+        Resuelve factura → pedido de venta para todo el lote con una sola
+        consulta agrupada (a través de sale_line_ids de las líneas de factura).
+        Si una factura tiene varios pedidos, se toma el más reciente.
+        
+        Returns:
+            {id de factura: id de pedido}, solo para las facturas con pedido
+        """
+        invoice_ids = tuple(set(self._origin.ids))
+        if not invoice_ids:
+            return {}
+        self.env['sale.order.line'].flush_model(['order_id', 'invoice_lines'])
+        self.env['account.move.line'].flush_model(['move_id'])
+        self.env.cr.execute("""
+            SELECT aml.move_id, max(sol.order_id)
+            FROM account_move_line aml
+            JOIN sale_order_line_invoice_rel rel ON rel.invoice_line_id = aml.id
+            JOIN sale_order_line sol ON sol.id = rel.order_line_id
+            WHERE aml.move_id IN %s
+            GROUP BY aml.move_id
+        """, (invoice_ids,))
+        return dict(self.env.cr.fetchall())
+    
     def action_view_settlement_sheet(self):
         """Ver planilla de reparto"""
         self.ensure_one()
@@ -266,17 +292,7 @@ class TreasuryAddInvoiceToSheetWizard(models.TransientModel):
         """Agrega la factura a la planilla"""
         self.ensure_one()
         
-        # Obtener última secuencia
-        last_sequence = 0
-        if self.sheet_id.line_ids:
-            last_sequence = max(self.sheet_id.line_ids.mapped('sequence'))
-        
-        # Crear línea
-        self.env['treasury.settlement.sheet.line'].create({
-            'sheet_id': self.sheet_id.id,
-            'invoice_id': self.invoice_id.id,
-            'sequence': last_sequence + 10,
-        })
+        self.sheet_id._add_invoices(self.invoice_id)
         
         return {'type': 'ir.actions.act_window_close'}
 
@@ -2,6 +2,13 @@
 
 from odoo import api, fields, models, _
 from odoo.exceptions import UserError
+from odoo.tools import SQL
+
+# Facturas disponibles por página del wizard
+PAGE_SIZE = 80
+
+# Tope de facturas disponibles que el wizard cuenta y permite seleccionar
+MAX_AVAILABLE_INVOICES = 2000
 
 
 class TreasuryInvoiceSelectionWizard(models.TransientModel):
@@ -93,7 +100,7 @@ class TreasuryInvoiceSelectionWizard(models.TransientModel):
         'invoice_id',
         string='Facturas Disponibles',
         compute='_compute_available_invoices',
-        help='Facturas que coinciden con los filtros'
+        help='Página actual de las facturas que coinciden con los filtros'
     )
     
     selected_invoice_ids = fields.Many2many(
@@ -108,7 +115,14 @@ class TreasuryInvoiceSelectionWizard(models.TransientModel):
     # ========== ESTADÍSTICAS ==========
     total_available = fields.Integer(
         string='Total Disponibles',
-        compute='_compute_stats'
+        compute='_compute_total_available',
+        help=f'Facturas que coinciden con los filtros (se cuentan hasta {MAX_AVAILABLE_INVOICES})'
+    )
+    
+    available_capped = fields.Boolean(
+        string='Demasiadas Facturas',
+        compute='_compute_total_available',
+        help=f'Hay más de {MAX_AVAILABLE_INVOICES} facturas: se deben ajustar los filtros'
     )
     
     total_selected = fields.Integer(
@@ -122,72 +136,134 @@ class TreasuryInvoiceSelectionWizard(models.TransientModel):
         currency_field='currency_id'
     )
     
+    # ========== PAGINACIÓN ==========
+    page = fields.Integer(
+        string='Página',
+        default=1,
+        help=f'Página de facturas disponibles ({PAGE_SIZE} por página)'
+    )
+    
+    page_count = fields.Integer(
+        string='Páginas',
+        compute='_compute_total_available'
+    )
+    
+    def _get_invoice_domain(self):
+        """Dominio de facturas según los filtros del wizard"""
+        self.ensure_one()
+        domain = [
+            ('move_type', '=', 'out_invoice'),
+            ('state', '=', 'posted'),
+        ]
+        
+        # Filtro de fecha
+        if self.date_from:
+            domain.append(('invoice_date', '>=', self.date_from))
+        if self.date_to:
+            domain.append(('invoice_date', '<=', self.date_to))
+        
+        # Filtro de clientes
+        if self.partner_ids:
+            domain.append(('partner_id', 'in', self.partner_ids.ids))
+        
+        # Filtro de zonas
+        if self.zone_ids:
+            domain.append(('partner_id.sale_zone_id', 'in', self.zone_ids.ids))
+        
+        # Filtro de vendedores
+        if self.salesperson_ids:
+            domain.append(('invoice_user_id', 'in', self.salesperson_ids.ids))
+        
+        # Filtro de estado de pago
+        if self.payment_state != 'all':
+            domain.append(('payment_state', '=', self.payment_state))
+        
+        # Filtro de estado SUNAT (si el campo existe)
+        if self.sunat_estado != 'all':
+            domain.append(('sunat_estado', '=', self.sunat_estado))
+        
+        # Filtro de montos
+        if self.amount_min:
+            domain.append(('amount_total', '>=', self.amount_min))
+        if self.amount_max:
+            domain.append(('amount_total', '<=', self.amount_max))
+        
+        return domain
+    
+    def _get_invoice_query(self, offset=0, limit=None, order=None):
+        """
+        Consulta de facturas disponibles: las que cumplen los filtros y no
+        están en una planilla activa (referencia indexada en la factura).
+        """
+        self.ensure_one()
+        return self.env['account.move']._search(
+            self._get_invoice_domain() + [('settlement_sheet_line_id', '=', False)],
+            offset=offset, limit=limit, order=order
+        )
+    
     @api.depends('date_from', 'date_to', 'partner_ids', 'zone_ids', 
                  'salesperson_ids', 'payment_state', 'sunat_estado',
-                 'amount_min', 'amount_max')
+                 'amount_min', 'amount_max', 'page')
     def _compute_available_invoices(self):
-        """Calcula las facturas disponibles según los filtros"""
+        """Calcula solo la página actual de facturas disponibles según los filtros"""
         for wizard in self:
-            domain = [
-                ('move_type', '=', 'out_invoice'),
-                ('state', '=', 'posted'),
-            ]
-            
-            # Filtro de fecha
-            if wizard.date_from:
-                domain.append(('invoice_date', '>=', wizard.date_from))
-            if wizard.date_to:
-                domain.append(('invoice_date', '<=', wizard.date_to))
-            
-            # Filtro de clientes
-            if wizard.partner_ids:
-                domain.append(('partner_id', 'in', wizard.partner_ids.ids))
-            
-            # Filtro de zonas
-            if wizard.zone_ids:
-                domain.append(('partner_id.sale_zone_id', 'in', wizard.zone_ids.ids))
-            
-            # Filtro de vendedores
-            if wizard.salesperson_ids:
-                domain.append(('invoice_user_id', 'in', wizard.salesperson_ids.ids))
-            
-            # Filtro de estado de pago
-            if wizard.payment_state != 'all':
-                domain.append(('payment_state', '=', wizard.payment_state))
-            
-            # Filtro de estado SUNAT (si el campo existe)
-            if wizard.sunat_estado != 'all':
-                domain.append(('sunat_estado', '=', wizard.sunat_estado))
-            
-            # Filtro de montos
-            if wizard.amount_min:
-                domain.append(('amount_total', '>=', wizard.amount_min))
-            if wizard.amount_max:
-                domain.append(('amount_total', '<=', wizard.amount_max))
-            
-            # Excluir facturas que ya están en planillas activas
-            existing_invoice_ids = self.env['treasury.settlement.sheet.line'].search([
-                ('sheet_id.state', 'not in', ['cancelled', 'closed'])
-            ]).mapped('invoice_id').ids
-            
-            if existing_invoice_ids:
-                domain.append(('id', 'not in', existing_invoice_ids))
-            
-            invoices = self.env['account.move'].search(domain, order='invoice_date desc')
-            wizard.invoice_ids = invoices
+            page = max(wizard.page or 1, 1)
+            offset = (page - 1) * PAGE_SIZE
+            if offset >= MAX_AVAILABLE_INVOICES:
+                wizard.invoice_ids = False
+                continue
+            query = wizard._get_invoice_query(
+                offset=offset,
+                limit=min(PAGE_SIZE, MAX_AVAILABLE_INVOICES - offset),
+                order='invoice_date desc, id desc',
+            )
+            wizard.invoice_ids = self.env['account.move'].browse(tuple(query))
     
-    @api.depends('invoice_ids', 'selected_invoice_ids')
+    @api.depends('date_from', 'date_to', 'partner_ids', 'zone_ids',
+                 'salesperson_ids', 'payment_state', 'sunat_estado',
+                 'amount_min', 'amount_max')
+    def _compute_total_available(self):
+        """
+        Cuenta las facturas disponibles sin cargarlas. El conteo se detiene
+        en el tope, así el costo no depende de cuántas facturas existan.
+        """
+        for wizard in self:
+            query = wizard._get_invoice_query(limit=MAX_AVAILABLE_INVOICES + 1)
+            self.env.cr.execute(SQL("SELECT COUNT(*) FROM (%s) AS capped", query.select()))
+            count = self.env.cr.fetchone()[0]
+            wizard.available_capped = count > MAX_AVAILABLE_INVOICES
+            wizard.total_available = min(count, MAX_AVAILABLE_INVOICES)
+            wizard.page_count = max(-(-wizard.total_available // PAGE_SIZE), 1)
+    
+    @api.depends('selected_invoice_ids')
     def _compute_stats(self):
-        """Calcula estadísticas de las facturas"""
+        """Calcula estadísticas de las facturas seleccionadas"""
         for wizard in self:
-            wizard.total_available = len(wizard.invoice_ids)
             wizard.total_selected = len(wizard.selected_invoice_ids)
             wizard.total_amount_selected = sum(wizard.selected_invoice_ids.mapped('amount_total'))
     
+    @api.onchange('date_from', 'date_to', 'partner_ids', 'zone_ids',
+                  'salesperson_ids', 'payment_state', 'sunat_estado',
+                  'amount_min', 'amount_max')
+    def _onchange_filters(self):
+        """Al cambiar los filtros se vuelve a la primera página"""
+        self.page = 1
+    
     def action_select_all(self):
-        """Selecciona todas las facturas disponibles"""
+        """Selecciona todas las facturas disponibles (no solo la página actual)"""
+        self.ensure_one()
+        if self.available_capped:
+            raise UserError(_(
+                'Hay más de %s facturas disponibles. Ajuste los filtros para seleccionarlas.'
+            ) % MAX_AVAILABLE_INVOICES)
+        query = self._get_invoice_query(limit=MAX_AVAILABLE_INVOICES)
+        self.selected_invoice_ids = [(6, 0, list(query))]
+        return self._reopen_wizard()
+    
+    def action_select_page(self):
+        """Agrega a la selección las facturas de la página actual"""
         self.ensure_one()
-        self.selected_invoice_ids = [(6, 0, self.invoice_ids.ids)]
+        self.selected_invoice_ids = [(4, invoice_id) for invoice_id in self.invoice_ids.ids]
         return self._reopen_wizard()
     
     def action_clear_selection(self):
@@ -197,10 +273,21 @@ class TreasuryInvoiceSelectionWizard(models.TransientModel):
         return self._reopen_wizard()
     
     def action_apply_filters(self):
-        """Re-aplica los filtros (re-calcula invoice_ids)"""
+        """Re-aplica los filtros desde la primera página"""
         self.ensure_one()
-        # Forzar re-cálculo
-        self._compute_available_invoices()
+        self.page = 1
+        return self._reopen_wizard()
+    
+    def action_next_page(self):
+        """Muestra la siguiente página de facturas disponibles"""
+        self.ensure_one()
+        self.page = min((self.page or 1) + 1, self.page_count)
+        return self._reopen_wizard()
+    
+    def action_previous_page(self):
+        """Muestra la página anterior de facturas disponibles"""
+        self.ensure_one()
+        self.page = max((self.page or 1) - 1, 1)
         return self._reopen_wizard()
     
     def action_add_to_sheet(self):
@@ -210,31 +297,12 @@ class TreasuryInvoiceSelectionWizard(models.TransientModel):
         if not self.selected_invoice_ids:
             raise UserError(_('Debe seleccionar al menos una factura.'))
         
-        if self.sheet_id.state != 'draft':
-            raise UserError(_(
-                'Solo se pueden agregar facturas a planillas en estado Borrador.'
-            ))
-        
-        # Obtener la última secuencia
-        last_sequence = 0
-        if self.sheet_id.line_ids:
-            last_sequence = max(self.sheet_id.line_ids.mapped('sequence'))
-        
-        # Crear líneas para cada factura seleccionada
-        lines_created = 0
-        for invoice in self.selected_invoice_ids:
-            last_sequence += 10
-            self.env['treasury.settlement.sheet.line'].create({
-                'sheet_id': self.sheet_id.id,
-                'invoice_id': invoice.id,
-                'sequence': last_sequence,
-            })
-            lines_created += 1
+        lines = self.sheet_id._add_invoices(self.selected_invoice_ids)
         
         # Mensaje de éxito
         self.sheet_id.message_post(
             body=_('Se agregaron %s facturas a la planilla por un total de %s') % (
-                lines_created,
+                len(lines),
                 self.total_amount_selected
             )
         )
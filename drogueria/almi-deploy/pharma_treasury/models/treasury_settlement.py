@@ -209,6 +209,19 @@ class TreasurySettlement(models.Model):
         required=True
     )
     
+    submission_key = fields.Char(
+        string='Clave de Envío',
+        readonly=True,
+        copy=False,
+        help='Clave única del envío desde la app móvil: un reenvío con la misma '
+             'clave retorna esta liquidación en lugar de crear otra'
+    )
+    
+    _sql_constraints = [
+        ('sheet_submission_key_unique', 'UNIQUE(sheet_id, submission_key)',
+         'Ya existe una liquidación de esta planilla con la misma clave de envío.')
+    ]
+    
     @api.model
     def create(self, vals):
         """Genera número secuencial al crear"""
@@ -1,8 +1,18 @@
 # -*- coding: utf-8 -*-
 
+import logging
+
 from odoo import api, fields, models, _
 from odoo.exceptions import ValidationError
 
+_logger = logging.getLogger(__name__)
+
+# Estados de planilla en los que sus facturas quedan libres para otra planilla
+INACTIVE_SHEET_STATES = ('cancelled', 'closed')
+
+# Facturas que se listan en los mensajes de error de un lote
+MAX_ERROR_INVOICES = 10
+
 
 class TreasurySettlementSheetLine(models.Model):
     """
@@ -195,16 +205,10 @@ class TreasurySettlementSheetLine(models.Model):
     
     @api.depends('invoice_id')
     def _compute_sale_order(self):
-        """Obtiene el pedido de venta relacionado con la factura"""
+        """Obtiene el pedido de venta de las facturas de todas las líneas con una sola consulta"""
+        order_by_invoice = self.invoice_id._get_sale_order_ids_by_invoice()
         for line in self:
-            if line.invoice_id:
-                # Buscar el pedido de venta a través de invoice_line_ids
-                sale_order = self.env['sale.order'].search([
-                    ('invoice_ids', 'in', line.invoice_id.ids)
-                ], limit=1)
-                line.sale_order_id = sale_order
-            else:
-                line.sale_order_id = False
+            line.sale_order_id = order_by_invoice.get(line.invoice_id._origin.id, False)
     
     @api.depends('amount_total', 'amount_collected')
     def _compute_collection_status(self):
@@ -217,33 +221,121 @@ class TreasurySettlementSheetLine(models.Model):
             else:
                 line.collection_status = 'partial'
     
+    def init(self):
+        # Una factura solo puede estar en una planilla activa
+        index_name = 'treasury_settlement_sheet_line_invoice_active_uniq'
+        self.env.cr.execute("""
+            SELECT 1 FROM treasury_settlement_sheet_line
+            WHERE sheet_state NOT IN %s
+            GROUP BY invoice_id
+            HAVING count(*) > 1
+            LIMIT 1
+        """, (INACTIVE_SHEET_STATES,))
+        if self.env.cr.fetchone():
+            _logger.error(
+                f"❌ No se creó el índice {index_name}: hay facturas en más de una planilla "
+                f"activa. Corrija las planillas duplicadas y actualice el módulo."
+            )
+            return
+        self.env.cr.execute(f"""
+            CREATE UNIQUE INDEX IF NOT EXISTS {index_name}
+            ON treasury_settlement_sheet_line (invoice_id)
+            WHERE sheet_state NOT IN ('cancelled', 'closed')
+        """)
+    
+    # ========== LÍNEA ACTIVA DE LA FACTURA ==========
+    
+    @api.model_create_multi
+    def create(self, vals_list):
+        lines = super().create(vals_list)
+        lines._sync_invoice_active_line()
+        return lines
+    
+    def write(self, vals):
+        result = super().write(vals)
+        if 'invoice_id' in vals or 'sheet_id' in vals:
+            self._sync_invoice_active_line()
+        return result
+    
+    def unlink(self):
+        self._sync_invoice_active_line(unlinking=True)
+        return super().unlink()
+    
+    def _sync_invoice_active_line(self, unlinking=False):
+        """
+        Actualiza en las facturas la referencia a su línea de planilla activa
+        (account.move.settlement_sheet_line_id), con dos consultas para todo
+        el lote: libera las facturas cuya línea ya no está activa y asigna
+        las líneas activas.
+        """
+        if not self:
+            return
+        self.flush_model(['invoice_id', 'sheet_state'])
+        self.env['account.move'].flush_model(['settlement_sheet_line_id'])
+        
+        self.env.cr.execute("""
+            UPDATE account_move move
+            SET settlement_sheet_line_id = NULL
+            FROM treasury_settlement_sheet_line line
+            WHERE move.settlement_sheet_line_id = line.id
+              AND line.id IN %s
+              AND (%s OR line.invoice_id != move.id OR line.sheet_state IN %s)
+            RETURNING move.id
+        """, (tuple(self.ids), unlinking, INACTIVE_SHEET_STATES))
+        move_ids = [row[0] for row in self.env.cr.fetchall()]
+        
+        if not unlinking:
+            self.env.cr.execute("""
+                UPDATE account_move move
+                SET settlement_sheet_line_id = line.id
+                FROM treasury_settlement_sheet_line line
+                WHERE move.id = line.invoice_id
+                  AND line.id IN %s
+                  AND line.sheet_state NOT IN %s
+                  AND move.settlement_sheet_line_id IS DISTINCT FROM line.id
+                RETURNING move.id
+            """, (tuple(self.ids), INACTIVE_SHEET_STATES))
+            move_ids += [row[0] for row in self.env.cr.fetchall()]
+        
+        if move_ids:
+            # Recalcular la planilla y el indicador guardados en las facturas
+            moves = self.env['account.move'].browse(set(move_ids))
+            moves.invalidate_recordset(['settlement_sheet_line_id'])
+            moves.modified(['settlement_sheet_line_id'])
+    
+    def _check_invoice_not_in_other_sheet(self):
+        """Valida que la factura no esté ya en la línea de otra planilla activa"""
+        for line in self:
+            active_line = line.invoice_id.settlement_sheet_line_id
+            if active_line and active_line != line:
+                raise ValidationError(_(
+                    'La factura %s ya está incluida en la planilla %s. '
+                    'Una factura no puede estar en múltiples planillas activas.'
+                ) % (line.invoice_name, active_line.sheet_id.name))
+    
     @api.constrains('invoice_id', 'sheet_id')
     def _check_invoice_unique(self):
-        """Valida que una factura no esté en múltiples planillas activas"""
-        for line in self:
-            if line.sheet_id.state not in ['cancelled']:
-                # Buscar otras planillas activas con la misma factura
-                other_lines = self.search([
-                    ('id', '!=', line.id),
-                    ('invoice_id', '=', line.invoice_id.id),
-                    ('sheet_id.state', 'not in', ['cancelled', 'closed'])
-                ])
-                
-                if other_lines:
-                    raise ValidationError(_(
-                        'La factura %s ya está incluida en la planilla %s. '
-                        'Una factura no puede estar en múltiples planillas activas.'
-                    ) % (line.invoice_name, other_lines[0].sheet_id.name))
+        """
+        Valida que una factura no esté en múltiples planillas activas.
+        Usa la referencia guardada en la factura (sin búsquedas); el índice
+        único parcial lo garantiza también entre transacciones simultáneas.
+        """
+        self.filtered(
+            lambda line: line.sheet_state not in INACTIVE_SHEET_STATES
+        )._check_invoice_not_in_other_sheet()
     
     @api.constrains('invoice_id')
     def _check_invoice_state(self):
-        """Valida que la factura esté confirmada"""
-        for line in self:
-            if line.invoice_id.state != 'posted':
-                raise ValidationError(_(
-                    'Solo se pueden agregar facturas confirmadas (posted) a la planilla. '
-                    'Estado actual de %s: %s'
-                ) % (line.invoice_name, line.invoice_id.state))
+        """Valida que las facturas estén confirmadas (un solo error para todo el lote)"""
+        invalid = self.filtered(lambda line: line.invoice_id.state != 'posted')
+        if invalid:
+            raise ValidationError(_(
+                'Solo se pueden agregar facturas confirmadas (posted) a la planilla. '
+                'Facturas no confirmadas: %s'
+            ) % ', '.join(
+                f"{line.invoice_name or line.invoice_id.display_name} ({line.invoice_id.state})"
+                for line in invalid[:MAX_ERROR_INVOICES]
+            ))
     
     @api.constrains('amount_collected')
     def _check_amount_collected(self):